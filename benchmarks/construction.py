@@ -0,0 +1,56 @@
+#!/usr/bin/env python2
+
+"""Cost of creating emulators and running short methods with them.
+
+Usage:
+    construction.py [-n count]
+
+Options:
+    -h --help     Show this screen.
+    -n <count>    Number of emulators created by every benchmark [default: 10000].
+"""
+
+from __future__ import print_function
+
+import time
+
+from docopt import docopt
+from smali.emulator import Emulator
+from smali.loader import ClassLoader, SmaliClass
+
+SOURCE = """
+.class public Lbench/Construction;
+.super Ljava/lang/Object;
+
+.method public static twice(I)I
+    .locals 1
+
+    add-int v0, p0, p0
+
+    return v0
+.end method
+""".split('\n')
+
+
+def measure(name, count, function):
+    s = time.time()
+    for i in range(count):
+        function(i)
+    elapsed = time.time() - s
+    print("%-12s %10.2f us per call  ( %d calls )" % (name, elapsed * 1e6 / count, count))
+
+
+def main(arguments):
+    count = int(arguments['-n'])
+    loader = ClassLoader()
+    method = SmaliClass(list(SOURCE)).method('twice')
+    emulator = Emulator(exit=False, loader=loader)
+    emulator.run_method(method, {'p0': 1})  # the method is decoded once, by the first run
+
+    measure('construct', count, lambda i: Emulator(exit=False, loader=loader))
+    measure('new+run', count, lambda i: Emulator(exit=False, loader=loader).run_method(method, {'p0': i}))
+    measure('reuse+run', count, lambda i: emulator.run_method(method, {'p0': i}))
+
+
+if __name__ == '__main__':
+    main(docopt(__doc__))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python2
+
+"""Latency of the emulator daemon against a new process per call.
+
+Usage:
+    daemon_latency.py [-r requests] [-s spawns]
+
+Options:
+    -h --help        Show this screen.
+    -r <requests>    Number of requests sent to the daemon [default: 1000].
+    -s <spawns>      Number of exec.py processes to spawn [default: 10].
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+
+from docopt import docopt
+from smali.client import Client
+from smali.server import Daemon
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DECRYPTOR = os.path.join(ROOT, 'utils', 'decryptor.smali')
+ARGS = {'p0': [-62, -99, -106, -125, -123, -105, -98, -37, -105, -97, -103, -41,
+               -118, -97, -113, -103, -109, -104, -115, 111, 98, 103, 35, 52], 'p1': 19}
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return dict((p, samples[min(len(samples) - 1, len(samples) * p // 100)] * 1000) for p in (50, 90, 99))
+
+
+def report(name, samples):
+    p = percentiles(samples)
+    print("%-8s p50 %8.3f ms  p90 %8.3f ms  p99 %8.3f ms  ( %d calls )" % (name, p[50], p[90], p[99], len(samples)))
+
+
+def bench_daemon(requests):
+    directory = tempfile.mkdtemp()
+    daemon = Daemon(os.path.join(directory, 'smali.sock'), workers=1)
+    thread = threading.Thread(target=daemon.serve_forever)
+    thread.start()
+    try:
+        samples = []
+        with Client(daemon.address) as client:
+            for i in range(requests):
+                s = time.time()
+                response = client.run_file(DECRYPTOR, 'field5', ARGS)
+                samples.append(time.time() - s)
+                assert 'result' in response, response
+        return samples
+    finally:
+        daemon.shutdown()
+        thread.join()
+        shutil.rmtree(directory)
+
+
+def bench_spawn(spawns):
+    env = dict(os.environ, PYTHONPATH=os.path.join(ROOT, 'src'))
+    command = [sys.executable, os.path.join(ROOT, 'utils', 'exec.py'),
+               '-i', DECRYPTOR, '-m', 'field5', '-p', json.dumps(ARGS)]
+    samples = []
+    for i in range(spawns):
+        s = time.time()
+        subprocess.check_output(command, env=env)
+        samples.append(time.time() - s)
+    return samples
+
+
+def main(arguments):
+    report('spawn', bench_spawn(int(arguments['-s'])))
+    report('daemon', bench_daemon(int(arguments['-r'])))
+
+
+if __name__ == '__main__':
+    main(docopt(__doc__))
@@ -0,0 +1,414 @@
+#!/usr/bin/env python2
+
+"""Performance suite of the emulator, with a baseline to detect regressions.
+
+Usage:
+    suite.py [-b benchmarks] [-r repeats] [-s scale] [-o output] [-c baseline] [-t threshold]
+    suite.py --peak <benchmark> [-s scale]
+
+Options:
+    -h --help           Show this screen.
+    -b <benchmarks>     Comma separated names of the benchmarks to run, all of them if not given.
+    -r <repeats>        Number of runs of every benchmark, the median one is reported [default: 15].
+    -s <scale>          Multiplier of the iterations of the loops [default: 1].
+    -o <output>         Write the results to this JSON file, to be used as a baseline.
+    -c <baseline>       Compare the results with this JSON file and fail on regressions.
+    -t <threshold>      Tolerated slowdown, as a ratio minus one, of the execution and of the
+                        preprocessing before a run is considered a regression [default: 1.0].
+    --peak <benchmark>  Print the peak memory of a single run of a benchmark, in KiB.
+
+Timings vary a lot between runs on a loaded machine, the medians of two runs of the suite were
+up to 1.9 times apart on the one the baseline was recorded on, so the threshold only catches
+large regressions. The baseline is meant to be recorded once, on the machine and with
+the interpreter the suite is compared on, and recorded again only when a change is expected to
+move the results, not to make a failing comparison pass. The peak memory of every benchmark is
+measured in a new process, so that it doesn't depend on what ran before it.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+from collections import OrderedDict
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from docopt import docopt
+from smali import vectorize
+from smali.emulator import Emulator
+from smali.loader import SmaliClass
+from smali.source import get_source_from_file
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DECRYPTOR = os.path.join(ROOT, 'utils', 'decryptor.smali')
+DECRYPTOR_ARGS = {'p0': [-62, -99, -106, -125, -123, -105, -98, -37, -105, -97, -103, -41,
+                         -118, -97, -113, -103, -109, -104, -115, 111, 98, 103, 35, 52], 'p1': 19}
+
+# Preprocessing times below this many milliseconds are too short to be compared.
+PREPROC_NOISE = 1.0
+
+# Growth of the peak memory below this many KiB is too small to be compared.
+PEAK_NOISE = 512
+
+# Tolerated growth of the peak memory, which doesn't vary much between runs.
+PEAK_THRESHOLD = 0.25
+
+
+def method(body, locals_count, helpers=()):
+    """
+    Source of a class with a static run(I)I method, its parameter is the iterations count.
+    :param body: Lines of the method, after the .locals directive.
+    :param locals_count: Number of local registers.
+    :param helpers: Lines of other methods of the class.
+    :return: The list of lines.
+    """
+    lines = ['.class public Lbench/Bench;', '.super Ljava/lang/Object;', '',
+             '.method public static run(I)I', '    .locals %d' % locals_count]
+    lines.extend('    ' + line for line in body)
+    lines.append('.end method')
+    lines.extend(helpers)
+    return lines
+
+
+def loop(body, locals_count, helpers=()):
+    """A run(I)I method repeating a body p0 times, v0 is the counter and v1 the result."""
+    return method(['const/4 v0, 0x0', 'const/4 v1, 0x0', ':loop_0', 'if-ge v0, p0, :end_0'] + body +
+                  ['add-int/lit8 v0, v0, 0x1', 'goto :loop_0', ':end_0', 'return v1'], locals_count, helpers)
+
+
+def bench_moves():
+    return loop(['const/16 v2, 0x2a', 'move v3, v2', 'const-string v4, "bench"', 'move-object v5, v4',
+                 'move v1, v3'], 6), 20000
+
+
+def bench_arithmetic():
+    return loop(['add-int v2, v1, v0', 'sub-int v2, v2, v0', 'mul-int/lit8 v2, v2, 0x3', 'xor-int/lit8 v2, v2, 0x55',
+                 'and-int/lit16 v2, v2, 0xfff', 'or-int v2, v2, v0', 'rem-int/lit8 v3, v2, 0x7',
+                 'shl-int/lit8 v3, v3, 0x2', 'add-int v1, v1, v3', 'and-int/lit16 v1, v1, 0x7fff'], 4), 20000
+
+
+def bench_branches():
+    return loop(['rem-int/lit8 v2, v0, 0x4', 'if-eqz v2, :zero_0', 'if-lez v2, :zero_0', 'if-gt v2, v0, :zero_0',
+                 'if-ne v2, v0, :zero_0', 'add-int/lit8 v1, v1, 0x1', ':zero_0'], 3), 30000
+
+
+def bench_arrays():
+    return method(['new-array v2, p0, [I', 'const/4 v0, 0x0', ':fill_0', 'if-ge v0, p0, :sum_0', 'aput v0, v2, v0',
+                   'add-int/lit8 v0, v0, 0x1', 'goto :fill_0', ':sum_0', 'const/4 v0, 0x0', 'const/4 v1, 0x0',
+                   'array-length v3, v2', ':loop_0', 'if-ge v0, v3, :end_0', 'aget v4, v2, v0',
+                   'add-int v1, v1, v4', 'add-int/lit8 v0, v0, 0x1', 'goto :loop_0', ':end_0', 'return v1'], 5), 20000
+
+
+def bench_invoke():
+    helper = ['', '.method public static helper(II)I', '    .locals 1', '    add-int v0, p0, p1',
+              '    return v0', '.end method']
+    return loop(['invoke-static {v1, v0}, Lbench/Bench;->helper(II)I', 'move-result v1'], 2, helper), 10000
+
+
+def bench_char_at():
+    """Calls to a mapped method, String.charAt as in decryptors loops."""
+    return loop(['const-string v2, "0123456789abcdef"', 'and-int/lit8 v3, v0, 0xf',
+                 'invoke-virtual {v2, v3}, Ljava/lang/String;->charAt(I)C', 'move-result v4'], 5), 20000
+
+
+def bench_exceptions():
+    """Exceptions used as control flow, a division by zero caught on every iteration."""
+    body = ['const/4 v2, 0x0']
+    for i in range(1, 20):
+        body.extend([':try_start_%d' % i, 'add-int/lit8 v3, v0, 0x1', ':try_end_%d' % i,
+                     '.catch Ljava/lang/Exception; {:try_start_%d .. :try_end_%d} :catch_0' % (i, i)])
+    body.extend([':try_start_0', 'div-int v3, v0, v2', ':try_end_0',
+                 '.catch Ljava/lang/ArithmeticException; {:try_start_0 .. :try_end_0} :catch_0',
+                 ':catch_0', 'add-int/lit8 v1, v1, 0x1'])
+    return loop(body, 4), 10000
+
+
+def bench_string_builder():
+    """A string built one char at a time, as decryptors do."""
+    return method(['new-instance v4, Ljava/lang/StringBuilder;', 'invoke-direct {v4}, Ljava/lang/StringBuilder;-><init>()V',
+                   'const/4 v0, 0x0', ':loop_0', 'if-ge v0, p0, :end_0', 'and-int/lit8 v3, v0, 0x3f',
+                   'add-int/lit8 v3, v3, 0x40', 'int-to-char v3, v3',
+                   'invoke-virtual {v4, v3}, Ljava/lang/StringBuilder;->append(C)Ljava/lang/StringBuilder;',
+                   'move-result-object v4', 'add-int/lit8 v0, v0, 0x1', 'goto :loop_0', ':end_0',
+                   'invoke-virtual {v4}, Ljava/lang/StringBuilder;->toString()Ljava/lang/String;',
+                   'move-result-object v5', 'invoke-virtual {v5}, Ljava/lang/String;->length()I',
+                   'move-result v1', 'return v1'], 6), 50000
+
+
+def bench_long_loop():
+    return loop(['add-int v1, v1, v0', 'and-int/lit16 v1, v1, 0x7fff'], 2), 200000
+
+
+def bench_array_data():
+    count = 20000
+    values = ['    0x%x' % (i * 7 % 0x10000) for i in range(count)]
+    body = ['const/16 v2, 0x%x' % count, 'new-array v3, v2, [I', 'fill-array-data v3, :array_0', 'const/4 v0, 0x0',
+            'const/4 v1, 0x0', ':loop_0', 'if-ge v0, v2, :end_0', 'aget v4, v3, v0', 'add-int v1, v1, v4',
+            'add-int/lit8 v0, v0, 0x1', 'goto :loop_0', ':end_0', 'return v1', '',
+            ':array_0', '.array-data 4'] + values + ['.end array-data']
+    return method(body, 5), 1
+
+
+def bench_xor_loop():
+    """A byte array filled and xor-ed with a repeating key, one element per iteration."""
+    key = [0x13, -0x2a, 0x7f, 0x5, -0x80, 0x31, 0x62, -0x9]
+    body = ['new-array v2, p0, [B', 'const/4 v0, 0x0', ':fill_0', 'if-ge v0, p0, :key_0', 'int-to-byte v4, v0',
+            'aput-byte v4, v2, v0', 'add-int/lit8 v0, v0, 0x1', 'goto :fill_0', ':key_0', 'const/16 v3, 0x%x' % len(key),
+            'new-array v3, v3, [B', 'fill-array-data v3, :array_0', 'array-length v5, v3', 'const/4 v0, 0x0',
+            ':loop_0', 'if-ge v0, p0, :end_0', 'aget-byte v4, v2, v0', 'rem-int v1, v0, v5', 'aget-byte v1, v3, v1',
+            'xor-int/2addr v4, v1', 'int-to-byte v4, v4', 'aput-byte v4, v2, v0', 'add-int/lit8 v0, v0, 0x1',
+            'goto :loop_0', ':end_0', 'const/4 v1, 0x0', 'aget-byte v1, v2, v1', 'return v1', '',
+            ':array_0', '.array-data 1'] + ['    %s' % hex(value) for value in key] + ['.end array-data']
+    return method(body, 6), 20000
+
+
+def bench_switch():
+    cases = 1000
+    body = ['const/4 v0, 0x0', 'const/4 v1, 0x0', ':loop_0', 'if-ge v0, p0, :end_0',
+            'rem-int/lit16 v2, v0, 0x%x' % cases, 'packed-switch v2, :pswitch_data_0', ':next_0',
+            'add-int/lit8 v0, v0, 0x1', 'goto :loop_0', ':end_0', 'return v1']
+    for i in range(cases):
+        body.extend([':pswitch_%d' % i, 'add-int/lit8 v1, v1, 0x%x' % (i % 100), 'goto :next_0'])
+    body.extend([':pswitch_data_0', '.packed-switch 0x0'] + ['    :pswitch_%d' % i for i in range(cases)] +
+                ['.end packed-switch'])
+    return method(body, 3), 20000
+
+
+def bench_preprocess():
+    """A generated class of about 100k lines, full of try blocks, switch cases and array data."""
+    blocks, cases, elements = 10000, 5000, 30000
+    body = ['const/4 v1, 0x0']
+    for i in range(blocks):
+        body.extend([':try_start_%d' % i, 'add-int/lit8 v1, v1, 0x1', ':try_end_%d' % i,
+                     '.catch Ljava/lang/Exception; {:try_start_%d .. :try_end_%d} :catch_0' % (i, i), ''])
+    body.extend(['rem-int/lit16 v2, v1, 0x%x' % cases, 'packed-switch v2, :pswitch_data_0', ':next_0',
+                 'const/16 v2, 0x%x' % elements, 'new-array v3, v2, [I', 'fill-array-data v3, :array_0',
+                 'const/4 v2, 0x1', 'aget v2, v3, v2', ':catch_0', 'return v1'])
+    for i in range(cases):
+        body.extend([':pswitch_%d' % i, 'add-int/lit8 v1, v1, 0x1', 'goto :next_0'])
+    body.extend([':pswitch_data_0', '.packed-switch 0x0'] + ['    :pswitch_%d' % i for i in range(cases)] +
+                ['.end packed-switch', ':array_0', '.array-data 4'] + ['    0x%x' % i for i in range(elements)] +
+                ['.end array-data'])
+    return method(body, 4), 1
+
+
+def bench_decryptor():
+    return get_source_from_file(DECRYPTOR).lines, None
+
+
+# name -> ( function returning the source and the iterations count, method, arguments )
+BENCHMARKS = OrderedDict([
+    ('micro.moves', bench_moves),
+    ('micro.arithmetic', bench_arithmetic),
+    ('micro.branches', bench_branches),
+    ('micro.arrays', bench_arrays),
+    ('micro.invoke', bench_invoke),
+    ('micro.char_at', bench_char_at),
+    ('micro.exceptions', bench_exceptions),
+    ('macro.decryptor', bench_decryptor),
+    ('macro.long_loop', bench_long_loop),
+    ('macro.string_builder', bench_string_builder),
+    ('macro.array_data', bench_array_data),
+    ('macro.xor_loop', bench_xor_loop),
+    ('macro.xor_vectorized', bench_xor_loop),
+    ('macro.switch', bench_switch),
+    ('macro.preprocess', bench_preprocess),
+])
+
+# Benchmarks of the code paths which need NumPy, skipped if it's not available. Loops are
+# vectorized in these ones only, so that the others don't depend on NumPy being installed.
+NUMPY_BENCHMARKS = ('macro.xor_vectorized',)
+
+
+def run_once(lines, iterations, options={}):
+    """
+    Preprocess and run a benchmark with a new emulator, so that nothing is reused between runs.
+    :param options: Keyword arguments of the emulator.
+    :return: The statistics of the emulator.
+    """
+    emu = Emulator(exit=False, **options)
+    klass = SmaliClass(list(lines))
+    if iterations is None:
+        emu.run_method(klass.method('field5'), DECRYPTOR_ARGS)
+    else:
+        emu.run_method(klass.method('run'), {'p0': iterations})
+    return emu.stats
+
+
+def emulator_options(name):
+    """Keyword arguments of the emulator of a benchmark."""
+    return {'vectorize': name in NUMPY_BENCHMARKS}
+
+
+def median(values):
+    """Median of a list of numbers."""
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+
+def max_rss():
+    """
+    Maximum resident set size of the process, in KiB. It's read from /proc if available, since
+    ru_maxrss keeps the maximum of the parent of a process on Linux, even after exec.
+    :return: The size, None if it can't be measured.
+    """
+    try:
+        with open('/proc/self/status') as fd:
+            for line in fd:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB everywhere else
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def measure_peak(name, scale):
+    """
+    Peak of the memory allocated by a single run of a benchmark, in KiB, in a process which only
+    ran a trivial method before it. It's traced by tracemalloc if available, otherwise it's the
+    growth of the maximum resident set size of the process.
+    :return: The peak, None if it can't be measured.
+    """
+    lines, iterations = source(name, scale)
+    # the opcodes table is built once per process, not by the benchmark
+    Emulator(exit=False).run_source(['return-void'])
+
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            run_once(lines, iterations, emulator_options(name))
+            return tracemalloc.get_traced_memory()[1] // 1024
+        finally:
+            tracemalloc.stop()
+
+    before = max_rss()
+    run_once(lines, iterations, emulator_options(name))
+    after = max_rss()
+    return None if before is None else after - before
+
+
+def peak_memory(name, scale):
+    """Peak of the memory allocated by a run of a benchmark, measured by a new process."""
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--peak', name, '-s', str(scale)])
+    output = output.decode('ascii').strip()
+    return None if output == 'None' else int(output)
+
+
+def source(name, scale):
+    """The source of a benchmark and its iterations count, multiplied by the scale."""
+    lines, iterations = BENCHMARKS[name]()
+    if iterations is not None and iterations > 1:
+        iterations = int(iterations * scale)
+    return lines, iterations
+
+
+def run_benchmark(name, repeats, scale):
+    """
+    Run a benchmark several times.
+    :return: A dictionary with the executed 'steps', the median 'steps_per_sec' and 'preproc_ms'
+             and the 'peak_kb' of memory.
+    """
+    lines, iterations = source(name, scale)
+
+    steps, rates, preproc = 0, [], []
+    for i in range(repeats):
+        stats = run_once(lines, iterations, emulator_options(name))
+        steps = stats.steps
+        rates.append(stats.steps / max(stats.execution / 1000.0, 1e-9))
+        preproc.append(stats.preproc)
+
+    return OrderedDict([
+        ('steps', steps),
+        ('steps_per_sec', round(median(rates), 1)),
+        ('preproc_ms', round(median(preproc), 3)),
+        ('peak_kb', peak_memory(name, scale)),
+    ])
+
+
+def regressions(results, baseline, threshold):
+    """
+    Compare results with a baseline.
+    :return: A list of messages, one per metric which got worse than the threshold allows.
+    """
+    messages = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+
+        if result['steps_per_sec'] < base['steps_per_sec'] / (1 + threshold):
+            messages.append("%s: %.1f steps/sec, baseline %.1f" % (name, result['steps_per_sec'], base['steps_per_sec']))
+        if result['preproc_ms'] > max(base['preproc_ms'] * (1 + threshold), base['preproc_ms'] + PREPROC_NOISE):
+            messages.append("%s: preprocessing %.3f ms, baseline %.3f" % (name, result['preproc_ms'], base['preproc_ms']))
+        if result['peak_kb'] is not None and base.get('peak_kb') is not None and \
+                result['peak_kb'] > max(base['peak_kb'] * (1 + PEAK_THRESHOLD), base['peak_kb'] + PEAK_NOISE):
+            messages.append("%s: peak memory %d KiB, baseline %d" % (name, result['peak_kb'], base['peak_kb']))
+    return messages
+
+
+def main(arguments):
+    if arguments['--peak']:
+        print(measure_peak(arguments['--peak'], float(arguments['-s'])))
+        return
+
+    names = arguments['-b'].split(',') if arguments['-b'] else list(BENCHMARKS)
+    repeats = int(arguments['-r'])
+    scale = float(arguments['-s'])
+
+    results = OrderedDict()
+    print("%-20s %10s %14s %12s %10s" % ('benchmark', 'steps', 'steps/sec', 'preproc ms', 'peak KiB'))
+    for name in names:
+        if name in NUMPY_BENCHMARKS and vectorize.numpy is None:
+            print("%-20s skipped, NumPy is not available" % name)
+            continue
+        result = results[name] = run_benchmark(name, repeats, scale)
+        print("%-20s %10d %14.1f %12.3f %10s" % (name, result['steps'], result['steps_per_sec'],
+                                                 result['preproc_ms'], result['peak_kb']))
+
+    report = OrderedDict([
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('repeats', repeats),
+        ('scale', scale),
+        ('benchmarks', results),
+    ])
+    if arguments['-o']:
+        with open(arguments['-o'], 'w') as fd:
+            json.dump(report, fd, indent=2, separators=(',', ': '))
+            fd.write('\n')
+
+    if arguments['-c']:
+        with open(arguments['-c']) as fd:
+            baseline = json.load(fd)
+        if any(baseline.get(key) != report[key] for key in ('python', 'platform', 'scale')):
+            print("\nwarning: the baseline was recorded with python %s on %s and scale %s." % (
+                baseline.get('python'), baseline.get('platform'), baseline.get('scale')))
+
+        messages = regressions(results, baseline['benchmarks'], float(arguments['-t']))
+        for message in messages:
+            print("regression: " + message)
+        if messages:
+            sys.exit(1)
+        print("\nno regressions against %s." % arguments['-c'])
+
+
+if __name__ == '__main__':
+    main(docopt(__doc__))
@@ -0,0 +1,6 @@
+import sys
+
+# the asyncio front end can't be even parsed by older interpreters
+collect_ignore = []
+if sys.version_info < (3, 5):
+    collect_ignore.append('src/smali/aio.py')
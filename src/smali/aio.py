@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Smali Emulator.
+#
+# Copyright(c) 2016 Simone 'evilsocket' Margaritelli
+# evilsocket@gmail.com
+# http://www.evilsocket.net
+#
+# This file may be licensed under the terms of of the
+# GNU General Public License Version 3 (the ``GPL'').
+#
+# Software distributed under the License is distributed
+# on an ``AS IS'' basis, WITHOUT WARRANTY OF ANY KIND, either
+# express or implied. See the GPL for the specific language
+# governing rights and limitations.
+#
+# You should have received a copy of the GPL along with this
+# program. If not, go to http://www.gnu.org/licenses/gpl.html
+# or write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+
+# asyncio front end of the emulator, it requires Python 3.5 or later.
+
+import time
+import asyncio
+
+from smali.emulator import Emulator, BudgetExceeded
+
+# Number of instructions executed before giving control back to the event loop.
+DEFAULT_SLICE = 1000
+
+
+async def run_method(method, args={}, slice_steps=DEFAULT_SLICE, emulator=None):
+    """
+    Emulate a method in slices of instructions, awaiting between them so that many emulations
+    can run concurrently in the same event loop. The smali methods it invokes run in the same
+    slices, and cancelling the task stops the emulation at the end of the current slice.
+    :param method: A smali.loader.Method instance.
+    :param args: A dictionary of optional initialization variables for the VM, used for arguments.
+    :param slice_steps: Number of instructions executed before awaiting.
+    :param emulator: The Emulator instance to use, it must not be shared with concurrent emulations,
+                     nor quit on fatal errors. A new one is created if None.
+    :return: The return value of the emulated method or None if no return-* opcode was executed,
+             or a BudgetExceeded instance if the run exhausted the max_steps or deadline of the emulator.
+    :raises EmulationError: If the emulation fails, as the exception of the task.
+    """
+    emulator = emulator or Emulator(exit=False)
+    vm = emulator.prepare(method, args)
+    vm.stepping = True
+    budget = emulator.budget
+    stats = emulator.stats
+    profiler = emulator.profiler
+    if profiler is not None:
+        profiler.enter(vm)
+
+    try:
+        while vm.stop is False:
+            s = time.time() * 1000
+            count = slice_steps if budget is None else min(slice_steps, budget.next(vm))
+            executed = emulator.step(vm, count)
+            e = time.time() * 1000
+
+            stats.execution += e - s
+            stats.steps += executed
+            if budget is not None:
+                budget.steps += executed
+
+            if vm.stop is False:
+                await asyncio.sleep(0)
+
+    except BudgetExceeded as exceeded:
+        stats.steps = exceeded.steps
+        return exceeded
+
+    finally:
+        # methods left running by a failed or cancelled emulation
+        while vm.frames:
+            vm.leave()
+        if profiler is not None:
+            profiler.leave()
+
+    stats.steps += vm.steps
+    stats.fused = vm.fused
+    return vm.return_v
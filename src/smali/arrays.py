@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Smali Emulator.
+#
+# Copyright(c) 2016 Simone 'evilsocket' Margaritelli
+# evilsocket@gmail.com
+# http://www.evilsocket.net
+#
+# This file may be licensed under the terms of of the
+# GNU General Public License Version 3 (the ``GPL'').
+#
+# Software distributed under the License is distributed
+# on an ``AS IS'' basis, WITHOUT WARRANTY OF ANY KIND, either
+# express or implied. See the GPL for the specific language
+# governing rights and limitations.
+#
+# You should have received a copy of the GPL along with this
+# program. If not, go to http://www.gnu.org/licenses/gpl.html
+# or write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+
+# Arrays of the emulated code. Arrays of primitive integer and floating point types are
+# backed by array.array, so that they take one machine word per element at most and can be
+# filled with a single copy, the others ( chars and objects ) are python lists.
+
+import array
+from functools import partial
+
+try:
+    array.array('q')
+    LONG = 'q'
+except ValueError:
+    LONG = 'l'  # Python 2, 64 bits wide on LP64 platforms
+
+# Typecode of the array.array backing the arrays of every primitive type, by descriptor. Java
+# bytes are signed, so they're stored as signed chars rather than in a bytearray.
+TYPECODES = {
+    '[Z': 'b',
+    '[B': 'b',
+    '[S': 'h',
+    '[I': 'i',
+    '[J': LONG,
+    '[F': 'f',
+    '[D': 'd',
+}
+
+INTEGERS = (int, type(2 ** 64))  # long on Python 2
+
+# Typecode of the array-data blocks, by element width.
+WIDTHS = {1: 'b', 2: 'h', 4: 'i', 8: LONG}
+
+
+def wrap(typecode, value):
+    """
+    Truncate an integer to the width of an array element, as Java does when narrowing.
+    :param typecode: Typecode of the array.
+    :param value: The integer to store.
+    :return: The value with the same low order bits, in the range of the element type.
+
+    >>> wrap('b', 200)
+    -56
+    >>> wrap('i', 2 ** 31)
+    -2147483648
+    """
+    bits = array.array(typecode).itemsize * 8
+    value &= (1 << bits) - 1
+    return value - (1 << bits) if value >> (bits - 1) else value
+
+
+def _zeros(typecode, size):
+    return array.array(typecode, b'\x00' * (size * array.array(typecode).itemsize if size > 0 else 0))
+
+
+def _blanks(size):
+    return [""] * size
+
+
+def allocator(descriptor):
+    """
+    Function creating the arrays of a type, used by new-array.
+    :param descriptor: The array type descriptor, like [B
+    :return: A function taking the size and returning the new array, zero filled.
+    """
+    typecode = TYPECODES.get(descriptor)
+    if typecode is None:
+        return _blanks
+    return partial(_zeros, typecode)
+
+
+def store(arr, idx, value):
+    """
+    Slow path of aput, once the plain assignment failed: the value is converted to the type of
+    the elements of typed arrays, lists grow by one element when it's stored right past their end
+    and other out of bounds stores are ignored.
+    :param arr: The array.
+    :param idx: Index of the element.
+    :param value: The value to store.
+    """
+    if isinstance(arr, array.array):
+        if isinstance(value, (str, type(u''))) and len(value) == 1:
+            value = ord(value)  # a char stored in an integer array
+        if isinstance(value, INTEGERS) and arr.typecode not in 'fd':
+            value = wrap(arr.typecode, value)
+    if -len(arr) <= idx < len(arr):
+        arr[idx] = value
+    elif idx == len(arr):
+        arr.append(value)
+
+
+def pack(width, elements):
+    """
+    Pack the elements of an array-data block once, to be copied by every fill-array-data.
+    :param width: Width in bytes of the elements.
+    :param elements: The list of integers.
+    :return: An array.array holding the elements, truncated to their width.
+    """
+    typecode = WIDTHS.get(width, LONG)
+    try:
+        return array.array(typecode, elements)
+    except OverflowError:
+        return array.array(typecode, [wrap(typecode, value) for value in elements])
+
+
+def fill(arr, data):
+    """
+    Copy an array-data block into an array with a single slice assignment.
+    :param arr: The array being filled.
+    :param data: The elements, packed by the pack function.
+    :return: The filled array, or a copy of the elements if the array can't hold them.
+    """
+    count = len(data)
+    if isinstance(arr, array.array) and len(arr) >= count:
+        if arr.typecode != data.typecode:
+            if arr.itemsize != data.itemsize:
+                return data[:]
+            # same width, different type: floating point arrays are filled with their bits
+            data = array.array(arr.typecode, data.tobytes() if hasattr(data, 'tobytes') else data.tostring())
+        arr[:count] = data
+        return arr
+
+    elif isinstance(arr, list) and len(arr) >= count:
+        arr[:count] = data.tolist()
+        return arr
+
+    return data[:]
+
+
+def to_bytes(arr):
+    """
+    Bytes held by a Java byte array.
+    :param arr: The array, an array.array of signed chars or a list of integers.
+    :return: The bytes.
+
+    >>> to_bytes([104, 105, -1]) == b'hi\\xff'
+    True
+    """
+    if isinstance(arr, array.array) and arr.itemsize == 1:
+        return arr.tobytes() if hasattr(arr, 'tobytes') else arr.tostring()
+    return bytes(bytearray(value & 0xFF for value in arr))
+
+
+def from_bytes(data):
+    """
+    Java byte array holding some bytes.
+    :param data: The bytes.
+    :return: An array.array of signed chars.
+
+    >>> from_bytes(b'hi\\xff').tolist()
+    [104, 105, -1]
+    """
+    arr = array.array('b')
+    if hasattr(arr, 'frombytes'):
+        arr.frombytes(data)
+    else:
+        arr.fromstring(data)
+    return arr
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Smali Emulator.
+#
+# Copyright(c) 2016 Simone 'evilsocket' Margaritelli
+# evilsocket@gmail.com
+# http://www.evilsocket.net
+#
+# This file may be licensed under the terms of of the
+# GNU General Public License Version 3 (the ``GPL'').
+#
+# Software distributed under the License is distributed
+# on an ``AS IS'' basis, WITHOUT WARRANTY OF ANY KIND, either
+# express or implied. See the GPL for the specific language
+# governing rights and limitations.
+#
+# You should have received a copy of the GPL along with this
+# program. If not, go to http://www.gnu.org/licenses/gpl.html
+# or write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import array
+import multiprocessing
+
+from smali.cache import ProgramCache
+from smali.emulator import Emulator, EmulationError, BudgetExceeded
+from smali.loader import ClassLoader, ClassNotFound, MethodNotFound
+from smali.objects.string_builder import Buffer
+
+try:
+    SCALAR_TYPES = (bool, int, long, float, unicode)
+except NameError:
+    SCALAR_TYPES = (bool, int, float, str)
+
+# Emulator of the pool worker process.
+_emulator = None
+
+
+def jsonable(value):
+    """
+    Convert a value returned by the emulated code to something that can be encoded as JSON.
+    :param value: The value to convert.
+    :return: The converted value, byte strings are decoded as UTF-8 ( or Latin-1 if they're not valid UTF-8 ),
+             StringBuilder instances become the string they hold and other objects their repr.
+    """
+    if isinstance(value, Buffer):
+        return jsonable(value.value())
+    elif isinstance(value, bytes):
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            return value.decode('latin-1')
+    elif isinstance(value, (list, tuple)):
+        return [jsonable(item) for item in value]
+    elif isinstance(value, array.array):
+        return value.tolist()
+    elif isinstance(value, dict):
+        return dict((jsonable(key), jsonable(item)) for key, item in value.items())
+    elif value is None or isinstance(value, SCALAR_TYPES):
+        return value
+    return repr(value)
+
+
+def run_method(emulator, method, args):
+    """
+    Run a method, reporting errors in the result instead of raising them.
+    :param emulator: Instance of the emulator, created with exit=False.
+    :param method: The smali.loader.Method instance to run.
+    :param args: A dictionary of initialization variables for the VM, used for arguments.
+    :return: A dictionary with the 'result' and the execution 'steps', or the 'error'. Runs which
+             exhausted their budget report the 'budget_exceeded' reason, pc and line as well.
+    """
+    try:
+        result = emulator.run_method(method, args)
+        if isinstance(result, BudgetExceeded):
+            return {
+                'error': str(result),
+                'budget_exceeded': {'reason': result.reason, 'pc': result.pc, 'line': result.line},
+                'steps': result.steps,
+            }
+        return {'result': jsonable(result), 'steps': emulator.stats.steps}
+    except EmulationError as e:
+        if e.line is None:
+            return {'error': e.message}
+        return {'error': "line %d: %s" % (e.line, e.message)}
+    except Exception as e:
+        return {'error': "%s: %s" % (e.__class__.__name__, e)}
+
+
+def run_job(emulator, job, restricted=False):
+    """
+    Run a job, reporting errors in the result instead of raising them.
+    :param emulator: Instance of the emulator, its class loader resolves the class of the job.
+    :param job: A dictionary with the 'class' descriptor ( or the smali 'file' path ), the 'method'
+                name or signature and the 'args'.
+    :param restricted: If true, the file of the job must be inside the search paths of the class
+                       loader, relative paths are resolved against them.
+    :return: A dictionary with the 'result' and the execution 'steps', or the 'error'.
+    """
+    try:
+        if 'file' in job and restricted:
+            filename = emulator.loader.find(job['file'])
+            if filename is None:
+                raise ClassNotFound("File '%s' not found in the search paths." % job['file'])
+            klass = emulator.loader.load_file(filename)
+        elif 'file' in job:
+            klass = emulator.loader.load_file(job['file'])
+        else:
+            klass = emulator.loader.load_class(job['class'])
+        method = klass.method(job['method'])
+    except (ClassNotFound, MethodNotFound, KeyError, TypeError, IOError, OSError) as e:
+        return {'error': "%s: %s" % (e.__class__.__name__, e)}
+    return run_method(emulator, method, job.get('args') or {})
+
+
+def _initialize(paths, cache, max_steps, deadline):
+    global _emulator
+    _emulator = Emulator(exit=False, loader=ClassLoader(paths), cache=ProgramCache(cache) if cache else None,
+                         max_steps=max_steps, deadline=deadline)
+
+
+def _run(entry):
+    index, job = entry
+    result = run_job(_emulator, job)
+    result.update({'index': index, 'class': job.get('class'), 'method': job.get('method')})
+    return result
+
+
+def run_pool(paths, jobs, workers=None, tasks=None, cache=None, max_steps=None, deadline=None):
+    """
+    Run jobs on a pool of processes, every process keeps its own emulator and class loader
+    so that classes and methods are loaded once per process.
+    :param paths: Directories to search classes in.
+    :param jobs: An iterable of jobs, as accepted by run_job.
+    :param workers: Number of processes, the number of CPUs if None.
+    :param tasks: Number of jobs after which a process is replaced by a new one, never if None.
+    :param cache: Optional directory of the ProgramCache shared by the processes.
+    :param max_steps: Maximum number of steps of every job, unlimited if None.
+    :param deadline: Maximum seconds of execution of every job, unlimited if None.
+    :return: A generator of results, with the 'index' of their job, in completion order.
+    """
+    pool = multiprocessing.Pool(workers, _initialize, (paths, cache, max_steps, deadline), tasks)
+    try:
+        for result in pool.imap_unordered(_run, enumerate(jobs)):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
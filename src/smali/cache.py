@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Smali Emulator.
+#
+# Copyright(c) 2016 Simone 'evilsocket' Margaritelli
+# evilsocket@gmail.com
+# http://www.evilsocket.net
+#
+# This file may be licensed under the terms of of the
+# GNU General Public License Version 3 (the ``GPL'').
+#
+# Software distributed under the License is distributed
+# on an ``AS IS'' basis, WITHOUT WARRANTY OF ANY KIND, either
+# express or implied. See the GPL for the specific language
+# governing rights and limitations.
+#
+# You should have received a copy of the GPL along with this
+# program. If not, go to http://www.gnu.org/licenses/gpl.html
+# or write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import os
+import sys
+import marshal
+import hashlib
+import tempfile
+
+# Bump this whenever the layout of the cached programs changes.
+CACHE_VERSION = 2
+
+
+class ProgramCache(object):
+    """
+    Content addressed on-disk cache of preprocessed programs.
+
+    Every entry is a marshal'ed dictionary holding the stripped lines of code, the labels,
+    try/catch blocks, packed-switch and array-data tables and the opcode matched by each line,
+    so that a program which was already seen can be decoded without parsing it again.
+    """
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    @staticmethod
+    def key(signature, lines):
+        """
+        Compute the cache key of a program.
+        :param signature: Signature of the opcodes set used to match the lines.
+        :param lines: The raw lines of code.
+        :return: The hex digest identifying the program.
+        """
+        content = '\n'.join(lines)
+        if not isinstance(content, bytes):
+            content = content.encode('utf-8')
+
+        digest = hashlib.sha1()
+        digest.update(('%d:%d.%d:%s:' % ((CACHE_VERSION,) + sys.version_info[:2] + (signature,))).encode('ascii'))
+        digest.update(content)
+        return digest.hexdigest()
+
+    def __filename(self, key):
+        return os.path.join(self.path, key + '.bin')
+
+    def load(self, key):
+        """
+        Load a program from the cache.
+        :param key: Key of the program.
+        :return: The program dictionary or None if it's not cached ( or unreadable ).
+        """
+        try:
+            with open(self.__filename(key), 'rb') as fd:
+                return marshal.load(fd)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+
+    def store(self, key, program):
+        """
+        Save a program to the cache, the file is written atomically so that concurrent
+        processes sharing the same cache directory never read a partial entry.
+        :param key: Key of the program.
+        :param program: The program dictionary.
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                marshal.dump(program, fp)
+            os.rename(tmp, self.__filename(key))
+        except (IOError, OSError):
+            if os.path.exists(tmp):
+                os.remove(tmp)
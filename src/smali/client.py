@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Smali Emulator.
+#
+# Copyright(c) 2016 Simone 'evilsocket' Margaritelli
+# evilsocket@gmail.com
+# http://www.evilsocket.net
+#
+# This file may be licensed under the terms of of the
+# GNU General Public License Version 3 (the ``GPL'').
+#
+# Software distributed under the License is distributed
+# on an ``AS IS'' basis, WITHOUT WARRANTY OF ANY KIND, either
+# express or implied. See the GPL for the specific language
+# governing rights and limitations.
+#
+# You should have received a copy of the GPL along with this
+# program. If not, go to http://www.gnu.org/licenses/gpl.html
+# or write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+
+import re
+import json
+import socket
+import struct
+
+# Every message is a JSON document preceded by its length, as a 32 bits big endian integer.
+HEADER = struct.Struct('>I')
+
+# Maximum size of a message.
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def parse_address(address):
+    """
+    Parse the address of the daemon, a host:port pair or the path of a Unix domain socket.
+
+    >>> parse_address('127.0.0.1:8000')
+    ('127.0.0.1', 8000)
+    >>> parse_address(':8000')
+    ('127.0.0.1', 8000)
+    >>> parse_address('/tmp/smali.sock')
+    '/tmp/smali.sock'
+    """
+    if isinstance(address, tuple):
+        return address
+
+    match = re.match(r'^([\w.\-]*):(\d+)$', address)
+    if match is None:
+        return address
+    return str(match.group(1) or '127.0.0.1'), int(match.group(2))
+
+
+def send_message(sock, message):
+    """
+    Send a message.
+    :param sock: The connected socket.
+    :param message: The JSON serializable message.
+    """
+    payload = json.dumps(message, sort_keys=True).encode('utf-8')
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+
+
+def receive_message(sock):
+    """
+    Receive a message.
+    :param sock: The connected socket.
+    :return: The decoded message, or None if the connection was closed.
+    """
+    header = _receive(sock, HEADER.size)
+    if header is None:
+        return None
+
+    size, = HEADER.unpack(header)
+    if size > MAX_MESSAGE_SIZE:
+        raise ProtocolError("Message of %d bytes is too large." % size)
+
+    payload = _receive(sock, size)
+    if payload is None:
+        raise ProtocolError("Connection closed in the middle of a message.")
+
+    try:
+        return json.loads(payload.decode('utf-8'))
+    except ValueError as e:
+        raise ProtocolError("Malformed message: %s" % e)
+
+
+def _receive(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+class Client(object):
+    """Client of the emulator daemon, requests are sent over a single persistent connection."""
+    def __init__(self, address, timeout=None):
+        address = parse_address(address)
+        family = socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(address)
+
+    def request(self, job):
+        """
+        Run a job on the daemon.
+        :param job: A dictionary with the 'class' descriptor ( or the smali 'file' path ), the 'method'
+                    name or signature and the 'args'.
+        :return: A dictionary with the 'result' and the execution 'steps', or the 'error'.
+        """
+        send_message(self.socket, job)
+        response = receive_message(self.socket)
+        if response is None:
+            raise ProtocolError("Connection closed by the daemon.")
+        return response
+
+    def run(self, klass, method, args=None):
+        return self.request({'class': klass, 'method': method, 'args': args or {}})
+
+    def run_file(self, filename, method, args=None):
+        return self.request({'file': filename, 'method': method, 'args': args or {}})
+
+    def close(self):
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
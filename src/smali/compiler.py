@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Smali Emulator.
+#
+# Copyright(c) 2016 Simone 'evilsocket' Margaritelli
+# evilsocket@gmail.com
+# http://www.evilsocket.net
+#
+# This file may be licensed under the terms of of the
+# GNU General Public License Version 3 (the ``GPL'').
+#
+# Software distributed under the License is distributed
+# on an ``AS IS'' basis, WITHOUT WARRANTY OF ANY KIND, either
+# express or implied. See the GPL for the specific language
+# governing rights and limitations.
+#
+# You should have received a copy of the GPL along with this
+# program. If not, go to http://www.gnu.org/licenses/gpl.html
+# or write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import sys
+from collections import OrderedDict
+
+from smali.arrays import store, fill
+from smali.opcodes import op_Return, op_IntToType, op_Invoke, op_PackedSwitch
+
+UNSET = object()  # value of the registers which were never set, when they're kept by name
+
+# Code objects already compiled, by generated source, least recently used first.
+_code_cache = OrderedDict()
+
+# Maximum number of code objects kept in the cache.
+CODE_CACHE_SIZE = 256
+
+# Types of the operands which can be written as python literals in the generated source.
+LITERAL_TYPES = tuple(set(type(value) for value in (0, 2 ** 64, 0.0, True, None, '', u'')))
+
+
+class Compiler(object):
+    """
+    Ahead of time compiler translating the decoded code of a method into a Python function.
+
+    Registers become local variables of the function and basic blocks are selected by a binary
+    tree of comparisons on the offset of their first instruction, inside a single loop. Opcodes
+    without a 'source' or 'condition' template are run through their eval method, after the
+    registers were written back to the VM.
+
+    The function takes the VM and the offset to start from and returns the number of executed
+    steps, counted like the interpreter does: a superinstruction is a single step, however many
+    opcodes it's compiled from. It stops when a return-* opcode is executed, or leaves vm.pc to
+    the offset the interpreter has to resume from when it can't continue by itself. If 'limited'
+    is true, the function takes a third argument too, the maximum number of steps to execute,
+    and returns before the first block which could go past it.
+    """
+    def __init__(self, vm, limited=False):
+        self.vm = vm
+        self.limited = limited
+        self.slots = vm.slots is not None
+        self.locals = {}      # register key -> local variable name
+        self.constants = []   # constants which can't be written as literals
+        self.lines = []       # generated source
+        self.origins = {}     # generated line number -> offset of the instruction
+        self.leaders = set()  # offsets of the first instruction of every basic block
+        self.counts = {}      # offset -> ( steps, superinstructions ) executed in its block up to it
+
+    def compile(self):
+        """
+        Generate and compile the function, the most recently compiled code is cached by source.
+        :return: The compiled function.
+        """
+        source = self.generate()
+        code = _code_cache.pop(source, None)
+        if code is None:
+            code = compile(source, '<smali>', 'exec', 0, True)
+        _code_cache[source] = code
+        while len(_code_cache) > CODE_CACHE_SIZE:
+            _code_cache.popitem(last=False)
+
+        scope = {
+            'sys': sys,
+            'UNSET': UNSET,
+            'store': store,
+            'fill': fill,
+            'K': self.constants,
+            'LINES': self.origins,
+            'LEADERS': frozenset(self.leaders),
+            'COUNTS': self.counts,
+        }
+        exec(code, scope)
+        return scope['method']
+
+    def generate(self):
+        """Generate the python source of the function."""
+        code = self.vm.code
+        self.__scan(code)
+
+        leaders = sorted(self.leaders)
+        blocks = [(start, end) for start, end in zip(leaders, leaders[1:] + [len(code)])]
+        self.__count(code, blocks)
+
+        self.__emit(0, 'def method(vm, pc, limit):' if self.limited else 'def method(vm, pc):')
+        self.__emit(1, 'regs = vm.regs')
+        self.__emit(1, self.__load_all())
+        self.__emit(1, 'steps = 0')
+        self.__emit(1, 'while True:')
+        self.__emit(2, 'try:')
+        self.__emit(3, 'while True:')
+        self.__tree(4, blocks)
+        self.__emit(2, 'except Exception as e:')
+        self.__emit(3, 'fault = LINES[sys.exc_info()[2].tb_lineno]')
+        self.__emit(3, 'executed, fused = COUNTS[fault]')
+        self.__emit(3, 'steps += executed')
+        self.__emit(3, 'vm.fused += fused')
+        self.__emit(3, self.__store_all())
+        self.__emit(3, 'vm.pc = fault + 1')
+        self.__emit(3, 'vm.exception(e)')
+        self.__emit(3, 'pc = vm.pc')
+        self.__emit(3, 'if pc not in LEADERS:')
+        self.__emit(4, 'return steps')
+
+        return '\n'.join(self.lines) + '\n'
+
+    def __scan(self, code):
+        """Collect the registers and the basic blocks leaders."""
+        self.leaders.add(0)
+        for start, end, target, name in self.vm.catch_blocks:
+            self.leaders.add(target)
+
+        for pc, insn in enumerate(code):
+            insn = self.__instruction(pc)
+            opcode = insn.opcode
+            if opcode is None:
+                self.leaders.add(pc + 1)
+                continue
+
+            for idx in opcode.registers:
+                self.__local(insn.args[idx])
+            for idx in opcode.targets:
+                self.leaders.add(insn.args[idx])
+
+            if isinstance(opcode, op_Invoke):
+                self.__local(insn.args[0])
+                for arg in insn.args[2]:
+                    self.__local(arg)
+            elif isinstance(opcode, op_PackedSwitch):
+                self.leaders.update(insn.args[2])
+
+            if self.__ends(insn):
+                self.leaders.add(pc + 1)
+
+        self.leaders.discard(len(code))
+
+    def __count(self, code, blocks):
+        """Count the steps and the superinstructions executed by every block up to each offset."""
+        for start, end in blocks:
+            steps = fused = 0
+            following = start  # offset of the instruction after the last superinstruction
+            for pc in range(start, end):
+                if pc >= following:
+                    parts = code[pc].parts or (code[pc],)
+                    following = pc + len(parts)
+                    steps += 1
+                    fused += 1 if len(parts) > 1 else 0
+                self.counts[pc] = (steps, fused)
+
+    def __instruction(self, pc):
+        """The instruction at an offset, superinstructions are compiled from their parts."""
+        insn = self.vm.code[pc]
+        return insn if insn.parts is None else insn.parts[0]
+
+    def __local(self, key):
+        if key is not None and key not in self.locals:
+            self.locals[key] = 'r%d' % (key if self.slots else len(self.locals))
+
+    def __constant(self, value):
+        if isinstance(value, LITERAL_TYPES):
+            return repr(value)
+
+        self.constants.append(value)
+        return 'K[%d]' % (len(self.constants) - 1)
+
+    def __emit(self, indent, source, pc=None):
+        for line in source.split('\n'):
+            if line:
+                self.lines.append('    ' * indent + line)
+                if pc is not None:
+                    self.origins[len(self.lines)] = pc
+
+    def __load(self, key):
+        if self.slots:
+            return '%s = regs[%r]' % (self.locals[key], key)
+        return '%s = regs.get(%r, UNSET)' % (self.locals[key], key)
+
+    def __store(self, key):
+        if self.slots:
+            return 'regs[%r] = %s' % (key, self.locals[key])
+        return 'if %s is not UNSET: regs[%r] = %s' % (self.locals[key], key, self.locals[key])
+
+    def __load_all(self):
+        return '\n'.join(self.__load(key) for key in sorted(self.locals))
+
+    def __store_all(self):
+        return '\n'.join(self.__store(key) for key in sorted(self.locals))
+
+    def __tree(self, indent, blocks):
+        """Emit a binary tree of comparisons selecting the block to execute."""
+        if len(blocks) == 1:
+            self.__block(indent, *blocks[0])
+            return
+
+        middle = len(blocks) // 2
+        self.__emit(indent, 'if pc < %d:' % blocks[middle][0])
+        self.__tree(indent + 1, blocks[:middle])
+        self.__emit(indent, 'else:')
+        self.__tree(indent + 1, blocks[middle:])
+
+    def __block(self, indent, start, end):
+        """
+        Emit the instructions of a block, conditional jumps leave it as soon as they're taken
+        while the other instructions fall through to the next one. The steps counter is updated
+        on every exit with the number of steps executed since the beginning of the block. With
+        a limit, the block is entered only if all of its steps fit in what's left of it.
+        """
+        if self.limited:
+            self.__emit(indent, 'if steps > limit - %d:' % self.counts[end - 1][0])
+            self.__emit(indent + 1, self.__store_all())
+            self.__emit(indent + 1, 'vm.pc = pc')
+            self.__emit(indent + 1, 'return steps')
+
+        for pc in range(start, end):
+            insn = self.__instruction(pc)
+            if isinstance(insn.opcode, op_Invoke):
+                self.__invoke(indent, pc, insn)
+            elif self.__inlined(insn):
+                self.__emit(indent, self.__template(insn), pc)
+            elif isinstance(insn.opcode, op_PackedSwitch):
+                self.__switch(indent, pc, insn)
+            elif insn.opcode is not None and insn.opcode.condition is not None:
+                self.__branch(indent, pc, insn)
+            elif isinstance(insn.opcode, op_Return) and self.__returned(insn) is not None:
+                self.__emit(indent, 'vm.return_v = %s' % self.__returned(insn), pc)
+                self.__exit(indent, pc)
+            else:
+                self.__generic(indent, pc, insn)
+
+        if not self.__ends(self.__instruction(end - 1)):
+            self.__steps(indent, end - 1)
+            self.__emit(indent, 'pc = %d' % end)
+
+    def __operands(self, insn):
+        registers = insn.opcode.registers
+        return [self.locals[arg] if idx in registers and arg is not None else self.__constant(arg)
+                for idx, arg in enumerate(insn.args)]
+
+    def __template(self, insn):
+        """Python source of an inlined instruction."""
+        if insn.opcode.source is not None:
+            return insn.opcode.source.format(*self.__operands(insn))
+
+        ctype, vx, vy = self.__operands(insn)
+        if insn.args[0] == 'char':
+            return '%s = chr(%s & 0xFF)' % (vx, vy)
+        return '%s = (%s << 24) >> 24' % (vx, vy)
+
+    def __returned(self, insn):
+        """Python expression of the value returned by a return-* opcode, if supported."""
+        ctype, vx = insn.args
+        if (ctype is None and vx is None) or ctype == '-void':
+            return 'None'
+        elif ctype in ('-wide', '-object') or (ctype is None and vx is not None):
+            return self.locals[vx]
+        return None
+
+    @staticmethod
+    def __inlined(insn):
+        """True if the instruction is translated in place and doesn't change the control flow."""
+        opcode = insn.opcode
+        return opcode is not None and (
+            opcode.source is not None or isinstance(opcode, op_Invoke) or
+            (isinstance(opcode, op_IntToType) and insn.args[0] in ('char', 'byte'))
+        )
+
+    @classmethod
+    def __ends(cls, insn):
+        """True if the execution never falls through to the next instruction ( or can't tell )."""
+        opcode = insn.opcode
+        if cls.__inlined(insn) or isinstance(opcode, op_PackedSwitch):
+            return False
+        return opcode is None or opcode.condition == 'True' or opcode.condition is None
+
+    def __steps(self, indent, pc):
+        """Account the steps and the superinstructions executed by the block up to an offset."""
+        steps, fused = self.counts[pc]
+        self.__emit(indent, 'steps += %d' % steps)
+        if fused:
+            self.__emit(indent, 'vm.fused += %d' % fused)
+
+    def __exit(self, indent, pc):
+        steps, fused = self.counts[pc]
+        self.__emit(indent, self.__store_all())
+        self.__emit(indent, 'vm.stop = True')
+        if fused:
+            self.__emit(indent, 'vm.fused += %d' % fused)
+        self.__emit(indent, 'return steps + %d' % steps)
+
+    def __branch(self, indent, pc, insn):
+        target = insn.args[insn.opcode.targets[0]]
+        condition = insn.opcode.condition.format(*self.__operands(insn))
+        if condition == 'True':
+            self.__steps(indent, pc)
+            self.__emit(indent, 'pc = %d' % target)
+        else:
+            self.__emit(indent, 'if %s:' % condition, pc)
+            self.__steps(indent + 1, pc)
+            self.__emit(indent + 1, 'pc = %d' % target)
+            self.__emit(indent + 1, 'continue')
+
+    def __invoke(self, indent, pc, insn):
+        this, site, args = insn.args
+        for key in (this,) + args:
+            if key is not None:
+                self.__emit(indent, self.__store(key), pc)
+        self.__emit(indent, 'vm.dispatch(%s, %r, %r)' % (self.__constant(site), this, args), pc)
+        if this is not None:
+            self.__emit(indent, self.__load(this), pc)
+
+    def __switch(self, indent, pc, insn):
+        vx, first_value, targets = insn.args
+        self.__emit(indent, 'idx = %s - %r' % (self.locals[vx], first_value), pc)
+        self.__emit(indent, 'if 0 <= idx < %d:' % len(targets))
+        self.__steps(indent + 1, pc)
+        self.__emit(indent + 1, 'pc = %r[idx]' % (targets,))
+        self.__emit(indent + 1, 'continue')
+
+    def __generic(self, indent, pc, insn):
+        """Run an instruction through its eval method, with the registers in the VM."""
+        self.__steps(indent, pc)
+        self.__emit(indent, self.__store_all())
+        self.__emit(indent, 'vm.pc = %d' % (pc + 1))
+        self.__emit(indent, '%s(vm, *%s)' % (self.__constant(insn.eval), self.__constant(insn.args)), pc)
+        self.__emit(indent, 'if vm.stop:')
+        self.__emit(indent + 1, 'return steps')
+        self.__emit(indent, self.__load_all())
+        self.__emit(indent, 'pc = vm.pc')
+        self.__emit(indent, 'if pc not in LEADERS:')
+        self.__emit(indent + 1, 'return steps')
+        # the block was accounted before running the instruction, not again if it raises
+        self.counts[pc] = (0, 0)
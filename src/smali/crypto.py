@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Smali Emulator.
+#
+# Copyright(c) 2016 Simone 'evilsocket' Margaritelli
+# evilsocket@gmail.com
+# http://www.evilsocket.net
+#
+# This file may be licensed under the terms of of the
+# GNU General Public License Version 3 (the ``GPL'').
+#
+# Software distributed under the License is distributed
+# on an ``AS IS'' basis, WITHOUT WARRANTY OF ANY KIND, either
+# express or implied. See the GPL for the specific language
+# governing rights and limitations.
+#
+# You should have received a copy of the GPL along with this
+# program. If not, go to http://www.gnu.org/licenses/gpl.html
+# or write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+
+# Block ciphers used by the javax.crypto models, in pure python. Whole buffers are converted to
+# integers with a single struct call and every block is encrypted with table lookups on words
+# ( AES ) or with combined S-box and permutation tables ( DES ), rather than byte by byte.
+
+import struct
+
+
+class NoSuchAlgorithm(Exception):
+    java_class = 'Ljava/security/NoSuchAlgorithmException;'
+
+
+class BadPadding(Exception):
+    java_class = 'Ljavax/crypto/BadPaddingException;'
+
+
+class IllegalBlockSize(Exception):
+    java_class = 'Ljavax/crypto/IllegalBlockSizeException;'
+
+
+class InvalidKey(Exception):
+    java_class = 'Ljava/security/InvalidKeyException;'
+
+
+def _xtime(a):
+    a <<= 1
+    return a ^ 0x11B if a & 0x100 else a
+
+
+def _aes_tables():
+    """Generate the AES S-boxes and the round tables from the field arithmetic."""
+    exp, log = [0] * 256, [0] * 256
+    x = 1
+    for i in range(255):
+        exp[i], log[x] = x, i
+        x ^= _xtime(x)  # multiply by the generator 3
+
+    def mul(a, b):
+        return exp[(log[a] + log[b]) % 255] if a and b else 0
+
+    sbox, inverse = [0] * 256, [0] * 256
+    for a in range(256):
+        b = exp[(255 - log[a]) % 255] if a else 0
+        s = b
+        for shift in range(1, 5):
+            s ^= ((b << shift) | (b >> (8 - shift))) & 0xFF
+        sbox[a] = s ^ 0x63
+        inverse[sbox[a]] = a
+
+    def rotated(table):
+        return [table] + [[((w >> (8 * n)) | (w << (32 - 8 * n))) & 0xFFFFFFFF for w in table] for n in (1, 2, 3)]
+
+    te = [(mul(s, 2) << 24) | (s << 16) | (s << 8) | mul(s, 3) for s in sbox]
+    td = [(mul(s, 14) << 24) | (mul(s, 9) << 16) | (mul(s, 13) << 8) | mul(s, 11) for s in inverse]
+    return sbox, inverse, rotated(te), rotated(td)
+
+
+SBOX, INV_SBOX, TE, TD = _aes_tables()
+
+
+class AES(object):
+    """AES with 128, 192 or 256 bits keys, blocks are tuples of four big endian words."""
+    block_size = 16
+    layout = 'IIII'
+
+    def __init__(self, key):
+        if len(key) not in (16, 24, 32):
+            raise InvalidKey("Invalid AES key length: %d bytes." % len(key))
+
+        nk = len(key) // 4
+        self.rounds = nk + 6
+        w = list(struct.unpack('>%dI' % nk, key))
+        rcon = 1
+        for i in range(nk, 4 * (self.rounds + 1)):
+            t = w[i - 1]
+            if i % nk == 0:
+                t = ((t << 8) | (t >> 24)) & 0xFFFFFFFF
+                t = self.__sub_word(t) ^ (rcon << 24)
+                rcon = _xtime(rcon)
+            elif nk > 6 and i % nk == 4:
+                t = self.__sub_word(t)
+            w.append(w[i - nk] ^ t)
+        self.ek = w
+
+        # equivalent inverse cipher: round keys in reverse order, with InvMixColumns applied
+        td0, td1, td2, td3 = TD
+        dk = []
+        for r in range(self.rounds, -1, -1):
+            words = w[4 * r:4 * r + 4]
+            if 0 < r < self.rounds:
+                words = [td0[SBOX[k >> 24]] ^ td1[SBOX[(k >> 16) & 0xFF]] ^
+                         td2[SBOX[(k >> 8) & 0xFF]] ^ td3[SBOX[k & 0xFF]] for k in words]
+            dk.extend(words)
+        self.dk = dk
+
+    @staticmethod
+    def __sub_word(t):
+        return (SBOX[t >> 24] << 24) | (SBOX[(t >> 16) & 0xFF] << 16) | (SBOX[(t >> 8) & 0xFF] << 8) | SBOX[t & 0xFF]
+
+    def encrypt(self, block):
+        return self.__crypt(block, self.ek, TE, SBOX, (1, 2, 3))
+
+    def decrypt(self, block):
+        return self.__crypt(block, self.dk, TD, INV_SBOX, (3, 2, 1))
+
+    def __crypt(self, block, rk, tables, sbox, order):
+        t0, t1, t2, t3 = tables
+        a, b, c = order
+        s = [block[0] ^ rk[0], block[1] ^ rk[1], block[2] ^ rk[2], block[3] ^ rk[3]]
+        k = 4
+        for r in range(1, self.rounds):
+            s = [t0[s[i] >> 24] ^ t1[(s[(i + a) & 3] >> 16) & 0xFF] ^ t2[(s[(i + b) & 3] >> 8) & 0xFF] ^
+                 t3[s[(i + c) & 3] & 0xFF] ^ rk[k + i] for i in range(4)]
+            k += 4
+        return tuple(((sbox[s[i] >> 24] << 24) | (sbox[(s[(i + a) & 3] >> 16) & 0xFF] << 16) |
+                      (sbox[(s[(i + b) & 3] >> 8) & 0xFF] << 8) | sbox[s[(i + c) & 3] & 0xFF]) ^ rk[k + i]
+                     for i in range(4))
+
+
+# DES tables, as in FIPS 46-3: bit positions are 1 based from the most significant bit.
+IP = (58, 50, 42, 34, 26, 18, 10, 2, 60, 52, 44, 36, 28, 20, 12, 4, 62, 54, 46, 38, 30, 22, 14, 6,
+      64, 56, 48, 40, 32, 24, 16, 8, 57, 49, 41, 33, 25, 17, 9, 1, 59, 51, 43, 35, 27, 19, 11, 3,
+      61, 53, 45, 37, 29, 21, 13, 5, 63, 55, 47, 39, 31, 23, 15, 7)
+
+FP = tuple(IP.index(position) + 1 for position in range(1, 65))
+
+PC1 = (57, 49, 41, 33, 25, 17, 9, 1, 58, 50, 42, 34, 26, 18, 10, 2, 59, 51, 43, 35, 27, 19, 11, 3,
+       60, 52, 44, 36, 63, 55, 47, 39, 31, 23, 15, 7, 62, 54, 46, 38, 30, 22, 14, 6, 61, 53, 45, 37,
+       29, 21, 13, 5, 28, 20, 12, 4)
+
+PC2 = (14, 17, 11, 24, 1, 5, 3, 28, 15, 6, 21, 10, 23, 19, 12, 4, 26, 8, 16, 7, 27, 20, 13, 2,
+       41, 52, 31, 37, 47, 55, 30, 40, 51, 45, 33, 48, 44, 49, 39, 56, 34, 53, 46, 42, 50, 36, 29, 32)
+
+P = (16, 7, 20, 21, 29, 12, 28, 17, 1, 15, 23, 26, 5, 18, 31, 10,
+     2, 8, 24, 14, 32, 27, 3, 9, 19, 13, 30, 6, 22, 11, 4, 25)
+
+SHIFTS = (1, 1, 2, 2, 2, 2, 2, 2, 1, 2, 2, 2, 2, 2, 2, 1)
+
+S = (
+    (14, 4, 13, 1, 2, 15, 11, 8, 3, 10, 6, 12, 5, 9, 0, 7, 0, 15, 7, 4, 14, 2, 13, 1, 10, 6, 12, 11, 9, 5, 3, 8,
+     4, 1, 14, 8, 13, 6, 2, 11, 15, 12, 9, 7, 3, 10, 5, 0, 15, 12, 8, 2, 4, 9, 1, 7, 5, 11, 3, 14, 10, 0, 6, 13),
+    (15, 1, 8, 14, 6, 11, 3, 4, 9, 7, 2, 13, 12, 0, 5, 10, 3, 13, 4, 7, 15, 2, 8, 14, 12, 0, 1, 10, 6, 9, 11, 5,
+     0, 14, 7, 11, 10, 4, 13, 1, 5, 8, 12, 6, 9, 3, 2, 15, 13, 8, 10, 1, 3, 15, 4, 2, 11, 6, 7, 12, 0, 5, 14, 9),
+    (10, 0, 9, 14, 6, 3, 15, 5, 1, 13, 12, 7, 11, 4, 2, 8, 13, 7, 0, 9, 3, 4, 6, 10, 2, 8, 5, 14, 12, 11, 15, 1,
+     13, 6, 4, 9, 8, 15, 3, 0, 11, 1, 2, 12, 5, 10, 14, 7, 1, 10, 13, 0, 6, 9, 8, 7, 4, 15, 14, 3, 11, 5, 2, 12),
+    (7, 13, 14, 3, 0, 6, 9, 10, 1, 2, 8, 5, 11, 12, 4, 15, 13, 8, 11, 5, 6, 15, 0, 3, 4, 7, 2, 12, 1, 10, 14, 9,
+     10, 6, 9, 0, 12, 11, 7, 13, 15, 1, 3, 14, 5, 2, 8, 4, 3, 15, 0, 6, 10, 1, 13, 8, 9, 4, 5, 11, 12, 7, 2, 14),
+    (2, 12, 4, 1, 7, 10, 11, 6, 8, 5, 3, 15, 13, 0, 14, 9, 14, 11, 2, 12, 4, 7, 13, 1, 5, 0, 15, 10, 3, 9, 8, 6,
+     4, 2, 1, 11, 10, 13, 7, 8, 15, 9, 12, 5, 6, 3, 0, 14, 11, 8, 12, 7, 1, 14, 2, 13, 6, 15, 0, 9, 10, 4, 5, 3),
+    (12, 1, 10, 15, 9, 2, 6, 8, 0, 13, 3, 4, 14, 7, 5, 11, 10, 15, 4, 2, 7, 12, 9, 5, 6, 1, 13, 14, 0, 11, 3, 8,
+     9, 14, 15, 5, 2, 8, 12, 3, 7, 0, 4, 10, 1, 13, 11, 6, 4, 3, 2, 12, 9, 5, 15, 10, 11, 14, 1, 7, 6, 0, 8, 13),
+    (4, 11, 2, 14, 15, 0, 8, 13, 3, 12, 9, 7, 5, 10, 6, 1, 13, 0, 11, 7, 4, 9, 1, 10, 14, 3, 5, 12, 2, 15, 8, 6,
+     1, 4, 11, 13, 12, 3, 7, 14, 10, 15, 6, 8, 0, 5, 9, 2, 6, 11, 13, 8, 1, 4, 10, 7, 9, 5, 0, 15, 14, 2, 3, 12),
+    (13, 2, 8, 4, 6, 15, 11, 1, 10, 9, 3, 14, 5, 0, 12, 7, 1, 15, 13, 8, 10, 3, 7, 4, 12, 5, 6, 11, 0, 14, 9, 2,
+     7, 11, 4, 1, 9, 12, 14, 2, 0, 6, 10, 13, 15, 3, 5, 8, 2, 1, 14, 7, 4, 10, 8, 13, 15, 12, 9, 0, 3, 5, 6, 11),
+)
+
+
+def permute(value, table, width):
+    """
+    Permute the bits of an integer.
+    :param value: The integer.
+    :param table: Position of the input bit of every output bit, 1 based from the most significant one.
+    :param width: Number of bits of the input.
+    :return: The permuted integer, len(table) bits wide.
+
+    >>> bin(permute(0b1000, (4, 3, 2, 1), 4))
+    '0b1'
+    """
+    out = 0
+    for position in table:
+        out = (out << 1) | ((value >> (width - position)) & 1)
+    return out
+
+
+def _byte_tables(table):
+    """Permutation of 64 bits values as 8 tables of the contribution of every input byte."""
+    return [[permute(value << (56 - 8 * byte), table, 64) for value in range(256)] for byte in range(8)]
+
+
+def _sp_tables():
+    """Output of every S-box, by 6 bits input, already moved to its bits by the P permutation."""
+    tables = []
+    for box in range(8):
+        table = []
+        for six in range(64):
+            row, column = ((six >> 4) & 2) | (six & 1), (six >> 1) & 0xF
+            table.append(permute(S[box][row * 16 + column] << (28 - 4 * box), P, 32))
+        tables.append(table)
+    return tables
+
+
+IP_TABLES, FP_TABLES, SP = _byte_tables(IP), _byte_tables(FP), _sp_tables()
+
+
+def _permute64(value, tables):
+    return (tables[0][value >> 56] | tables[1][(value >> 48) & 0xFF] | tables[2][(value >> 40) & 0xFF] |
+            tables[3][(value >> 32) & 0xFF] | tables[4][(value >> 24) & 0xFF] | tables[5][(value >> 16) & 0xFF] |
+            tables[6][(value >> 8) & 0xFF] | tables[7][value & 0xFF])
+
+
+class DES(object):
+    """DES, blocks are tuples of one 64 bits big endian integer."""
+    block_size = 8
+    layout = 'Q'
+
+    def __init__(self, key):
+        if len(key) < 8:
+            raise InvalidKey("Invalid DES key length: %d bytes." % len(key))
+
+        cd = permute(struct.unpack('>Q', key[:8])[0], PC1, 64)
+        c, d = cd >> 28, cd & 0xFFFFFFF
+        self.subkeys = []
+        for shift in SHIFTS:
+            c = ((c << shift) | (c >> (28 - shift))) & 0xFFFFFFF
+            d = ((d << shift) | (d >> (28 - shift))) & 0xFFFFFFF
+            k = permute((c << 28) | d, PC2, 56)
+            self.subkeys.append(tuple((k >> (42 - 6 * box)) & 0x3F for box in range(8)))
+
+    def encrypt(self, block):
+        return (self.crypt(block[0], self.subkeys),)
+
+    def decrypt(self, block):
+        return (self.crypt(block[0], self.subkeys[::-1]),)
+
+    @staticmethod
+    def crypt(value, subkeys):
+        value = _permute64(value, IP_TABLES)
+        left, right = value >> 32, value & 0xFFFFFFFF
+        s0, s1, s2, s3, s4, s5, s6, s7 = SP
+        for k in subkeys:
+            # the expansion of the right half, as 8 groups of 6 bits overlapping by one bit
+            e = ((right & 1) << 33) | (right << 1) | (right >> 31)
+            left, right = right, left ^ (
+                s0[((e >> 28) & 0x3F) ^ k[0]] | s1[((e >> 24) & 0x3F) ^ k[1]] |
+                s2[((e >> 20) & 0x3F) ^ k[2]] | s3[((e >> 16) & 0x3F) ^ k[3]] |
+                s4[((e >> 12) & 0x3F) ^ k[4]] | s5[((e >> 8) & 0x3F) ^ k[5]] |
+                s6[((e >> 4) & 0x3F) ^ k[6]] | s7[(e & 0x3F) ^ k[7]])
+        return _permute64((right << 32) | left, FP_TABLES)
+
+
+class TripleDES(object):
+    """DESede, with keys of three ( or two ) DES keys."""
+    block_size = 8
+    layout = 'Q'
+
+    def __init__(self, key):
+        if len(key) not in (16, 24):
+            raise InvalidKey("Invalid DESede key length: %d bytes." % len(key))
+        first, second = DES(key[:8]).subkeys, DES(key[8:16]).subkeys
+        third = DES(key[16:24]).subkeys if len(key) == 24 else first
+        self.encryption = (first, second[::-1], third)
+        self.decryption = (third[::-1], second, first[::-1])
+
+    def encrypt(self, block):
+        return (self.__crypt(block[0], self.encryption),)
+
+    def decrypt(self, block):
+        return (self.__crypt(block[0], self.decryption),)
+
+    @staticmethod
+    def __crypt(value, schedule):
+        for subkeys in schedule:
+            value = DES.crypt(value, subkeys)
+        return value
+
+
+# Block ciphers, by Java algorithm name.
+ALGORITHMS = {
+    'AES': AES,
+    'DES': DES,
+    'DESEDE': TripleDES,
+    'TRIPLEDES': TripleDES,
+}
+
+
+def pad(data, size):
+    """
+    Add the PKCS#5 padding to a buffer.
+
+    >>> pad(b'abc', 8) == b'abc' + b'\\x05' * 5
+    True
+    """
+    count = size - len(data) % size
+    return data + struct.pack('B', count) * count
+
+
+def unpad(data, size):
+    """
+    Remove the PKCS#5 padding of a buffer.
+
+    >>> unpad(b'abc' + b'\\x05' * 5, 8) == b'abc'
+    True
+    """
+    count = bytearray(data[-1:])[0] if data else 0
+    if not 0 < count <= size or data[-count:] != data[-1:] * count:
+        raise BadPadding("Given final block not properly padded.")
+    return data[:-count]
+
+
+def crypt(cipher, data, encrypt, iv=None):
+    """
+    Encrypt or decrypt a whole buffer, in ECB mode or in CBC mode if an initialization vector is given.
+    :param cipher: The AES, DES or TripleDES instance.
+    :param data: The bytes, a multiple of the block size.
+    :param encrypt: True to encrypt, False to decrypt.
+    :param iv: The initialization vector of CBC mode, or None.
+    :return: The encrypted or decrypted bytes.
+    """
+    size = cipher.block_size
+    if len(data) % size:
+        raise IllegalBlockSize("Input length not multiple of %d bytes." % size)
+
+    width = len(cipher.layout)
+    count = len(data) // size * width
+    values = struct.unpack('>%d%s' % (count, cipher.layout[0]), data)
+    blocks = [values[i:i + width] for i in range(0, count, width)]
+
+    out = []
+    function = cipher.encrypt if encrypt else cipher.decrypt
+    if iv is None:
+        for block in blocks:
+            out.extend(function(block))
+    else:
+        chain = struct.unpack('>' + cipher.layout, iv[:size])
+        for block in blocks:
+            if encrypt:
+                chain = function(tuple(a ^ b for a, b in zip(block, chain)))
+                out.extend(chain)
+            else:
+                out.extend(a ^ b for a, b in zip(function(block), chain))
+                chain = block
+
+    return struct.pack('>%d%s' % (count, cipher.layout[0]), *out)
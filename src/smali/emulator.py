@@ -22,12 +22,75 @@ from __future__ import print_function
 import sys
 import time
 
-import smali.opcodes
-from smali.vm import VM
+from smali.vm import VM, CatchBlocks
+from smali.object_mapping import ObjectMapping
+from smali.opcodes import Instruction, table
+from smali.parser import count_parameter_registers
+from smali.compiler import Compiler
+from smali.fusion import fuse
+from smali.vectorize import vectorize
+from smali.loader import ClassLoader, Program, SmaliClass
 from smali.source import Source, get_source_from_file
 from smali.preprocessors import *
 
 
+class EmulationError(BaseException):
+    """
+    Fatal error of the emulation, raised instead of quitting when the emulator is embedded.
+    It's not an Exception so that the try/catch blocks of the emulated code can't handle it.
+    """
+    def __init__(self, message, line=None):
+        BaseException.__init__(self, message)
+        self.message = message
+        self.line = line  # number of the line being executed, if any
+
+
+class BudgetExceeded(BaseException):
+    """
+    Result of a run stopped because it exhausted its steps or its time. It's raised to unwind
+    the emulation, and returned in place of the return value of the emulated method.
+    """
+    def __init__(self, reason, vm, steps):
+        self.reason = reason  # 'steps' or 'deadline'
+        self.pc = vm.pc       # offset of the next instruction to execute
+        self.line = vm.code[vm.pc].index + 1 if vm.pc < len(vm.code) else None  # its line number
+        self.steps = steps    # number of executed steps
+        BaseException.__init__(self, "Budget exceeded ( %s ) at pc %d, line %s, after %d steps." % (
+            self.reason, self.pc, self.line, self.steps))
+
+
+class Budget(object):
+    """
+    Steps and time left to a run, checked between slices of 'interval' steps, whose last one
+    ends at max_steps exactly, compiled or not. Invoked methods run their own slices, the steps
+    of the slices interrupted in their callers are accounted once those end, so nested calls
+    can go past max_steps by up to a slice per call.
+    """
+    interval = 1000
+
+    def __init__(self, max_steps=None, deadline=None):
+        self.max_steps = max_steps  # maximum number of steps, unlimited if None
+        self.expires = None if deadline is None else time.time() + deadline  # time limit, if any
+        self.steps = 0  # number of steps executed so far
+
+    def next(self, vm):
+        """
+        Check the budget before running a slice of instructions.
+        :param vm: Instance of the VM.
+        :return: The number of steps which can be executed before the next check.
+        """
+        if self.expires is not None and time.time() >= self.expires:
+            raise BudgetExceeded('deadline', vm, self.steps)
+
+        if self.max_steps is None:
+            return self.interval
+
+        left = self.max_steps - self.steps
+        if left <= 0:
+            raise BudgetExceeded('steps', vm, self.steps)
+        return min(left, self.interval)
+
+
 class Stats(object):
     """Statistics about the running process."""
     def __init__(self, vm):
@@ -35,6 +98,7 @@ class Stats(object):
         self.preproc = 0
         self.execution = 0
         self.steps = 0
+        self.fused = 0
 
     def __repr__(self):
         return (
@@ -42,7 +106,8 @@ class Stats(object):
             "preprocessing time : {} ms\n"
             "execution time     : {} ms\n"
             "execution steps    : {}\n"
-        ).format(self.opcodes, self.preproc, self.execution, self.steps)
+            "fused steps        : {}\n"
+        ).format(self.opcodes, self.preproc, self.execution, self.steps, self.fused)
 
 
 class Emulator(object):
@@ -53,22 +118,36 @@ class Emulator(object):
         # Code preprocessors.
         self.preprocessors = [TryCatchPreprocessor, PackedSwitchPreprocessor, ArrayDataPreprocessor]
 
-        self.opcodes = []  # Opcodes handlers.
-        for op_code_symbol in [entry for entry in dir(smali.opcodes) if entry.startswith('op_')]:
-            self.opcodes.append(getattr(smali.opcodes, op_code_symbol)())
+        self.table = table()                             # Opcodes table, shared by all the emulators of the process.
+        self.opcodes = self.table.handlers               # Opcodes handlers, in matching order.
 
+        self.mapping = kwargs.get('mapping') or ObjectMapping()  # Java objects and methods models, shared by the VMs.
         self.vm = kwargs.get('vm') or VM(self)           # Instance of the virtual machine.
+        self.spare = self.vm                             # VM reset and reused by run and run_method.
         self.source = kwargs.get('source')               # Instance of the source file.
         self.stats = kwargs.get('stats') or Stats(self)  # Instance of the statistics object.
+        self.cache = kwargs.get('cache')                 # Optional ProgramCache instance.
+        self.fusion = kwargs.get('fusion', True)         # Replace common opcodes sequences with superinstructions.
+        self.vectorize = kwargs.get('vectorize', True)   # Run counted loops over arrays with NumPy, if available.
+        self.loader = kwargs.get('loader') or ClassLoader()  # Index of the methods of the loaded class files.
+        self.trace = False                               # Print every opcode being executed.
+        self.exit = kwargs.get('exit', True)             # Quit on fatal errors, raise EmulationError otherwise.
+        self.max_steps = kwargs.get('max_steps')         # Maximum number of steps of every run, unlimited if None.
+        self.deadline = kwargs.get('deadline')           # Maximum seconds of execution of every run, unlimited if None.
+        self.budget = None                               # Budget of the current run, if limited.
+        self.profiler = kwargs.get('profiler')           # Optional smali.profiler.Profiler instance, runs are interpreted if set.
 
     def __preprocess(self):
         """
-        Start the preprocessing phase which will save all the labels and their line index
-        for fast lookups while jumping and will pre parse all the try/catch directives.
+        Start the preprocessing phase, a single pass which will save all the labels and their
+        line index for fast lookups while jumping, the try/catch directives and the packed-switch
+        and array-data blocks.
+        :return: The set of the indexes of the lines of the packed-switch and array-data blocks.
         """
+        payload = set()
         next_line = None
-        self.source.lines = [line.strip() for line in self.source.lines]
-        for index, line in enumerate(self.source.lines):
+        lines = self.source.lines = [line.strip() for line in self.source.lines]
+        for index, line in enumerate(lines):
             # we're inside a block which was already processed
             if next_line is not None and index <= next_line:
                 next_line = None if index == next_line else next_line
@@ -78,24 +157,104 @@ class Emulator(object):
             elif line == '':
                 continue
 
-            elif line[0] == ':':  # we've found something to preprocess
+            elif line[0] == ':' or line[0] == '.':  # we've found something to preprocess
                 # loop each preprocessors and search for the one responsible to parse this line
-                # TODO: refactor this block. This is a dirty way to do the branching.
-                # TODO: It should use a dictionary or  something like that.
                 for preproc in self.preprocessors:
                     if preproc.check(line):
-                        next_line = preproc.process(self.vm, line, index, self.source.lines)
+                        next_line = preproc.process(self.vm, line, index, lines)
+                        if next_line is not None:
+                            payload.update(range(index, next_line + 1))
                         break
                 else:
-                    self.vm.labels[line] = index
+                    if line[0] == ':':
+                        self.vm.labels[line] = index
+
+        # try blocks are delimited by labels, resolved to line indexes now that they're all known
+        labels = self.vm.labels
+        self.vm.catch_blocks = [(labels[start], labels[end], handler, name)
+                                for start, end, handler, name in self.vm.catch_blocks
+                                if start in labels and end in labels]
+        return payload
+
+    def __match(self, payload):
+        """
+        Match every line of code against the opcodes handlers.
+        :param payload: Indexes of the lines which are data, not code.
+        :return: A list of ( line index, opcode class name, raw operands ) tuples, the class name
+                 is None if the line does not correspond to any supported opcode.
+        """
+        matches = []
+        for index, line in enumerate(self.source.lines):
+            if self.__should_skip_line(line) or index in payload:
+                continue
+
+            # Search for appropriate opcode.
+            for opcode in self.opcodes:
+                args = opcode.match(line)
+                if args is not None:
+                    matches.append((index, opcode.__class__.__name__, args))
+                    break
+            else:
+                matches.append((index, None, ()))
+
+        return matches
+
+    def __decode(self, matches):
+        """
+        Start the decoding phase which will turn every matched line into an instruction,
+        so that the main loop can dispatch without matching any regular expression.
+        Labels and try/catch blocks are resolved from line indexes to opcodes offsets.
+        """
+        lines = self.source.lines
+        base = self.source.start
+        offsets = []  # offset of the first instruction at or after each line
+        for pc, match in enumerate(matches):
+            offsets.extend([pc] * (match[0] + 1 - len(offsets)))
+        offsets.extend([len(matches)] * (len(lines) + 1 - len(offsets)))
 
-    def __parse_line(self, line):
-        # Search for appropriate parser.
-        for parser in self.opcodes:
-            if parser.parse(line, self.vm):
-                return True
+        vm = self.vm
+        vm.labels = dict((label, offsets[index]) for label, index in vm.labels.items())
+        vm.catch_blocks = CatchBlocks([(offsets[start], offsets[end], vm.labels[label], name)
+                                       for start, end, label, name in vm.catch_blocks], len(matches) + 2)
 
-        return False
+        opcodes = self.table.by_name
+        vm.code = []
+        for index, name, args in matches:
+            if name is None:
+                insn = Instruction(Instruction.unsupported, (), base + index, lines[index])
+            else:
+                opcode = opcodes[name]
+                try:
+                    insn = Instruction(opcode.eval, opcode.decode(vm, args), base + index, lines[index], opcode)
+                except Exception as e:
+                    # operands which can't be decoded will raise once executed
+                    insn = Instruction(Instruction.error, (e,), base + index, lines[index])
+            vm.code.append(insn)
+
+        # falling off the end of the code stops the execution
+        vm.code.append(Instruction(Instruction.halt, (), base + len(lines), ''))
+
+    def __allocate(self):
+        """
+        Allocate a register file if the code declares the registers count of its method
+        with a .locals or .registers directive, otherwise registers are kept by name.
+        """
+        methods = []
+        directives = []
+        for line in self.source.lines:
+            if line.startswith('.method '):
+                methods.append(line)
+            elif line.startswith('.locals ') or line.startswith('.registers '):
+                directives.append(line)
+
+        # the layout is ambiguous if there's more than one method
+        if len(directives) != 1 or len(methods) > 1:
+            return
+
+        directive, count = directives[0].split()
+        count = OpCode.get_int_value(count)
+        params = count_parameter_registers(methods[0]) if methods else 0
+        self.vm.allocate(count + params if directive == '.locals' else count, params)
 
     @staticmethod
     def __should_skip_line(line):
@@ -111,60 +270,335 @@ class Emulator(object):
         Display an error message, the current line being executed and quit.
         :param message: The error message to display.
         """
+        insn = None
+        if 0 < self.vm.pc <= len(self.vm.code):
+            insn = self.vm.code[self.vm.pc - 1]
+
+        if self.exit is False:
+            raise EmulationError(message, None if insn is None else insn.index + 1)
+
         print("\n-------------------------")
-        print("Fatal error on line %03d:\n" % self.vm.pc)
-        print("  %03d %s" % (self.vm.pc, self.source[self.vm.pc - 1]))
+        if insn is not None:
+            print("Fatal error on line %03d:\n" % (insn.index + 1))
+            print("  %03d %s" % (insn.index + 1, insn.line))
         print("\n%s" % message)
         sys.exit()
 
-    def run_file(self, filename, args={}, trace=False):
-        return self.run(get_source_from_file(filename), args, trace)
+    def run_file(self, filename, args={}, trace=False, compiled=False, method=None):
+        if method is not None:
+            return self.run_method(self.loader.load_file(filename).method(method), args, trace, compiled=compiled)
+        return self.run(get_source_from_file(filename), args, trace, compiled=compiled)
 
-    def run_source(self, source_code, args={}, trace=False):
-        return self.run(Source(lines=source_code), args, trace)
+    def run_source(self, source_code, args={}, trace=False, compiled=False, method=None):
+        if method is not None:
+            return self.run_method(SmaliClass(source_code).method(method), args, trace, compiled=compiled)
+        return self.run(Source(lines=source_code), args, trace, compiled=compiled)
 
     def preproc_source(self, source_object=None):
-        """Preprocess labels and try/catch blocks for fast lookup."""
+        """
+        Preprocess labels and try/catch blocks for fast lookup and decode the code.
+        If a cache is available, a program which was already preprocessed is loaded from
+        there instead of being parsed again.
+        """
         self.source = self.source or source_object
         s = time.time() * 1000
-        self.__preprocess()
+        self.__prepare()
         e = time.time() * 1000
         self.stats.preproc = e - s
 
-    def run(self, source_object, args={}, trace=False, vm=None):
+    def __prepare(self):
+        """Preprocess and decode the source into the VM, going through the cache if any."""
+        key = self.cache.key(self.table.signature, self.source.lines) if self.cache else None
+        program = self.cache.load(key) if self.cache else None
+        if program is not None:
+            self.source.lines = program['lines']
+            self.vm.labels = program['labels']
+            self.vm.catch_blocks = program['catch_blocks']
+            self.vm.packed_switches = program['packed_switches']
+            self.vm.array_data = program['array_data']
+            matches = program['matches']
+        else:
+            matches = self.__match(self.__preprocess())
+            if self.cache:
+                self.cache.store(key, {
+                    'lines': self.source.lines,
+                    'labels': self.vm.labels,
+                    'catch_blocks': self.vm.catch_blocks,
+                    'packed_switches': self.vm.packed_switches,
+                    'array_data': self.vm.array_data,
+                    'matches': matches,
+                })
+        self.__allocate()
+        self.__decode(matches)
+        if self.fusion:
+            fuse(self.vm)
+        if self.vectorize:
+            vectorize(self.vm)
+
+    def load(self, method):
+        """
+        Preprocess and decode a method the first time it's needed.
+        :param method: A smali.loader.Method instance.
+        :return: The smali.loader.Program instance of the method.
+        """
+        if method.program is None:
+            vm, source = self.vm, self.source
+            self.vm, self.source = VM(self), Source(lines=method.lines, start=method.start)
+            try:
+                self.__prepare()
+                method.program = Program(self.vm, method)
+            finally:
+                self.vm, self.source = vm, source
+        return method.program
+
+    def run(self, source_object, args={}, trace=False, vm=None, compiled=False):
         """
         Load a smali file and start emulating it.
         :param source_object: A Source() instance containing the source code to run.
         :param args: A dictionary of optional initialization variables for the VM, used for arguments.
         :param trace: If true every opcode being executed will be printed.
+        :param compiled: If true the code is compiled to a python function before being run, the
+                         interpreter takes over wherever the compiled code can't go on by itself.
         :return: The return value of the emulated method or None if no return-* opcode was executed.
         """
-        OpCode.trace = trace
         self.source = source_object
-        self.vm = VM(self) if not vm else vm
+        self.vm = vm or self.spare.reset()
         self.stats = Stats(self)
 
+        self.preproc_source(self.source)
+
         if len(args) > 0:
             self.vm.variables.update(args)
+        self.budget = self.__budget()
 
-        self.preproc_source(self.source)
+        return self.__execute(trace, compiled)
 
-        # Loop each line and emulate.
+    def run_method(self, method, args={}, trace=False, vm=None, compiled=False):
+        """
+        Emulate a single method of a class, its code is preprocessed and decoded the first
+        time it's run and shared by the following runs.
+        :param method: A smali.loader.Method instance.
+        :param args: A dictionary of optional initialization variables for the VM, used for arguments.
+        :param trace: If true every opcode being executed will be printed.
+        :param compiled: If true the code is compiled to a python function before being run.
+        :return: The return value of the emulated method or None if no return-* opcode was executed,
+                 or a BudgetExceeded instance if the run exhausted its max_steps or deadline.
+        """
+        self.__load_method(method, args, vm or self.spare.reset())
+        return self.__execute(trace, compiled)
+
+    def prepare(self, method, args={}, vm=None):
+        """
+        Load a method in the VM and initialize its arguments, ready to be run.
+        :param method: A smali.loader.Method instance.
+        :param args: A dictionary of optional initialization variables for the VM, used for arguments.
+        :param vm: The VM to load the method in, a new one if None.
+        :return: The VM.
+        """
+        return self.__load_method(method, args, vm or VM(self))
+
+    def __load_method(self, method, args, vm):
+        """Load a method in a VM, which becomes the VM of the emulator, and initialize its arguments."""
+        self.vm = vm
+        self.stats = Stats(self)
 
         s = time.time() * 1000
-        while self.vm.stop is False and self.source.has_line(self.vm.pc):
-            self.stats.steps += 1
-            line = self.source[self.vm.pc]
-            self.vm.pc += 1
+        self.vm.load(self.load(method))
+        self.vm.klass = method.klass
+        e = time.time() * 1000
+        self.stats.preproc = e - s
 
-            if self.__should_skip_line(line):
-                continue
+        if len(args) > 0:
+            self.vm.variables.update(args)
+        self.budget = self.__budget()
+        return self.vm
 
-            elif self.__parse_line(line) is False:
-                self.fatal("Unsupported opcode.")
+    def run_many(self, method, iterable_of_args, compiled=False):
+        """
+        Emulate a method once for every set of arguments, the method is preprocessed, decoded
+        ( and compiled ) only once and just the registers are reset between the runs.
+        :param method: A smali.loader.Method instance.
+        :param iterable_of_args: An iterable of dictionaries of initialization variables for the VM.
+        :param compiled: If true the method is compiled to a python function before the first run.
+        :return: A generator of ( return value, execution steps ) tuples, one per set of arguments.
+        """
+        self.vm = vm = VM(self)
+        self.stats = stats = Stats(self)
+
+        s = time.time() * 1000
+        vm.load(self.load(method))
+        vm.klass = method.klass
+        function, leaders = None, None
+        if compiled is True and self.profiler is None:
+            function, leaders = self.__compile(vm, self.__budget() is not None)
+        e = time.time() * 1000
+        stats.preproc = e - s
+
+        for args in iterable_of_args:
+            vm.restart()
+            if len(args) > 0:
+                vm.variables.update(args)
+            # other runs of the emulator may have happened since the previous set of arguments
+            self.trace = False
+            self.budget = self.__budget()
+
+            s = time.time() * 1000
+            result, steps = self.__run(vm, function, leaders)
+            e = time.time() * 1000
+
+            stats.execution += e - s
+            stats.steps += steps
+            stats.fused += vm.fused
+            yield result, steps
+
+    def __execute(self, trace, compiled):
+        """Run the decoded code and update the statistics."""
+        vm = self.vm
+        self.trace = trace
+
+        s = time.time() * 1000
+        function, leaders = None, None
+        if compiled is True and trace is False and self.profiler is None:
+            function, leaders = self.__compile(vm, self.budget is not None)
+
+        result, steps = self.__run(vm, function, leaders)
 
         e = time.time() * 1000
         self.stats.execution = e - s
+        self.stats.steps = steps
+        self.stats.fused = vm.fused
+
+        return result
+
+    def __budget(self):
+        """A new budget for a run, if its steps or time are limited."""
+        if self.max_steps is None and self.deadline is None:
+            return None
+        return Budget(self.max_steps, self.deadline)
+
+    @staticmethod
+    def __compile(vm, limited):
+        """
+        Compile the code loaded in the VM, the function of a method is compiled once and kept
+        with its program for the following runs.
+        :param vm: Instance of the VM.
+        :param limited: True if the function has to return to check the budget of the run.
+        :return: A ( function, leaders ) tuple, leaders are the offsets the function can start from.
+        """
+        program = vm.program
+        compiled = program.functions.get(limited) if program is not None else None
+        if compiled is None:
+            compiler = Compiler(vm, limited)
+            compiled = (compiler.compile(), frozenset(compiler.leaders))
+            if program is not None:
+                program.functions[limited] = compiled
+        return compiled
+
+    def __run(self, vm, function, leaders):
+        """
+        Run the code loaded in the VM, starting with its compiled function if any.
+        :return: A ( result, steps ) tuple, the result is a BudgetExceeded instance if the run
+                 exhausted its budget, otherwise the return value of the method.
+        """
+        budget = self.budget
+        steps = 0
+        try:
+            if function is not None and budget is None:
+                steps = function(vm, vm.pc)
+            elif function is not None:
+                # compiled code returns to check the budget before a block, where it can resume
+                while vm.stop is False and vm.pc in leaders:
+                    executed = function(vm, vm.pc, budget.next(vm))
+                    budget.steps += executed
+                    steps += executed
+                    if executed == 0:
+                        # the block is longer than the steps left, the interpreter runs it step by step
+                        break
+
+            steps += self.interpret(vm)
+            return vm.return_v, steps + vm.steps
+
+        except BudgetExceeded as exceeded:
+            return exceeded, exceeded.steps
+
+    def interpret(self, vm):
+        """
+        Run the code loaded in the VM until it stops, in slices checked against the budget of
+        the run if there's one, or measured by the profiler if it's set.
+        :param vm: Instance of the VM.
+        :return: The number of executed steps.
+        """
+        budget = self.budget
+        profiler = self.profiler
+        if budget is not None or profiler is not None:
+            if profiler is not None:
+                profiler.enter(vm)
+            try:
+                steps = 0
+                while vm.stop is False:
+                    executed = self.step(vm, Budget.interval if budget is None else budget.next(vm))
+                    if budget is not None:
+                        budget.steps += executed
+                    steps += executed
+                return steps
+            finally:
+                if profiler is not None:
+                    profiler.leave()
+
+        code = vm.code
+        trace = self.trace
+        steps = 0
+
+        # Loop each instruction and emulate.
+        while vm.stop is False:
+            try:
+                while vm.stop is False:
+                    insn = code[vm.pc]
+                    vm.pc += 1
+                    steps += 1
+                    if trace is True:
+                        for part in insn.parts or (insn,):
+                            print("%03d %s" % (part.index + 1, part.line))
+                    insn.eval(vm, *insn.args)
+
+            except Exception as e:
+                vm.exception(e)
+
+        return steps
+
+    def step(self, vm, count):
+        """
+        Run at most 'count' instructions of the code loaded in the VM, so that the execution
+        can be interleaved with other work. Invoked methods run to completion within the slice,
+        unless the VM is stepping, then they're entered and run in the slices of their caller.
+        :param vm: Instance of the VM.
+        :param count: Maximum number of instructions to execute.
+        :return: The number of executed steps.
+        """
+        trace = self.trace
+        profiler = self.profiler
+        steps = 0
+
+        while vm.stop is False and steps < count:
+            try:
+                while vm.stop is False and steps < count:
+                    insn = vm.code[vm.pc]
+                    vm.pc += 1
+                    steps += 1
+                    if trace is True:
+                        for part in insn.parts or (insn,):
+                            print("%03d %s" % (part.index + 1, part.line))
+                    if profiler is not None:
+                        profiler.execute(vm, insn)
+                    else:
+                        insn.eval(vm, *insn.args)
+
+            except Exception as e:
+                vm.exception(e)
+
+            # a method entered by the stepping VM returned to its caller
+            if vm.stop is True and vm.stepping and vm.frames:
+                vm.resume()
 
-        return self.vm.return_v
+        return steps
 
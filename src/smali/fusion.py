@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Smali Emulator.
+#
+# Copyright(c) 2016 Simone 'evilsocket' Margaritelli
+# evilsocket@gmail.com
+# http://www.evilsocket.net
+#
+# This file may be licensed under the terms of of the
+# GNU General Public License Version 3 (the ``GPL'').
+#
+# Software distributed under the License is distributed
+# on an ``AS IS'' basis, WITHOUT WARRANTY OF ANY KIND, either
+# express or implied. See the GPL for the specific language
+# governing rights and limitations.
+#
+# You should have received a copy of the GPL along with this
+# program. If not, go to http://www.gnu.org/licenses/gpl.html
+# or write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import operator
+
+from smali.opcodes import (
+    Instruction, op_Move, op_MoveResult, op_Invoke, op_Aget, op_XorInt2Addr, op_XorIntLit,
+    op_IntToType, op_AddIntLit, op_PackedSwitch,
+)
+
+# Comparison operators used by the if-* condition templates.
+OPERATORS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+
+# Superinstructions, each one does the work of a sequence of opcodes in a single dispatch.
+# The fused instruction replaces the first one of the sequence while the other ones are left
+# in place, so that offsets don't change, and the handler skips them by moving vm.pc forward.
+
+class AddIntLitIf(object):
+    """add-int/lit* followed by a two registers if-*."""
+    @staticmethod
+    def eval(vm, vx, vy, lit, compare, va, vb, target):
+        vm.fused += 1
+        regs = vm.regs
+        regs[vx] = regs[vy] + lit
+        if compare(regs[va], regs[vb]):
+            vm.pc = target
+        else:
+            vm.pc += 1
+
+
+class AddIntLitIfz(object):
+    """add-int/lit* followed by an if-*z."""
+    @staticmethod
+    def eval(vm, vx, vy, lit, compare, va, target):
+        vm.fused += 1
+        regs = vm.regs
+        regs[vx] = regs[vy] + lit
+        if compare(regs[va], 0):
+            vm.pc = target
+        else:
+            vm.pc += 1
+
+
+class AgetXorToChar(object):
+    """aget followed by xor-int/2addr ( or xor-int/lit* when lit is not None ) and int-to-char."""
+    @staticmethod
+    def eval(vm, va, varr, vidx, vx, vy, lit, vc, vd):
+        vm.fused += 1
+        regs = vm.regs
+        regs[va] = regs[varr][regs[vidx]]
+        y = regs[vy]
+        y = int(y) if isinstance(y, int) else ord(y)
+        if lit is None:
+            regs[vx] ^= y
+        else:
+            regs[vx] = y ^ lit
+        regs[vc] = chr(regs[vd] & 0xFF)
+        vm.pc += 2
+
+
+class MoveChain(object):
+    """A sequence of move opcodes."""
+    @staticmethod
+    def eval(vm, moves):
+        vm.fused += 1
+        regs = vm.regs
+        for vx, vy in moves:
+            regs[vx] = regs[vy]
+        vm.pc += len(moves) - 1
+
+
+class InvokeMoveResult(object):
+    """invoke-* followed by move-result, with the move opcodes around them."""
+    @staticmethod
+    def eval(vm, before, this, site, args, dest, after):
+        vm.fused += 1
+        regs = vm.regs
+        for vx, vy in before:
+            regs[vx] = regs[vy]
+        target = site.target if site.owner is vm.klass else site.resolve(vm)
+        result = target(vm, this, args)
+        if vm.regs is not regs:
+            # the method was entered by a stepping VM, the rest runs once it returns
+            vm.frames[-1].resume = (InvokeMoveResult.resume, (dest, after, len(before) + len(after) + 1))
+            return
+        if result is not None:
+            vm.return_v = result
+        InvokeMoveResult.resume(vm, dest, after, len(before) + len(after) + 1)
+
+    @staticmethod
+    def resume(vm, dest, after, skip):
+        regs = vm.regs
+        regs[dest] = vm.return_v
+        for vx, vy in after:
+            regs[vx] = regs[vy]
+        vm.pc += skip
+
+
+def fuse(vm):
+    """
+    Replace the most common opcodes sequences of the decoded code with superinstructions.
+    A sequence is fused only if no jump lands in its middle and all of its instructions are
+    covered by the same try/catch blocks.
+    :param vm: Instance of the VM holding the decoded code.
+    :return: The number of fused sequences.
+    """
+    code = vm.code
+    targets = set(target for start, end, target, name in vm.catch_blocks)
+    for insn in code:
+        if insn.opcode is not None:
+            targets.update(insn.args[idx] for idx in insn.opcode.targets)
+            if isinstance(insn.opcode, op_PackedSwitch):
+                targets.update(insn.args[2])
+
+    def catch_blocks(pc):
+        return vm.catch_blocks.handlers(pc + 1)
+
+    def is_a(pc, klass):
+        return pc < len(code) and isinstance(code[pc].opcode, klass)
+
+    def fusible(start, end):
+        return all(pc not in targets for pc in range(start + 1, end)) and \
+            all(catch_blocks(pc) == catch_blocks(start) for pc in range(start + 1, end))
+
+    def moves(pc, leading=True):
+        end = pc
+        while is_a(end, op_Move) and ((leading and end == pc) or end not in targets):
+            end += 1
+        return [code[idx].args for idx in range(pc, end)]
+
+    count = 0
+    pc = 0
+    while pc < len(code):
+        fused = None
+        before = moves(pc)
+        invoke = pc + len(before)
+
+        if is_a(invoke, op_Invoke) and is_a(invoke + 1, op_MoveResult):
+            after = moves(invoke + 2, leading=False)
+            end = invoke + 2 + len(after)
+            this, site, args = code[invoke].args
+            fused = (InvokeMoveResult.eval, end,
+                     (tuple(before), this, site, args, code[invoke + 1].args[0], tuple(after)))
+
+        elif len(before) > 1:
+            fused = (MoveChain.eval, pc + len(before), (tuple(before),))
+
+        elif is_a(pc, op_Aget) and is_a(pc + 1, (op_XorInt2Addr, op_XorIntLit)) and \
+                is_a(pc + 2, op_IntToType) and code[pc + 2].args[0] == 'char':
+            xor = code[pc + 1].args
+            vx, vy, lit = xor if len(xor) == 3 else xor + (None,)
+            fused = (AgetXorToChar.eval, pc + 3, code[pc].args + (vx, vy, lit) + code[pc + 2].args[1:])
+
+        elif is_a(pc, op_AddIntLit) and pc + 1 < len(code) and code[pc + 1].opcode is not None:
+            branch = code[pc + 1]
+            condition = branch.opcode.condition
+            if condition is not None and condition != 'True':
+                left, compare, right = condition.split()
+                if right == '0':
+                    fused = (AddIntLitIfz.eval, pc + 2,
+                             code[pc].args + (OPERATORS[compare], branch.args[0], branch.args[1]))
+                else:
+                    fused = (AddIntLitIf.eval, pc + 2,
+                             code[pc].args + (OPERATORS[compare],) + branch.args)
+
+        if fused is not None and fusible(pc, fused[1]):
+            handler, end, args = fused
+            first = code[pc]
+            code[pc] = Instruction(handler, args, first.index, first.line, parts=tuple(code[pc:end]))
+            count += 1
+            pc = end
+        else:
+            pc += 1
+
+    return count
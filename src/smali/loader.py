@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Smali Emulator.
+#
+# Copyright(c) 2016 Simone 'evilsocket' Margaritelli
+# evilsocket@gmail.com
+# http://www.evilsocket.net
+#
+# This file may be licensed under the terms of of the
+# GNU General Public License Version 3 (the ``GPL'').
+#
+# Software distributed under the License is distributed
+# on an ``AS IS'' basis, WITHOUT WARRANTY OF ANY KIND, either
+# express or implied. See the GPL for the specific language
+# governing rights and limitations.
+#
+# You should have received a copy of the GPL along with this
+# program. If not, go to http://www.gnu.org/licenses/gpl.html
+# or write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+import os
+import re
+import copy
+from collections import OrderedDict
+
+from smali.opcodes import OpCode, op_ConstString
+from smali.parser import METHOD_PATTERN, FIELD_PATTERN, count_parameter_registers
+from smali.source import get_source_from_file
+
+
+class MethodNotFound(Exception):
+    pass
+
+
+class ClassNotFound(Exception):
+    pass
+
+
+def search_paths(directory):
+    """
+    Directories holding the class files of an apktool output tree, one per dex file
+    ( smali, smali_classes2, ... ), or the directory itself if it's not such a tree.
+    :param directory: Root of the apktool output, or a directory of class files.
+    :return: The list of directories to search classes in.
+    """
+    paths = sorted(os.path.join(directory, entry) for entry in os.listdir(directory)
+                   if entry.startswith('smali') and os.path.isdir(os.path.join(directory, entry)))
+    return paths or [directory]
+
+
+class Program(object):
+    """The preprocessed and decoded code of a method, shared by all of its runs."""
+    __slots__ = ('code', 'labels', 'catch_blocks', 'packed_switches', 'array_data', 'slots', 'size',
+                 'params', 'blank', 'free', 'method', 'functions')
+
+    def __init__(self, vm, method=None):
+        self.code = vm.code
+        self.labels = vm.labels
+        self.catch_blocks = vm.catch_blocks
+        self.packed_switches = vm.packed_switches
+        self.array_data = vm.array_data
+        self.slots = None if vm.slots is None else dict(vm.slots)
+        self.size = len(vm.regs)
+        if self.slots is None:
+            self.params = None
+        else:
+            count = len([name for name in self.slots if name.startswith('p')])
+            self.params = tuple(self.slots['p%d' % i] for i in range(count))
+        self.blank = (None,) * self.size  # initial content of the registers
+        self.free = []  # register files, with their layout, free for reuse by the next invoke
+        self.method = method  # Method instance this is the code of, if any
+        self.functions = {}  # limited -> ( compiled function, leaders ), compiled on first use
+
+
+class Method(object):
+    """Entry of the methods index of a class, its code is preprocessed and decoded on first use."""
+    def __init__(self, klass, name, descriptor, modifiers, start):
+        self.klass = klass            # SmaliClass this method belongs to
+        self.name = name              # method name, like field5
+        self.descriptor = descriptor  # parameters and return types, like ([II)Ljava/lang/String;
+        self.modifiers = modifiers    # access flags, like ['public', 'static']
+        self.start = start            # index of the .method line
+        self.end = None               # index of the line following .end method
+        self.registers = None         # registers count, parameters included
+        self.program = None           # Program instance, once loaded
+
+    @property
+    def signature(self):
+        return self.name + self.descriptor
+
+    @property
+    def static(self):
+        return 'static' in self.modifiers
+
+    @property
+    def lines(self):
+        return self.klass.lines[self.start:self.end]
+
+    def __repr__(self):
+        return "%s lines %d-%d registers %s" % (self.signature, self.start + 1, self.end, self.registers)
+
+
+# integer literals, with the byte, short and long suffixes of smali
+INT_LITERAL = re.compile(r'^(-?(?:0x[0-9a-f]+|\d+))[tsl]?$', re.IGNORECASE)
+CONSTANTS = {'true': 1, 'false': 0, 'null': None}
+
+
+def default_value(descriptor, literal=None):
+    """
+    Initial value of a static field.
+    :param descriptor: The field type, like I or [B
+    :param literal: The value the field is declared with, if any, like 0x10L, 1.5f, true, 'c' or "key".
+    :return: The literal value, or the default value of the type.
+    """
+    if literal is None:
+        if descriptor[0] in 'L[':
+            return None
+        return 0.0 if descriptor in ('F', 'D') else 0
+
+    elif literal in CONSTANTS:
+        return CONSTANTS[literal]
+
+    elif len(literal) > 1 and literal[0] in '"\'' and literal[-1] == literal[0]:
+        value = op_ConstString.operands(None, None, literal[1:-1])[1]
+        return ord(value) if descriptor == 'C' else value
+
+    match = INT_LITERAL.match(literal)
+    if match is not None:
+        return OpCode.get_int_value(match.group(1))
+
+    try:
+        return float(literal.rstrip('fFdD'))
+    except ValueError:
+        raise ValueError("Unsupported initial value %s of a field of type %s." % (literal, descriptor))
+
+
+class SmaliClass(object):
+    """
+    Index of the methods of a smali class, built with a single scan of its lines, and store of
+    its static fields, which are initialized by <clinit> the first time one of them is accessed
+    and keep their values for as long as the class is loaded.
+    """
+    def __init__(self, lines, filename=None):
+        self.lines = lines
+        self.filename = filename
+        self.name = None    # class descriptor, like Lcom/example/Decryptor;
+        self.methods = []   # methods in declaration order
+        self.signatures = {}  # methods by signature
+        self.defaults = {}  # declared static fields, by descriptor like Lcom/example/Decryptor;->key:[B
+        self.fields = {}    # values of the static fields, by descriptor
+        self.initialized = False  # true once <clinit> was run, or while it runs
+
+        method = None
+        for index, line in enumerate(lines):
+            line = line.strip()
+            if line.startswith('.class '):
+                self.name = line.split()[-1]
+
+            elif line.startswith('.field '):
+                match = FIELD_PATTERN.match(line)
+                if match is not None and 'static' in (match.group(1) or '').split():
+                    name = match.group(2)
+                    self.defaults['%s->%s' % (self.name, name)] = default_value(name.split(':', 1)[1], match.group(3))
+
+            elif line.startswith('.method '):
+                match = METHOD_PATTERN.match(line)
+                modifiers = (match.group(1) or '').split()
+                name, descriptor = line.split()[-1].split('(', 1)
+                method = Method(self, name, '(' + descriptor, modifiers, index)
+
+            elif method is None:
+                continue
+
+            elif line.startswith('.locals ') or line.startswith('.registers '):
+                directive, count = line.split()
+                count = OpCode.get_int_value(count)
+                if directive == '.locals':
+                    count += count_parameter_registers(lines[method.start])
+                method.registers = count
+
+            elif line == '.end method':
+                method.end = index + 1
+                self.methods.append(method)
+                self.signatures[method.signature] = method
+                method = None
+
+        self.fields = dict(self.defaults)
+
+    def method(self, name):
+        """
+        Find a method by signature, like field5([II)Ljava/lang/String;, or by name alone.
+        :param name: The method signature or name.
+        :return: The Method instance, the first one declared if the name is overloaded.
+        """
+        method = self.signatures.get(name)
+        if method is not None:
+            return method
+
+        for method in self.methods:
+            if method.name == name:
+                return method
+
+        raise MethodNotFound("Method '%s' not found in class '%s'." % (name, self.name or self.filename))
+
+    def clone(self):
+        """
+        Copy the class, sharing its methods and their programs, with static fields of its own.
+        :return: The new SmaliClass instance.
+        """
+        klass = copy.copy(self)
+        klass.fields = dict(self.fields)
+        return klass
+
+    def initialize(self, vm):
+        """
+        Run the static initializer of the class, unless it already ran. The class is marked as
+        initialized before <clinit> starts, so that the fields it accesses don't run it again,
+        and its static fields go back to their initial values if it fails, to run it again on
+        the next access.
+        :param vm: The VM to run <clinit> on, its state is left untouched.
+        """
+        if self.initialized:
+            return
+
+        self.initialized = True
+        method = self.signatures.get('<clinit>()V')
+        if method is None:
+            return
+
+        result, return_v = vm.result, vm.return_v
+        try:
+            vm.call(method, None, ())
+        except BaseException:
+            self.fields = dict(self.defaults)
+            self.initialized = False
+            raise
+        finally:
+            vm.result, vm.return_v = result, return_v
+
+
+class ClassLoader(object):
+    """
+    Load smali class files once and keep their methods index, reloading changed files.
+    If a capacity is given, only the most recently used classes are kept loaded.
+    """
+    def __init__(self, paths=(), capacity=None):
+        self.paths = list(paths)  # directories to search classes in, by class name
+        self.capacity = capacity  # maximum number of loaded classes, unbounded if None
+        self.classes = OrderedDict()  # path -> ( modification time, SmaliClass ), least recently used first
+
+    def load_class(self, name):
+        """
+        Load a class from the search paths.
+        :param name: The class descriptor, like Lcom/example/Decryptor;
+        :return: The SmaliClass instance.
+        """
+        filename = self.find(name[1:].rstrip(';').replace('/', os.sep) + '.smali')
+        if filename is None:
+            raise ClassNotFound("Class '%s' not found." % name)
+        return self.load_file(filename)
+
+    def find(self, filename):
+        """
+        Find a file in the search paths, a relative path is tried against every one of them.
+        :param filename: The path of the file.
+        :return: Its real path, or None if it's not a file inside one of the search paths.
+        """
+        for path in self.paths:
+            root = os.path.realpath(path)
+            found = os.path.realpath(os.path.join(root, filename))
+            if found.startswith(os.path.join(root, '')) and os.path.isfile(found):
+                return found
+        return None
+
+    def load_file(self, filename):
+        path = os.path.abspath(filename)
+        mtime = os.path.getmtime(path)
+        entry = self.classes.pop(path, None)
+        if entry is None or entry[0] != mtime:
+            entry = (mtime, SmaliClass(get_source_from_file(path).lines, filename))
+
+        self.classes[path] = entry
+        if self.capacity is not None and len(self.classes) > self.capacity:
+            self.classes.popitem(last=False)
+        return entry[1]
@@ -26,22 +26,68 @@ from smali.parser import (
 from smali.objects.string import String
 from smali.objects.string_builder import StringBuilder
 from smali.objects.integer import Integer
+from smali.objects.base64 import Base64
+from smali.objects.cipher import Cipher, SecretKeySpec, IvParameterSpec
+from smali.objects.inflater import Inflater
+from smali.objects.message_digest import MessageDigest
+
+# Owner of the call sites which were never resolved.
+UNRESOLVED = object()
+
+
+class CallSite(object):
+    """
+    Inline cache of an invoke-* instruction. The invoked method is resolved the first time the
+    instruction is executed and its callable is reused by the next executions, as long as they
+    run in the same smali class ( which decides whether the call is to one of its own methods ).
+    """
+    __slots__ = ('klass', 'method', 'owner', 'target')
+
+    def __init__(self, klass, method):
+        self.klass = klass        # mangled class name, without the trailing ';'
+        self.method = method      # signature of the method
+        self.owner = UNRESOLVED   # smali class the target was resolved in
+        self.target = None        # function( vm, this, args ) running the method
+
+    def resolve(self, vm):
+        """
+        Resolve the invoked method in the running class of a VM.
+        :param vm: Instance of the VM.
+        :return: The function running the method.
+        """
+        self.target = vm.resolve(self.klass, self.method)
+        self.owner = vm.klass
+        return self.target
+
+    def __repr__(self):
+        return '%s;->%s' % (self.klass, self.method)
+
+
+# Mapped classes, the python models of the java ones, by class name.
+CLASSES = dict((klass.name(), klass) for klass in (
+    String, StringBuilder, Integer, Base64, Cipher, SecretKeySpec, IvParameterSpec, Inflater, MessageDigest,
+))
+
 
 # This class holds the mapping of Java objects and methods to their Python respective.
 
 
 class ObjectMapping(object):
     def __init__(self):
-        self.mapping = {
-            String.name(): String.methods(),
-            StringBuilder.name(): StringBuilder.methods(),
-            Integer.name(): Integer.methods(),
-        }
+        # methods of the mapped classes by class name, every instance has its own, filled on first use
+        self.mapping = {}
 
     @staticmethod
     def __demangle_class_name(name):
         return extract_class_name(name)
 
+    def __methods(self, class_name):
+        """The methods of a mapped class by signature, None if the class is not mapped."""
+        methods = self.mapping.get(class_name)
+        if methods is None and class_name in CLASSES:
+            methods = self.mapping[class_name] = CLASSES[class_name].methods()
+        return methods
+
     def new_instance(self, vm, klass):
         """
         Used by the new-instance opcode.
@@ -50,33 +96,45 @@ class ObjectMapping(object):
         :return: The new class instance.
         """
         class_name = self.__demangle_class_name(klass)
+        methods = self.__methods(class_name)
 
-        if class_name in self.mapping:
-            if 'new-instance' in self.mapping[class_name]:
-                return self.mapping[class_name]['new-instance']()
+        if methods is not None:
+            if 'new-instance' in methods:
+                return methods['new-instance']()
 
             else:
                 vm.emu.fatal("Unsupported method 'new-instance' for class '%s'." % class_name)
         else:
             vm.emu.fatal("Unsupported class '%s'." % class_name)
 
-    def invoke(self, vm, this, klass, method_name, args):
+    def method(self, vm, klass, method_name):
         """
-        Invoke a method ( if mapped ).
+        Find the Python function of a mapped method.
         :param vm: Instance of the VM.
-        :param this: Identifier of the class instance.
         :param klass: Mangled class name.
-        :param method_name: Mangled method name to invoke.
-        :param args: Arguments of the method.
+        :param method_name: Mangled method name.
+        :return: The function, taking the VM, the instance and the arguments identifiers.
         """
         class_name = self.__demangle_class_name(klass)
-        if class_name in self.mapping:
-            if method_name in self.mapping[class_name]:
-                invokeResult = self.mapping[class_name][method_name](vm, this, args)
-                if not invokeResult is None:
-                    vm.return_v = invokeResult
+        methods = self.__methods(class_name)
+        if methods is not None:
+            if method_name in methods:
+                return methods[method_name]
 
             else:
                 vm.emu.fatal("Unsupported method '%s' for class '%s'." % (method_name, class_name))
         else:
             vm.emu.fatal("Unsupported class '%s'." % class_name)
+
+    def invoke(self, vm, this, klass, method_name, args):
+        """
+        Invoke a method ( if mapped ).
+        :param vm: Instance of the VM.
+        :param this: Identifier of the class instance.
+        :param klass: Mangled class name.
+        :param method_name: Mangled method name to invoke.
+        :param args: Arguments of the method.
+        """
+        invokeResult = self.method(vm, klass, method_name)(vm, this, args)
+        if not invokeResult is None:
+            vm.return_v = invokeResult
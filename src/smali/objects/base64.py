@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Smali Emulator.
+#
+# Copyright(c) 2016 Simone 'evilsocket' Margaritelli
+# evilsocket@gmail.com
+# http://www.evilsocket.net
+#
+# This file may be licensed under the terms of of the
+# GNU General Public License Version 3 (the ``GPL'').
+#
+# Software distributed under the License is distributed
+# on an ``AS IS'' basis, WITHOUT WARRANTY OF ANY KIND, either
+# express or implied. See the GPL for the specific language
+# governing rights and limitations.
+#
+# You should have received a copy of the GPL along with this
+# program. If not, go to http://www.gnu.org/licenses/gpl.html
+# or write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+
+from __future__ import absolute_import
+
+import array
+import base64
+import re
+
+from smali.arrays import to_bytes, from_bytes
+
+# Flags of android.util.Base64.
+NO_PADDING = 1
+NO_WRAP = 2
+CRLF = 4
+URL_SAFE = 8
+
+LINE_LENGTH = 76
+
+# Characters which are not part of the alphabets, skipped by the decoder as Android does.
+SKIPPED = re.compile(b'[^A-Za-z0-9+/]')
+URL_SKIPPED = re.compile(b'[^A-Za-z0-9_-]')
+
+
+def encode(data, flags):
+    """
+    Encode bytes to Base64, as android.util.Base64.encode.
+    :param data: The bytes.
+    :param flags: The flags of the encoder.
+    :return: The encoded bytes, wrapped in lines of 76 characters unless NO_WRAP is set.
+
+    >>> encode(b'hello', 0) == b'aGVsbG8=\\n'
+    True
+    """
+    text = base64.b64encode(data)
+    if flags & URL_SAFE:
+        text = text.replace(b'+', b'-').replace(b'/', b'_')
+    if flags & NO_PADDING:
+        text = text.rstrip(b'=')
+    if not flags & NO_WRAP:
+        newline = b'\r\n' if flags & CRLF else b'\n'
+        text = b''.join(text[i:i + LINE_LENGTH] + newline for i in range(0, len(text), LINE_LENGTH))
+    return text
+
+
+def decode(text, flags):
+    """
+    Decode Base64 bytes, as android.util.Base64.decode: the padding is optional and characters
+    which are not part of the alphabet ( like newlines ) are skipped.
+    :param text: The encoded bytes.
+    :param flags: The flags of the decoder, URL_SAFE selects the alphabet.
+    :return: The decoded bytes.
+
+    >>> decode(b'aGVs\\nbG8', 0) == b'hello'
+    True
+    """
+    text = text.split(b'=', 1)[0]
+    if flags & URL_SAFE:
+        text = URL_SKIPPED.sub(b'', text)
+    else:
+        text = SKIPPED.sub(b'', text)
+    if len(text) % 4 == 1:
+        raise ValueError("bad base-64")
+    text += b'=' * (-len(text) % 4)
+    return base64.b64decode(text, b'-_' if flags & URL_SAFE else None)
+
+
+class Base64:
+    @staticmethod
+    def name():
+        return 'android.util.Base64'
+
+    @staticmethod
+    def methods():
+        return {
+            'decode(Ljava/lang/String;I)[B': Base64.decode,
+            'decode([BI)[B': Base64.decode,
+            'encode([BI)[B': Base64.encode,
+            'encodeToString([BI)Ljava/lang/String;': Base64.encode_to_string,
+        }
+
+    @staticmethod
+    def decode(vm, this, args):
+        value = vm[this]
+        if isinstance(value, (list, array.array)):
+            text = to_bytes(value)
+        elif isinstance(value, bytes):
+            text = value
+        else:
+            text = value.encode('ascii', 'ignore')
+        vm.return_v = from_bytes(decode(text, vm[args[0]]))
+
+    @staticmethod
+    def encode(vm, this, args):
+        vm.return_v = from_bytes(encode(to_bytes(vm[this]), vm[args[0]]))
+
+    @staticmethod
+    def encode_to_string(vm, this, args):
+        vm.return_v = encode(to_bytes(vm[this]), vm[args[0]]).decode('ascii')
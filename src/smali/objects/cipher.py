@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Smali Emulator.
+#
+# Copyright(c) 2016 Simone 'evilsocket' Margaritelli
+# evilsocket@gmail.com
+# http://www.evilsocket.net
+#
+# This file may be licensed under the terms of of the
+# GNU General Public License Version 3 (the ``GPL'').
+#
+# Software distributed under the License is distributed
+# on an ``AS IS'' basis, WITHOUT WARRANTY OF ANY KIND, either
+# express or implied. See the GPL for the specific language
+# governing rights and limitations.
+#
+# You should have received a copy of the GPL along with this
+# program. If not, go to http://www.gnu.org/licenses/gpl.html
+# or write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+
+import os
+
+from smali.arrays import to_bytes, from_bytes
+from smali.crypto import ALGORITHMS, NoSuchAlgorithm, InvalidKey, crypt, pad, unpad
+
+# Operation modes of Cipher.init.
+ENCRYPT_MODE = 1
+DECRYPT_MODE = 2
+
+MODES = ('ECB', 'CBC')
+PADDINGS = {'PKCS5PADDING': True, 'PKCS7PADDING': True, 'NOPADDING': False}
+
+
+class Key(object):
+    """A SecretKeySpec instance."""
+    __slots__ = ('encoded', 'algorithm')
+
+    def __init__(self, encoded=b'', algorithm=None):
+        self.encoded = encoded
+        self.algorithm = algorithm
+
+
+class Parameters(object):
+    """An IvParameterSpec instance."""
+    __slots__ = ('iv',)
+
+    def __init__(self, iv=b''):
+        self.iv = iv
+
+
+class Transformation(object):
+    """
+    State of a Cipher instance: the algorithm/mode/padding it was created for and, once it's
+    initialized, the block cipher with its key schedule. The data given to update is buffered
+    and encrypted or decrypted as a whole by doFinal.
+    """
+    __slots__ = ('algorithm', 'mode', 'padding', 'cipher', 'encrypt', 'iv', 'buffer')
+
+    def __init__(self, transformation):
+        parts = transformation.upper().split('/')
+        if len(parts) not in (1, 3):
+            raise NoSuchAlgorithm("Invalid transformation format: %s" % transformation)
+
+        # Java defaults to ECB mode with PKCS#5 padding
+        self.algorithm, self.mode, padding = parts if len(parts) == 3 else (parts[0], 'ECB', 'PKCS5PADDING')
+        if self.algorithm not in ALGORITHMS or self.mode not in MODES or padding not in PADDINGS:
+            raise NoSuchAlgorithm("Cannot find any provider supporting %s" % transformation)
+
+        self.padding = PADDINGS[padding]
+        self.cipher = None
+        self.encrypt = True
+        self.iv = None
+        self.buffer = b''
+
+    def init(self, mode, key, iv=None):
+        """
+        Initialize the cipher with a key.
+        :param mode: ENCRYPT_MODE or DECRYPT_MODE.
+        :param key: The key bytes.
+        :param iv: The initialization vector of CBC mode, a random one is generated for encryption if None.
+        """
+        self.cipher = ALGORITHMS[self.algorithm](key)
+        self.encrypt = mode != DECRYPT_MODE
+        self.buffer = b''
+        if self.mode == 'ECB':
+            self.iv = None
+        elif iv is not None:
+            self.iv = iv
+        elif self.encrypt:
+            self.iv = os.urandom(self.cipher.block_size)
+        else:
+            raise InvalidKey("Parameters missing")
+
+    def final(self, data):
+        """
+        Encrypt or decrypt the buffered data followed by some more.
+        :param data: The last bytes.
+        :return: The encrypted or decrypted bytes.
+        """
+        if self.cipher is None:
+            raise InvalidKey("Cipher not initialized")
+
+        data, self.buffer = self.buffer + data, b''
+        size = self.cipher.block_size
+        if self.encrypt:
+            return crypt(self.cipher, pad(data, size) if self.padding else data, True, self.iv)
+
+        data = crypt(self.cipher, data, False, self.iv)
+        return unpad(data, size) if self.padding else data
+
+
+class Cipher:
+    @staticmethod
+    def name():
+        return 'javax.crypto.Cipher'
+
+    @staticmethod
+    def methods():
+        return {
+            'getInstance(Ljava/lang/String;)Ljavax/crypto/Cipher;': Cipher.get_instance,
+            'init(ILjava/security/Key;)V': Cipher.init,
+            'init(ILjava/security/Key;Ljava/security/spec/AlgorithmParameterSpec;)V': Cipher.init,
+            'update([B)[B': Cipher.update,
+            'doFinal()[B': Cipher.do_final,
+            'doFinal([B)[B': Cipher.do_final,
+            'doFinal([BII)[B': Cipher.do_final,
+            'getIV()[B': Cipher.get_iv,
+            'getBlockSize()I': Cipher.get_block_size,
+        }
+
+    @staticmethod
+    def get_instance(vm, this, args):
+        vm.return_v = Transformation(vm[this])
+
+    @staticmethod
+    def init(vm, this, args):
+        iv = vm[args[2]].iv if len(args) > 2 else None
+        vm[this].init(vm[args[0]], vm[args[1]].encoded, iv)
+
+    @staticmethod
+    def update(vm, this, args):
+        # the data is buffered until doFinal, so no output is produced yet
+        vm[this].buffer += to_bytes(vm[args[0]])
+        vm.return_v = from_bytes(b'')
+
+    @staticmethod
+    def do_final(vm, this, args):
+        data = to_bytes(vm[args[0]]) if args else b''
+        if len(args) > 1:
+            offset = vm[args[1]]
+            data = data[offset:offset + vm[args[2]]]
+        vm.return_v = from_bytes(vm[this].final(data))
+
+    @staticmethod
+    def get_iv(vm, this, args):
+        iv = vm[this].iv
+        vm.return_v = None if iv is None else from_bytes(iv)
+
+    @staticmethod
+    def get_block_size(vm, this, args):
+        vm.return_v = ALGORITHMS[vm[this].algorithm].block_size
+
+
+class SecretKeySpec:
+    @staticmethod
+    def name():
+        return 'javax.crypto.spec.SecretKeySpec'
+
+    @staticmethod
+    def methods():
+        return {
+            'new-instance': SecretKeySpec.new_instance,
+            '<init>([BLjava/lang/String;)V': SecretKeySpec.init,
+            '<init>([BIILjava/lang/String;)V': SecretKeySpec.init,
+            'getEncoded()[B': SecretKeySpec.get_encoded,
+            'getAlgorithm()Ljava/lang/String;': SecretKeySpec.get_algorithm,
+        }
+
+    @staticmethod
+    def new_instance():
+        return Key()
+
+    @staticmethod
+    def init(vm, this, args):
+        key = vm[this]
+        key.encoded = to_bytes(vm[args[0]])
+        if len(args) > 2:
+            offset = vm[args[1]]
+            key.encoded = key.encoded[offset:offset + vm[args[2]]]
+        key.algorithm = vm[args[-1]]
+
+    @staticmethod
+    def get_encoded(vm, this, args):
+        vm.return_v = from_bytes(vm[this].encoded)
+
+    @staticmethod
+    def get_algorithm(vm, this, args):
+        vm.return_v = vm[this].algorithm
+
+
+class IvParameterSpec:
+    @staticmethod
+    def name():
+        return 'javax.crypto.spec.IvParameterSpec'
+
+    @staticmethod
+    def methods():
+        return {
+            'new-instance': IvParameterSpec.new_instance,
+            '<init>([B)V': IvParameterSpec.init,
+            '<init>([BII)V': IvParameterSpec.init,
+            'getIV()[B': IvParameterSpec.get_iv,
+        }
+
+    @staticmethod
+    def new_instance():
+        return Parameters()
+
+    @staticmethod
+    def init(vm, this, args):
+        iv = to_bytes(vm[args[0]])
+        if len(args) > 1:
+            offset = vm[args[1]]
+            iv = iv[offset:offset + vm[args[2]]]
+        vm[this].iv = iv
+
+    @staticmethod
+    def get_iv(vm, this, args):
+        vm.return_v = from_bytes(vm[this].iv)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Smali Emulator.
+#
+# Copyright(c) 2016 Simone 'evilsocket' Margaritelli
+# evilsocket@gmail.com
+# http://www.evilsocket.net
+#
+# This file may be licensed under the terms of of the
+# GNU General Public License Version 3 (the ``GPL'').
+#
+# Software distributed under the License is distributed
+# on an ``AS IS'' basis, WITHOUT WARRANTY OF ANY KIND, either
+# express or implied. See the GPL for the specific language
+# governing rights and limitations.
+#
+# You should have received a copy of the GPL along with this
+# program. If not, go to http://www.gnu.org/licenses/gpl.html
+# or write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+
+import array
+import zlib
+
+from smali.arrays import to_bytes, from_bytes
+
+
+class DataFormat(Exception):
+    java_class = 'Ljava/util/zip/DataFormatException;'
+
+
+def ended(decompressor):
+    """
+    True if a decompressor reached the end of the compressed stream. Python 2 decompressors have
+    no eof attribute, so a copy is given one more byte, which is left unused past the end only.
+    """
+    eof = getattr(decompressor, 'eof', None)
+    if eof is not None:
+        return eof
+    if decompressor.unused_data:
+        return True
+    probe = decompressor.copy()
+    try:
+        probe.decompress(b'\x00')
+    except zlib.error:
+        return False
+    return probe.unused_data != b''
+
+
+class Stream(object):
+    """
+    State of an Inflater instance. The whole input given to setInput is decompressed by the
+    first inflate call, which then copies the output to the buffers of the next calls.
+    """
+    __slots__ = ('nowrap', 'decompressor', 'input', 'output', 'finished', 'total_in', 'total_out')
+
+    def __init__(self, nowrap=False):
+        self.reset(nowrap)
+
+    def reset(self, nowrap=None):
+        if nowrap is not None:
+            self.nowrap = nowrap
+        # raw deflate data if nowrap, otherwise with the zlib header and checksum
+        self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS if self.nowrap else zlib.MAX_WBITS)
+        self.input = b''
+        self.output = b''
+        self.finished = False
+        self.total_in = 0
+        self.total_out = 0
+
+    def inflate(self, size):
+        """
+        Decompress the pending input.
+        :param size: Maximum number of bytes to return.
+        :return: Up to size decompressed bytes.
+        """
+        if self.input:
+            data, self.input = self.input, b''
+            try:
+                self.output += self.decompressor.decompress(data)
+            except zlib.error as e:
+                raise DataFormat(str(e))
+            self.total_in += len(data) - len(self.decompressor.unused_data)
+            self.finished = ended(self.decompressor)
+
+        data, self.output = self.output[:size], self.output[size:]
+        self.total_out += len(data)
+        return data
+
+    def __deepcopy__(self, memo):
+        # decompression objects can't be pickled, they clone themselves
+        copied = Stream.__new__(Stream)
+        for name in Stream.__slots__:
+            setattr(copied, name, getattr(self, name))
+        copied.decompressor = self.decompressor.copy()
+        return copied
+
+
+class Inflater:
+    @staticmethod
+    def name():
+        return 'java.util.zip.Inflater'
+
+    @staticmethod
+    def methods():
+        return {
+            'new-instance': Inflater.new_instance,
+            '<init>()V': Inflater.init,
+            '<init>(Z)V': Inflater.init,
+            'setInput([B)V': Inflater.set_input,
+            'setInput([BII)V': Inflater.set_input,
+            'inflate([B)I': Inflater.inflate,
+            'inflate([BII)I': Inflater.inflate,
+            'finished()Z': Inflater.finished,
+            'needsInput()Z': Inflater.needs_input,
+            'getRemaining()I': Inflater.get_remaining,
+            'getTotalIn()I': Inflater.get_total_in,
+            'getTotalOut()I': Inflater.get_total_out,
+            'reset()V': Inflater.reset,
+            'end()V': Inflater.end,
+        }
+
+    @staticmethod
+    def new_instance():
+        return Stream()
+
+    @staticmethod
+    def init(vm, this, args):
+        vm[this].reset(bool(vm[args[0]]) if args else False)
+
+    @staticmethod
+    def set_input(vm, this, args):
+        data = to_bytes(vm[args[0]])
+        if len(args) > 1:
+            offset = vm[args[1]]
+            data = data[offset:offset + vm[args[2]]]
+        vm[this].input += data
+
+    @staticmethod
+    def inflate(vm, this, args):
+        buf = vm[args[0]]
+        offset, length = (vm[args[1]], vm[args[2]]) if len(args) > 1 else (0, len(buf))
+        data = from_bytes(vm[this].inflate(length))
+        buf[offset:offset + len(data)] = data if isinstance(buf, array.array) else data.tolist()
+        vm.return_v = len(data)
+
+    @staticmethod
+    def finished(vm, this, args):
+        stream = vm[this]
+        vm.return_v = stream.finished and not stream.output
+
+    @staticmethod
+    def needs_input(vm, this, args):
+        stream = vm[this]
+        vm.return_v = not stream.input and not stream.output and not stream.finished
+
+    @staticmethod
+    def get_remaining(vm, this, args):
+        stream = vm[this]
+        vm.return_v = len(stream.input) + len(stream.decompressor.unused_data)
+
+    @staticmethod
+    def get_total_in(vm, this, args):
+        vm.return_v = vm[this].total_in
+
+    @staticmethod
+    def get_total_out(vm, this, args):
+        vm.return_v = vm[this].total_out
+
+    @staticmethod
+    def reset(vm, this, args):
+        vm[this].reset()
+
+    @staticmethod
+    def end(vm, this, args):
+        vm[this].reset()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Smali Emulator.
+#
+# Copyright(c) 2016 Simone 'evilsocket' Margaritelli
+# evilsocket@gmail.com
+# http://www.evilsocket.net
+#
+# This file may be licensed under the terms of of the
+# GNU General Public License Version 3 (the ``GPL'').
+#
+# Software distributed under the License is distributed
+# on an ``AS IS'' basis, WITHOUT WARRANTY OF ANY KIND, either
+# express or implied. See the GPL for the specific language
+# governing rights and limitations.
+#
+# You should have received a copy of the GPL along with this
+# program. If not, go to http://www.gnu.org/licenses/gpl.html
+# or write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+
+import hashlib
+
+from smali.arrays import to_bytes, from_bytes
+from smali.crypto import NoSuchAlgorithm
+
+# hashlib constructors, by Java algorithm name without dashes.
+ALGORITHMS = {
+    'MD5': hashlib.md5,
+    'SHA': hashlib.sha1,
+    'SHA1': hashlib.sha1,
+    'SHA224': hashlib.sha224,
+    'SHA256': hashlib.sha256,
+    'SHA384': hashlib.sha384,
+    'SHA512': hashlib.sha512,
+}
+
+
+class Digest(object):
+    """State of a MessageDigest instance, the hashlib object of its algorithm."""
+    __slots__ = ('algorithm', 'constructor', 'hash')
+
+    def __init__(self, algorithm):
+        self.algorithm = algorithm
+        self.constructor = ALGORITHMS.get(algorithm.upper().replace('-', ''))
+        if self.constructor is None:
+            raise NoSuchAlgorithm("%s MessageDigest not available" % algorithm)
+        self.hash = self.constructor()
+
+    def digest(self):
+        """The digest of the data, the state is reset as Java does."""
+        value = self.hash.digest()
+        self.hash = self.constructor()
+        return value
+
+    def __deepcopy__(self, memo):
+        # hashlib objects can't be pickled, they clone themselves
+        copied = Digest.__new__(Digest)
+        copied.algorithm, copied.constructor, copied.hash = self.algorithm, self.constructor, self.hash.copy()
+        return copied
+
+
+class MessageDigest:
+    @staticmethod
+    def name():
+        return 'java.security.MessageDigest'
+
+    @staticmethod
+    def methods():
+        return {
+            'getInstance(Ljava/lang/String;)Ljava/security/MessageDigest;': MessageDigest.get_instance,
+            'update([B)V': MessageDigest.update,
+            'update([BII)V': MessageDigest.update,
+            'update(B)V': MessageDigest.update_byte,
+            'digest()[B': MessageDigest.digest,
+            'digest([B)[B': MessageDigest.digest,
+            'reset()V': MessageDigest.reset,
+            'getAlgorithm()Ljava/lang/String;': MessageDigest.get_algorithm,
+            'getDigestLength()I': MessageDigest.get_digest_length,
+            'isEqual([B[B)Z': MessageDigest.is_equal,
+        }
+
+    @staticmethod
+    def get_instance(vm, this, args):
+        vm.return_v = Digest(vm[this])
+
+    @staticmethod
+    def update(vm, this, args):
+        data = to_bytes(vm[args[0]])
+        if len(args) > 1:
+            offset = vm[args[1]]
+            data = data[offset:offset + vm[args[2]]]
+        vm[this].hash.update(data)
+
+    @staticmethod
+    def update_byte(vm, this, args):
+        vm[this].hash.update(to_bytes([vm[args[0]]]))
+
+    @staticmethod
+    def digest(vm, this, args):
+        if args:
+            vm[this].hash.update(to_bytes(vm[args[0]]))
+        vm.return_v = from_bytes(vm[this].digest())
+
+    @staticmethod
+    def reset(vm, this, args):
+        vm[this].hash = vm[this].constructor()
+
+    @staticmethod
+    def get_algorithm(vm, this, args):
+        vm.return_v = vm[this].algorithm
+
+    @staticmethod
+    def get_digest_length(vm, this, args):
+        vm.return_v = vm[this].hash.digest_size
+
+    @staticmethod
+    def is_equal(vm, this, args):
+        vm.return_v = to_bytes(vm[this]) == to_bytes(vm[args[0]])
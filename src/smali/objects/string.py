@@ -18,6 +18,9 @@
 # or write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
+from smali.arrays import to_bytes, from_bytes
+
+
 class String:
     @staticmethod
     def name():
@@ -28,12 +31,18 @@ class String:
         return {
             'new-instance': String.new_instance,
             '<init>([C)V': String.init_from_char_array,
+            '<init>([B)V': String.init_from_bytes,
+            '<init>([BLjava/lang/String;)V': String.init_from_bytes,
+            '<init>([BII)V': String.init_from_bytes,
+            '<init>([BIILjava/lang/String;)V': String.init_from_bytes,
             'charAt(I)C': String.charat,
             'toCharArray()[C': String.tochararray,
             'intern()Ljava/lang/String;': String.repr_intern,
             'valueOf([CII)Ljava/lang/String;' :String.valueof,
             'length()I': String.length,
             'substring(II)Ljava/lang/String;' : String.ssubs,
+            'getBytes()[B': String.getbytes,
+            'getBytes(Ljava/lang/String;)[B': String.getbytes,
         }
 
     @staticmethod
@@ -48,6 +57,24 @@ class String:
     def init_from_char_array(vm, this, args):
         vm[this] = "".join(vm[args[0]])
 
+    @staticmethod
+    def init_from_bytes(vm, this, args):
+        # ( bytes[, offset, length][, charset] ), the charset is UTF-8 unless given and
+        # malformed input is replaced as Java does
+        data = to_bytes(vm[args[0]])
+        if len(args) > 2:
+            offset = vm[args[1]]
+            data = data[offset:offset + vm[args[2]]]
+        charset = vm[args[-1]] if len(args) in (2, 4) else 'utf-8'
+        vm[this] = data.decode(charset, 'replace')
+
+    @staticmethod
+    def getbytes(vm, this, args):
+        value = vm[this]
+        if not isinstance(value, bytes):
+            value = value.encode(vm[args[0]] if args else 'utf-8')
+        vm.return_v = from_bytes(value)
+
     @staticmethod
     def charat(vm, this, args):
         idx = vm[args[0]]
@@ -64,8 +91,9 @@ class String:
 
     @staticmethod
     def valueof(vm,this,args):
-        v = "".join(vm[this])
-        vm.return_v = v[int(vm[args[0]]):int(vm[args[1]])]
+        # valueOf(char[] data, int offset, int count), only the chars in the range are joined
+        offset = int(vm[args[0]])
+        vm.return_v = "".join(vm[this][offset:offset + int(vm[args[1]])])
 
     @staticmethod
     def ssubs(vm,this,args):
@@ -18,6 +18,34 @@
 # or write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
+class Buffer(object):
+    """
+    Content of a StringBuilder instance, the appended strings are kept as a list of chunks
+    joined only when the whole string is needed, so that appending is linear in the length
+    of the result. It's shown as the string it holds.
+    """
+    __slots__ = ('chunks', 'length')
+
+    def __init__(self, text=''):
+        self.chunks = [text]
+        self.length = len(text)
+
+    def append(self, text):
+        self.chunks.append(text)
+        self.length += len(text)
+
+    def value(self):
+        if len(self.chunks) > 1:
+            self.chunks = [''.join(self.chunks)]
+        return self.chunks[0]
+
+    def __str__(self):
+        return str(self.value())
+
+    def __repr__(self):
+        return repr(self.value())
+
+
 class StringBuilder:
     @staticmethod
     def name():
@@ -28,24 +56,35 @@ class StringBuilder:
         return {
             'new-instance': StringBuilder.new_instance,
             '<init>()V': StringBuilder.init,
+            '<init>(Ljava/lang/String;)V': StringBuilder.init_from_string,
             'append(Ljava/lang/String;)Ljava/lang/StringBuilder;': StringBuilder.append,
             'append(C)Ljava/lang/StringBuilder;': StringBuilder.append,
+            'length()I': StringBuilder.length,
             'toString()Ljava/lang/String;': StringBuilder.tostring
         }
 
     @staticmethod
     def new_instance():
-        return ""
+        return Buffer()
 
     @staticmethod
     def init(vm, this, args):
         pass
 
+    @staticmethod
+    def init_from_string(vm, this, args):
+        vm[this].append(vm[args[0]])
+
     @staticmethod
     def append(vm, this, args):
-        vm[this] += vm[args[0]]
-        vm.return_v = vm[this]
+        buf = vm[this]
+        buf.append(vm[args[0]])
+        vm.return_v = buf
+
+    @staticmethod
+    def length(vm, this, args):
+        vm.return_v = vm[this].length
 
     @staticmethod
     def tostring(vm, this, args):
-        vm.return_v = str(vm[this])
\ No newline at end of file
+        vm.return_v = str(vm[this].value())
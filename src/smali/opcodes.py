@@ -20,34 +20,65 @@ from __future__ import print_function
 
 import re
 import ast
+import hashlib
+
+from smali.arrays import allocator, store, pack, fill
+from smali.object_mapping import CallSite
 
 # TODO: Implement missing opcodes.
 
 # Base class for all Dalvik opcodes ( see http://pallergabor.uw.hu/androidblog/dalvik_opcodes.html ).
 class OpCode(object):
-    trace = False
+    registers = ()    # indexes of the operands which are registers, resolved to register file slots
+    targets = ()      # indexes of the operands which are jump labels, resolved to opcode offsets
+    literals = ()     # indexes of the operands which are integer literals, evaluated once
+    source = None     # python statement(s) equivalent to eval, used by the compiler
+    condition = None  # python expression deciding if a jump is taken, used by the compiler
 
     def __init__(self, expression):
         self.expression = re.compile(expression)
 
     @staticmethod
     def get_int_value(val):
-        return ast.literal_eval(val)
-
-    def parse(self, line, vm):
+        try:
+            return int(val, 0)  # plain decimal and hexadecimal literals, the most common ones
+        except ValueError:
+            return ast.literal_eval(val)
+
+    def match(self, line):
+        """
+        Match a line of code against this opcode.
+        :param line: The line of code to match.
+        :return: The tuple of raw operands, or None if the line is not this opcode.
+        """
         m = self.expression.search(line)
         if m is None:
-            return False
+            return None
 
-        if OpCode.trace is True:
-            print("%03d %s" % (vm.pc, line))
+        return tuple(x.strip() if x is not None else x for x in m.groups())
 
-        try:
-            self.eval(vm, *[x.strip() if x is not None else x for x in m.groups()])
-        except Exception as e:
-            vm.exception(e)
+    def decode(self, vm, args):
+        """
+        Pre-parse the raw operands returned by match.
+        :param vm: Instance of the VM, its labels and registers layout must already be resolved.
+        :param args: The tuple of raw operands.
+        :return: The tuple of operands to give to eval.
+        """
+        args = list(args)
+        for idx in self.registers:
+            if args[idx] is not None:
+                args[idx] = vm.register(args[idx])
+        for idx in self.targets:
+            args[idx] = vm.labels[args[idx]]
+        for idx in self.literals:
+            args[idx] = OpCode.get_int_value(args[idx])
+
+        return self.operands(vm, *args)
 
-        return True
+    @staticmethod
+    def operands(vm, *args):
+        """Hook called once at decode time, can be overridden to pre-compute the operands."""
+        return tuple(args)
 
     @staticmethod
     def eval(vm, *args):
@@ -58,391 +89,592 @@ class OpCode(object):
         raise NotImplementedError()
 
 
+class Instruction(object):
+    """A decoded line of code, ready to be dispatched by the emulator main loop."""
+    __slots__ = ('eval', 'args', 'index', 'line', 'opcode', 'parts')
+
+    def __init__(self, handler, args, index, line, opcode=None, parts=None):
+        self.eval = handler    # eval method of the opcode
+        self.args = args       # pre-parsed operands
+        self.index = index     # index of the line in the source code
+        self.line = line       # line of code, used for tracing and errors
+        self.opcode = opcode   # opcode handler instance, None for the builtin ones
+        self.parts = parts     # original instructions of a superinstruction
+
+    @staticmethod
+    def unsupported(vm):
+        vm.fatal("Unsupported opcode.")
+
+    @staticmethod
+    def halt(vm):
+        vm.stop = True
+
+    @staticmethod
+    def error(vm, e):
+        raise e
+
+
 class op_Const(OpCode):
     """Evaluate a constant object."""
+    registers = (0,)
+    literals = (1,)
+    source = '{0} = {1}'
+
     def __init__(self):
         OpCode.__init__(self, '^const(?:/\d+)? (.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, lit):
-        vm[vx] = OpCode.get_int_value(lit)
+        vm.regs[vx] = lit
 
 
 class op_ConstString(OpCode):
     """Evaluate a constant string."""
+    registers = (0,)
+    source = '{0} = {1}'
+
     def __init__(self):
         OpCode.__init__(self, '^const-string(?:/jumbo)? (.+),\s*"(.*)"')
 
+    @staticmethod
+    def operands(vm, vx, s):
+        return vx, s.decode('unicode_escape')
+
     @staticmethod
     def eval(vm, vx, s):
-        vm[vx] = s.decode('unicode_escape')
+        vm.regs[vx] = s
 
 
 class op_Move(OpCode):
     """Evaluate a move."""
+    registers = (0, 1)
+    source = '{0} = {1}'
+
     def __init__(self):
         OpCode.__init__(self, '^move(?:-object)? (.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, vy):
-        vm[vx] = vm[vy]
+        regs = vm.regs
+        regs[vx] = regs[vy]
 
 
 class op_MoveResult(OpCode):
     """MoveResult"""
+    registers = (0,)
+    source = '{0} = vm.return_v'
+
     def __init__(self):
         OpCode.__init__(self, '^move-result(?:-object)? (.+)')
 
     @staticmethod
     def eval(vm, dest):
-        vm[dest] = vm.return_v
+        vm.regs[dest] = vm.return_v
 
 
 class op_MoveException(OpCode):
+    registers = (0,)
+    source = '{0} = vm.exceptions.pop()'
+
     def __init__(self):
         OpCode.__init__(self, '^move-exception (.+)')
 
     @staticmethod
     def eval(vm, vx):
-        vm[vx] = vm.exceptions.pop()
+        vm.regs[vx] = vm.exceptions.pop()
 
 
 class op_IfLe(OpCode):
+    registers = (0, 1)
+    targets = (2,)
+    condition = '{0} <= {1}'
+
     def __init__(self):
         OpCode.__init__(self, '^if-le (.+),\s*(.+),\s*(\:.+)')
 
     @staticmethod
-    def eval(vm, vx, vy, label):
-        if vm[vx] <= vm[vy]:
-            vm.goto(label)
+    def eval(vm, vx, vy, target):
+        regs = vm.regs
+        if regs[vx] <= regs[vy]:
+            vm.goto(target)
 
 
 class op_IfGe(OpCode):
+    registers = (0, 1)
+    targets = (2,)
+    condition = '{0} >= {1}'
+
     def __init__(self):
         OpCode.__init__(self, '^if-ge (.+),\s*(.+),\s*(\:.+)')
 
     @staticmethod
-    def eval(vm, vx, vy, label):
-        if vm[vx] >= vm[vy]:
-            vm.goto(label)
+    def eval(vm, vx, vy, target):
+        regs = vm.regs
+        if regs[vx] >= regs[vy]:
+            vm.goto(target)
 
 
 class op_IfGez(OpCode):
+    registers = (0,)
+    targets = (1,)
+    condition = '{0} >= 0'
+
     def __init__(self):
         OpCode.__init__(self, '^if-gez (.+),\s*(\:.+)')
         
     @staticmethod
-    def eval(vm, vx, label):
-        if vm[vx] >= 0:
-            vm.goto(label)
+    def eval(vm, vx, target):
+        if vm.regs[vx] >= 0:
+            vm.goto(target)
 
 
 class op_IfLtz(OpCode):
+    registers = (0,)
+    targets = (1,)
+    condition = '{0} < 0'
+
     def __init__(self):
         OpCode.__init__(self, '^if-ltz (.+),\s*(\:.+)')
         
     @staticmethod
-    def eval(vm, vx, label):
-        if vm[vx] < 0:
-            vm.goto(label)
+    def eval(vm, vx, target):
+        if vm.regs[vx] < 0:
+            vm.goto(target)
 
 
 class op_IfGt(OpCode):
+    registers = (0, 1)
+    targets = (2,)
+    condition = '{0} > {1}'
+
     def __init__(self):
         OpCode.__init__(self, '^if-gt (.+),\s*(.+),\s*(\:.+)')
 
     @staticmethod
-    def eval(vm, vx, vy, label):
-        if vm[vx] > vm[vy]:
-            vm.goto(label)
+    def eval(vm, vx, vy, target):
+        regs = vm.regs
+        if regs[vx] > regs[vy]:
+            vm.goto(target)
 
 
 class op_IfGtz(OpCode):
+    registers = (0,)
+    targets = (1,)
+    condition = '{0} > 0'
+
     def __init__(self):
         OpCode.__init__(self, '^if-gtz (.+),\s*(\:.+)')
         
     @staticmethod
-    def eval(vm, vx, label):
-        if vm[vx] > 0:
-            vm.goto(label)
+    def eval(vm, vx, target):
+        if vm.regs[vx] > 0:
+            vm.goto(target)
 
 
 class op_IfLez(OpCode):
+    registers = (0,)
+    targets = (1,)
+    condition = '{0} <= 0'
+
     def __init__(self):
         OpCode.__init__(self, '^if-lez (.+),\s*(\:.+)')
 
     @staticmethod
-    def eval(vm, vx, label):
-        if vm[vx] <= 0:
-            vm.goto(label)
+    def eval(vm, vx, target):
+        if vm.regs[vx] <= 0:
+            vm.goto(target)
 
 
 class op_IfEq(OpCode):
+    registers = (0, 1)
+    targets = (2,)
+    condition = '{0} == {1}'
+
     def __init__(self):
         OpCode.__init__(self, '^if-eq (.+),\s*(.+),\s*(\:.+)')
 
     @staticmethod
-    def eval(vm, vx, vy, label):
-        if vm[vx] == vm[vy]:
-            vm.goto(label)
+    def eval(vm, vx, vy, target):
+        regs = vm.regs
+        if regs[vx] == regs[vy]:
+            vm.goto(target)
 
 
 class op_IfNe(OpCode):
+    registers = (0, 1)
+    targets = (2,)
+    condition = '{0} != {1}'
+
     def __init__(self):
         OpCode.__init__(self, '^if-ne (.+),\s*(.+),\s*(\:.+)')
 
     @staticmethod
-    def eval(vm, vx, vy, label):
-        if vm[vx] != vm[vy]:
-            vm.goto(label)
+    def eval(vm, vx, vy, target):
+        regs = vm.regs
+        if regs[vx] != regs[vy]:
+            vm.goto(target)
 
 
 class op_IfLt(OpCode):
+    registers = (0, 1)
+    targets = (2,)
+    condition = '{0} < {1}'
+
     def __init__(self):
         OpCode.__init__(self, '^if-lt (.+),\s*(.+),\s*(\:.+)')
 
     @staticmethod
-    def eval(vm, vx, vy, label):
-        if vm[vx] < vm[vy]:
-            vm.goto(label)
+    def eval(vm, vx, vy, target):
+        regs = vm.regs
+        if regs[vx] < regs[vy]:
+            vm.goto(target)
 
 
 class op_IfEqz(OpCode):
+    registers = (0,)
+    targets = (1,)
+    condition = '{0} == 0'
+
     def __init__(self):
         OpCode.__init__(self, '^if-eqz (.+),\s*(\:.+)')
 
     @staticmethod
-    def eval(vm, vx, label):
-        if vm[vx] == 0:
-            vm.goto(label)
+    def eval(vm, vx, target):
+        if vm.regs[vx] == 0:
+            vm.goto(target)
 
 
 class op_IfNez(OpCode):
+    registers = (0,)
+    targets = (1,)
+    condition = '{0} != 0'
+
     def __init__(self):
         OpCode.__init__(self, '^if-nez (.+),\s*(\:.+)')
 
     @staticmethod
-    def eval(vm, vx, label):
-        if vm[vx] != 0:
-            vm.goto(label)
+    def eval(vm, vx, target):
+        if vm.regs[vx] != 0:
+            vm.goto(target)
 
 
 class op_ArrayLength(OpCode):
+    registers = (0, 1)
+    source = '{0} = len({1})'
+
     def __init__(self):
         OpCode.__init__(self, 'array-length (.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, vy):
-        vm[vx] = len(vm[vy])
+        regs = vm.regs
+        regs[vx] = len(regs[vy])
 
 
 class op_ArrayFillData(OpCode):
+    registers = (0,)
+    source = '{0} = fill({0}, {1})'
+
     def __init__(self):
         OpCode.__init__(self, 'fill-array-data (.+),\s*(.+)')
 
     @staticmethod
-    def eval(vm, vx, label):
-        vm[vx] = vm.array_data[label]["elements"]
+    def operands(vm, vx, label):
+        # the elements are packed once and shared by every run of the decoded code
+        block = vm.array_data[label]
+        return vx, pack(block["element_width"], block["elements"])
+
+    @staticmethod
+    def eval(vm, vx, data):
+        regs = vm.regs
+        regs[vx] = fill(regs[vx], data)
 
 
 class op_Aget(OpCode):
+    registers = (0, 1, 2)
+    source = '{0} = {1}[{2}]'
+
     def __init__(self):
         OpCode.__init__(self, '^aget[\-a-z]* (.+),\s*(.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, vy, vz):
-        arr     = vm[vy]
-        idx     = vm[vz]
-        vm[vx] = arr[idx]
+        regs = vm.regs
+        arr     = regs[vy]
+        idx     = regs[vz]
+        regs[vx] = arr[idx]
 
 
 class op_AddIntLit(OpCode):
+    registers = (0, 1)
+    literals = (2,)
+    source = '{0} = {1} + {2}'
+
     def __init__(self):
         OpCode.__init__(self, '^add-int/lit\d+ (.+),\s*(.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, vy, lit):
-        vm[vx] = eval( "%s + %s" % ( vm[vy], lit ) )
+        regs = vm.regs
+        regs[vx] = regs[vy] + lit
 
 
 class op_MulIntLit(OpCode):
+    registers = (0, 1)
+    literals = (2,)
+    source = '{0} = {1} * {2}'
+
     def __init__(self):
         OpCode.__init__(self, '^mul-int/lit\d+ (.+),\s*(.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, vy, lit):
-        vm[vx] = eval("%s * %s" % (vm[vy], lit))
+        regs = vm.regs
+        regs[vx] = regs[vy] * lit
 
 
 class op_XorInt2Addr(OpCode):
+    registers = (0, 1)
+    source = '{0} ^= int({1}) if isinstance({1}, int) else ord({1})'
+
     def __init__(self):
         OpCode.__init__(self, '^xor-int(?:/2addr)? (.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, vy):
-        # test if vm[vy] is a char instead of an int
-        if isinstance(vm[vy], int):
-            vm[vx] ^= int(vm[vy])
+        regs = vm.regs
+        # test if regs[vy] is a char instead of an int
+        if isinstance(regs[vy], int):
+            regs[vx] ^= int(regs[vy])
         else:
-            vm[vx] ^= ord(vm[vy])
+            regs[vx] ^= ord(regs[vy])
 
 
 class op_XorIntLit(OpCode):
     #xor-int/lit8 v0, v0, 0x26
+    registers = (0, 1)
+    literals = (2,)
+    source = '{0} = (int({1}) if isinstance({1}, int) else ord({1})) ^ {2}'
+
 
     def __init__(self):
         OpCode.__init__(self, '^xor-int/lit\d+ (.+),\s*(.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, vy, lit):
-        if isinstance(vm[vy],int):
-            ii = int(vm[vy])
+        regs = vm.regs
+        if isinstance(regs[vy],int):
+            ii = int(regs[vy])
         else:
-            ii = ord(vm[vy])
-        vm[vx] = ii ^ OpCode.get_int_value(lit)
+            ii = ord(regs[vy])
+        regs[vx] = ii ^ lit
 
 
 class op_DivIntLit(OpCode):
+    registers = (0, 1)
+    literals = (2,)
+    source = '{0} = {1} / {2}'
+
     def __init__(self):
         OpCode.__init__(self, '^div-int/lit\d+ (.+),\s*(.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, vy, lit):
-        vm[vx] = vm[vy] / OpCode.get_int_value(lit)
+        regs = vm.regs
+        regs[vx] = regs[vy] / lit
 
 
 class op_DivInt(OpCode):
+    registers = (0, 1, 2)
+    source = '{0} = {1} / {2}'
+
     def __init__(self):
         OpCode.__init__(self, '^div-int (.+),\s*(.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, vy, vz):
-        vm[vx] = vm[vy] / vm[vz]
+        regs = vm.regs
+        regs[vx] = regs[vy] / regs[vz]
 
 
 class op_DivIntLit(OpCode):
+    registers = (0, 1)
+    literals = (2,)
+    source = '{0} = {1} / {2}'
+
     def __init__(self):
         OpCode.__init__(self, '^div-int/lit\d+ (.+),\s*(.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, vy, lit):
-        vm[vx] = vm[vy] / OpCode.get_int_value(lit)
+        regs = vm.regs
+        regs[vx] = regs[vy] / lit
 
 
 class op_AddInt(OpCode):
+    registers = (0, 1, 2)
+    source = '{0} = {1} + {2}'
+
     def __init__(self):
         OpCode.__init__(self, '^add-int (.+),\s*(.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, vy, vz):
-        vm[vx] = vm[vy] + vm[vz]
+        regs = vm.regs
+        regs[vx] = regs[vy] + regs[vz]
 
 
 class op_SubInt(OpCode):
+    registers = (0, 1, 2)
+    source = '{0} = {1} - {2}'
+
     def __init__(self):
         OpCode.__init__(self, '^sub-int (.+),\s*(.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, vy, vz):
-        vm[vx] = vm[vy] - vm[vz]
+        regs = vm.regs
+        regs[vx] = regs[vy] - regs[vz]
 
 
 class op_MulInt(OpCode):
+    registers = (0, 1, 2)
+    source = '{0} = {1} * {2}'
+
     def __init__(self):
         OpCode.__init__(self, '^mul-int (.+),\s*(.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, vy, vz):
-        vm[vx] = vm[vy] * vm[vz]
+        regs = vm.regs
+        regs[vx] = regs[vy] * regs[vz]
 
 
 class op_RemInt(OpCode):
+    registers = (0, 1, 2)
+    source = '{0} = {1} % {2}'
+
     def __init__(self):
         OpCode.__init__(self, '^rem-int (.+),\s*(.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, vy, vz):
-        vm[vx] = vm[vy] % vm[vz]
+        regs = vm.regs
+        regs[vx] = regs[vy] % regs[vz]
 
 
 class op_AndInt(OpCode):
+    registers = (0, 1, 2)
+    source = '{0} = {1} & {2}'
+
     def __init__(self):
         OpCode.__init__(self, '^and-int (.+),\s*(.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, vy, vz):
-        vm[vx] = vm[vy] & vm[vz]
+        regs = vm.regs
+        regs[vx] = regs[vy] & regs[vz]
 
 
 class op_AndIntLit(OpCode):
+    registers = (0, 1)
+    literals = (2,)
+    source = '{0} = int({1}) & {2}'
+
     def __init__(self):
         OpCode.__init__(self, '^and-int/lit\d+ (.+),\s*(.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, vy, lit):
-        vm[vx] = int(vm[vy]) & OpCode.get_int_value(lit)
+        regs = vm.regs
+        regs[vx] = int(regs[vy]) & lit
 
 
 class op_OrInt(OpCode):
+    registers = (0, 1, 2)
+    source = '{0} = {1} | {2}'
+
     def __init__(self):
         OpCode.__init__(self, '^or-int (.+),\s*(.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, vy, vz):
-        vm[vx] = vm[vy] | vm[vz]
+        regs = vm.regs
+        regs[vx] = regs[vy] | regs[vz]
 
 
 class op_ShlIntLit(OpCode):
 	#shl-int/lit8 vx, vy, lit8
+    registers = (0, 1)
+    literals = (2,)
+    source = '{0} = {1} << {2}'
+
     def __init__(self):
         OpCode.__init__(self, '^shl-int/lit\d+ (.+),\s*(.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, vy, lit):
-        vm[vx] = vm[vy] << OpCode.get_int_value(lit)
+        regs = vm.regs
+        regs[vx] = regs[vy] << lit
 	
 
 class op_GoTo(OpCode):
+    targets = (0,)
+    condition = 'True'
+
     def __init__(self):
         OpCode.__init__(self, '^goto(?:/\d+)? (:.+)')
 
     @staticmethod
-    def eval(vm, label):
-        vm.goto(label)
+    def eval(vm, target):
+        vm.goto(target)
 
 
 class op_NewInstance(OpCode):
+    registers = (0,)
+    source = '{0} = vm.new_instance({1})'
+
     def __init__(self):
         OpCode.__init__(self, '^new-instance (.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, klass):
-        vm[vx] = vm.new_instance(klass)
+        vm.regs[vx] = vm.new_instance(klass)
 
 
 class op_NewArray(OpCode):
+    registers = (0, 1)
+    source = '{0} = {2}({1})'
+
     def __init__(self):
         OpCode.__init__(self, '^new-array (.+),\s*(.+),\s*(.+)')
 
     @staticmethod
-    def eval(vm, vx, vy, klass):
-        vm[vx] = [""] * vm[vy]
+    def operands(vm, vx, vy, klass):
+        return vx, vy, allocator(klass)
+
+    @staticmethod
+    def eval(vm, vx, vy, allocate):
+        regs = vm.regs
+        regs[vx] = allocate(regs[vy])
 
 
 class op_APut(OpCode):
+    registers = (0, 1, 2)
+    source = 'idx = int({2})\ntry:\n    {1}[idx] = {0}\nexcept (IndexError, OverflowError, TypeError):\n    store({1}, idx, {0})'
+
     def __init__(self):
         OpCode.__init__(self, '^aput(?:-[a-z]+)? (.+),\s*(.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, vy, vz):
-        idx = int(vm[vz])
-        arr = vm[vy]
-        val = vm[vx]
-        if len(arr) > idx:
-            arr[idx] = val
-        elif idx == len(arr):
-            arr.append(val)
-        vm[vy] = arr
+        regs = vm.regs
+        idx = int(regs[vz])
+        try:
+            regs[vy][idx] = regs[vx]
+        except (IndexError, OverflowError, TypeError):
+            # typed arrays truncate the values, lists grow by one element
+            store(regs[vy], idx, regs[vx])
 
 
 class op_Invoke(OpCode):
@@ -450,50 +682,66 @@ class op_Invoke(OpCode):
         OpCode.__init__(self, '^invoke-(?:[a-z]+) \{(.*)\},\s*(.+)')
 
     @staticmethod
-    def eval(vm, args, call):
-        args = list(map(str.strip, args.split(',')))
-        this = args[0]
-        args = args[1:]
-        klass, method  = call.split(';->')
+    def operands(vm, args, call):
+        args = [vm.register(arg.strip()) for arg in args.split(',') if arg.strip()] or [None]
+        klass, method = call.split(';->')
+        return args[0], CallSite(klass, method), tuple(args[1:])
 
-        vm.invoke(this, klass, method, args)
+    @staticmethod
+    def eval(vm, this, site, args):
+        # inlined VM.dispatch, the call site is resolved only by its first execution
+        target = site.target if site.owner is vm.klass else site.resolve(vm)
+        result = target(vm, this, args)
+        if result is not None:
+            vm.return_v = result
 
 
 class op_IntToType(OpCode):
+    registers = (1, 2)
+
     def __init__(self):
         OpCode.__init__(self, '^int-to-([a-z]+) (.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, ctype, vx, vy):
+        regs = vm.regs
         if ctype == 'char':
-            vm[vx] = chr( vm[vy] & 0xFF )
+            regs[vx] = chr( regs[vy] & 0xFF )
         elif ctype == 'byte' :
-            a = vm[vy]
+            a = regs[vy]
             a1 = a << 24
-            vm[vx] = a1 >> 24
+            regs[vx] = a1 >> 24
         else:
             vm.emu.fatal("Unsupported type '%s' ." % ctype)
 
 
 class op_SPut(OpCode):
+    registers = (0,)
+    source = 'vm.statics({1})[{1}] = {0}'
+
     def __init__(self):
         OpCode.__init__(self, '^sput(?:-[a-z]+)?\s+(.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, staticVariableName):
-        vm.variables[staticVariableName] = vm.variables[vx]
+        vm.statics(staticVariableName)[staticVariableName] = vm.regs[vx]
 
 
 class op_SGet(OpCode):
+    registers = (0,)
+    source = '{0} = vm.statics({1})[{1}]'
+
     def __init__(self):
         OpCode.__init__(self, '^sget(?:-[a-z]+)?\s+(.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, staticVariableName):
-        vm.variables[vx] = vm.variables[staticVariableName]
+        vm.regs[vx] = vm.statics(staticVariableName)[staticVariableName]
 
 
 class op_Return(OpCode):
+    registers = (1,)
+
     def __init__(self):
         OpCode.__init__(self, '^return(-[a-z]*)*\s*(.+)*')
 
@@ -503,7 +751,7 @@ class op_Return(OpCode):
             vm.return_v = None
             vm.stop = True
         elif ctype in ( '-wide', '-object' ) or (ctype is None and vx is not None):
-            vm.return_v = vm[vx]
+            vm.return_v = vm.regs[vx]
             vm.stop = True
 
         else:
@@ -511,28 +759,59 @@ class op_Return(OpCode):
 
 
 class op_RemIntLit(OpCode):
+    registers = (0, 1)
+    literals = (2,)
+    source = '{0} = int({1}) % {2}'
+
     def __init__(self):
         OpCode.__init__(self, '^rem-int/lit\d+ (.+),\s*(.+),\s*(.+)')
 
     @staticmethod
     def eval(vm, vx, vy, lit):
-        vm[vx] = int(vm[vy]) % OpCode.get_int_value(lit)
+        regs = vm.regs
+        regs[vx] = int(regs[vy]) % lit
 
 
 class op_PackedSwitch(OpCode):
+    registers = (0,)
+
     def __init__(self):
         OpCode.__init__(self, '^packed-switch (.+),\s*(.+)')
 
     @staticmethod
-    def eval(vm, vx, table):
-        val = vm[vx]
-        switch = vm.packed_switches.get(table, {})
-        cases = switch.get('cases', [])
-        case_idx = val - switch.get('first_value')
+    def operands(vm, vx, table):
+        switch = vm.packed_switches[table]
+        return vx, switch['first_value'], tuple(vm.labels[case] for case in switch['cases'])
 
-        if case_idx >= len(cases) or case_idx < 0:
+    @staticmethod
+    def eval(vm, vx, first_value, targets):
+        case_idx = vm.regs[vx] - first_value
+
+        if case_idx >= len(targets) or case_idx < 0:
             return
 
-        case_label = cases[case_idx]
+        vm.goto(targets[case_idx])
+
+
+class OpcodeTable(object):
+    """Handlers of every opcode, built once per process by table() and shared by all the emulators."""
+    __slots__ = ('handlers', 'by_name', 'signature')
+
+    def __init__(self):
+        names = sorted(name for name in globals() if name.startswith('op_'))
+        self.handlers = tuple(globals()[name]() for name in names)  # in the order lines are matched
+        self.by_name = dict(zip(names, self.handlers))
+        # part of the cache key of every program, see smali.cache
+        patterns = sorted(handler.expression.pattern for handler in self.handlers)
+        self.signature = hashlib.sha1('\n'.join(patterns).encode('utf-8')).hexdigest()
+
+
+_table = None
+
 
-        vm.goto(case_label)
+def table():
+    """The OpcodeTable of the process, built the first time it's needed."""
+    global _table
+    if _table is None:
+        _table = OpcodeTable()
+    return _table
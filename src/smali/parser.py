@@ -6,6 +6,9 @@ import re
 
 FIRST_TOKEN = re.compile(r'([\w\-\/]+)')  # first token of a line
 CLASS_PATTERN = re.compile(r'(L?)([a-zA-Z]+[\w\/]+);?')
+METHOD_PATTERN = re.compile(r'^\.method\s+(.*\s)?[^\s]+\((.*)\)[^\s]+$')  # method declaration
+FIELD_PATTERN = re.compile(r'^\.field\s+(.*?\s)?([^\s=]+:[^\s=]+)(?:\s*=\s*(.+))?$')  # field declaration
+PARAMETER_PATTERN = re.compile(r'\[*(?:L[^;]+;|[ZBSCIJFD])')  # a single parameter type
 
 
 class IncorrectPattern(Exception):
@@ -46,3 +49,26 @@ def get_op_code(input_symbol_table_line):
     'cmpl-double'
     """
     return FIRST_TOKEN.search(input_symbol_table_line).group(1)
+
+
+def count_parameter_registers(method_line):
+    """Count the registers used by the parameters of a method, 'this' included.
+
+    >>> count_parameter_registers('.method public static field5([II)Ljava/lang/String;')
+    2
+    >>> count_parameter_registers('.method public constructor <init>()V')
+    1
+    >>> count_parameter_registers('.method private foo(JLjava/lang/String;[D)V')
+    5
+    """
+    match = METHOD_PATTERN.match(method_line.strip())
+    if match is None:
+        raise IncorrectPattern(
+            "'{}' Does not correspond to a method.".format(method_line)
+        )
+
+    modifiers = (match.group(1) or '').split()
+    count = 0 if 'static' in modifiers else 1
+    for parameter in PARAMETER_PATTERN.findall(match.group(2)):
+        count += 2 if parameter in ('J', 'D') else 1
+    return count
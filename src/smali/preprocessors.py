@@ -22,34 +22,35 @@ import re
 from smali.opcodes import OpCode
 
 
+def following(lines, index):
+    """Lines after the one at 'index', with their index, without copying the list."""
+    nindex = index + 1
+    while nindex < len(lines):
+        yield nindex, lines[nindex]
+        nindex += 1
+
+
 class TryCatchPreprocessor:
     """Pre process try/catch blocks."""
-    # TODO: Save exception type for specific catch.
+
+    # .catch Ljava/lang/Exception; {:try_start_0 .. :try_end_0} :catch_0
+    # .catchall {:try_start_0 .. :try_end_0} :catchall_0
+    expression = re.compile('^\.catch(?:all)?(?:\s+([^\s{]+))?\s*\{\s*(:[^\s.]+)\s*\.\.\s*(:[^\s}]+)\s*\}\s*(\:.+)')
 
     @staticmethod
     def check(line):
-        return line.startswith(':try_start_')
+        return line.startswith('.catch')
 
     @staticmethod
-    def process(vm, line, index, lines ):
+    def process(vm, line, index, lines):
         """
-        Will search the '.catch' directive and update the VM accordingly.
+        Save the try block, the handler and the exception type of a '.catch' or '.catchall'
+        directive ( whose type is None ), the block is kept by the labels which delimit it until
+        the labels line indexes are all known.
         """
-        # get block identifier
-        block_id = line.split('_')[2]
-        # search for next pattern:
-        #
-        #   .catch Ljava/lang/Exception; {:try_start_BLOCK_ID .. :try_end_BLOCK_ID} :LABEL
-        #
-        expression = '^\.catch [^\s]+ \{:try_start_%s[ \.]+:try_end_%s\}\s*(\:.+)' % (block_id, block_id)
-        for nindex, nline in enumerate(lines[index + 1:]):
-            # TODO: Save exception type for specific catch.
-            m = re.search(expression, nline)
-            if m:
-                label = m.group(1)
-                eindex = nindex + index + 1
-                vm.catch_blocks.append((index, eindex, label))
-                break
+        m = TryCatchPreprocessor.expression.match(line)
+        if m:
+            vm.catch_blocks.append((m.group(2), m.group(3), m.group(4).strip(), m.group(1)))
 
 
 class PackedSwitchPreprocessor:
@@ -63,7 +64,7 @@ class PackedSwitchPreprocessor:
         pswitch = {"first_value": 0, "cases": []}
         next_line = index
 
-        for nindex, nline in enumerate(lines[index + 1:]):
+        for nindex, nline in following(lines, index):
             if nline.startswith(".packed-switch "):
                 pswitch["first_value"] = OpCode.get_int_value(nline.split(' ')[1])
 
@@ -71,7 +72,7 @@ class PackedSwitchPreprocessor:
                 pswitch["cases"].append(nline)
 
             elif nline == '.end packed-switch':
-                next_line = index + nindex + 1
+                next_line = nindex
                 break
 
             else:
@@ -92,12 +93,12 @@ class ArrayDataPreprocessor:
         array = {"element_width": 0, "elements": []}
         next_line = index
 
-        for nindex, nline in enumerate(lines[index + 1:]):
+        for nindex, nline in following(lines, index):
             if nline.startswith(".array-data "):
                 array["element_width"] = OpCode.get_int_value(nline.split(' ')[1])
 
             elif nline == '.end array-data':
-                next_line = index + nindex + 1
+                next_line = nindex
                 break
             else:
                 array["elements"].append(OpCode.get_int_value(nline))
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Smali Emulator.
+#
+# Copyright(c) 2016 Simone 'evilsocket' Margaritelli
+# evilsocket@gmail.com
+# http://www.evilsocket.net
+#
+# This file may be licensed under the terms of of the
+# GNU General Public License Version 3 (the ``GPL'').
+#
+# Software distributed under the License is distributed
+# on an ``AS IS'' basis, WITHOUT WARRANTY OF ANY KIND, either
+# express or implied. See the GPL for the specific language
+# governing rights and limitations.
+#
+# You should have received a copy of the GPL along with this
+# program. If not, go to http://www.gnu.org/licenses/gpl.html
+# or write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+
+import marshal
+from timeit import default_timer
+
+# Function of the code which is not part of a method of a class, like a whole file being run.
+SOURCE = ('<source>', 0, '<source>')
+
+
+def function(vm):
+    """
+    Identify the code loaded in the VM as pstats does with python functions.
+    :param vm: Instance of the VM.
+    :return: A ( filename, line number, name ) tuple, the name is the class descriptor and the
+             method signature, like Lcom/example/Decryptor;->decrypt([B)[B
+    """
+    program = vm.program
+    method = None if program is None else program.method
+    if method is None:
+        return SOURCE
+    klass = method.klass
+    return klass.filename or klass.name, method.start + 1, "%s->%s" % (klass.name, method.signature)
+
+
+def frame_name(key):
+    """
+    Name of a function in collapsed stacks, where semicolons separate the frames.
+    :param key: The pstats key of the function.
+    :return: The name, like com/example/Decryptor.decrypt([B)[B
+
+    >>> frame_name(('Foo.smali', 10, 'Lcom/example/Foo;->bar(Ljava/lang/String;I)V'))
+    'com/example/Foo.bar(Ljava/lang/String,I)V'
+    """
+    name = key[2]
+    if '->' in name:
+        klass, signature = name.split('->', 1)
+        name = klass[1:].rstrip(';') + '.' + signature
+    return name.replace(';', ',')
+
+
+def opcode_name(insn):
+    """
+    Name of the handler of an instruction, superinstructions are named after their parts.
+    :param insn: A smali.opcodes.Instruction instance.
+    :return: The opcode class name, like op_Const, or the builtin handler one, like halt.
+    """
+    if insn.parts is not None:
+        return '+'.join(opcode_name(part) for part in insn.parts)
+    elif insn.opcode is not None:
+        return insn.opcode.__class__.__name__
+    return insn.eval.__name__
+
+
+class Call(object):
+    """A running method, with the time spent in the opcodes and the methods it invoked."""
+    __slots__ = ('function', 'path', 'start', 'children')
+
+    def __init__(self, function, path, start):
+        self.function = function  # pstats key of the method
+        self.path = path          # collapsed stack of the method, callers first
+        self.start = start        # timer value when the method was entered
+        self.children = 0.0       # time spent in opcodes and invoked methods
+
+
+class Profiler(object):
+    """
+    Opt-in profiler of the emulation, given to the emulator with the 'profiler' argument.
+
+    It counts the executions and measures the time of every opcode handler, source line and
+    method, which can be exported as pstats data or as collapsed stacks for flamegraph.pl.
+    Opcode and line times exclude the methods they invoke, superinstructions are accounted
+    as a single opcode on the line of their first part. Profiled runs are interpreted only,
+    the compiled code of a method isn't used while a profiler is set.
+    """
+    def __init__(self, timer=default_timer):
+        self.timer = timer
+        self.opcodes = {}    # opcode name -> [ count, time ]
+        self.lines = {}      # ( function, line number ) -> [ count, time ]
+        self.functions = {}  # function -> [ calls, primitive calls, own time, cumulative time ]
+        self.callers = {}    # ( caller, function ) -> [ calls, primitive calls, own time, cumulative time ]
+        self.calls = {}      # ( function, opcode name ) -> [ count, time ], opcodes as callees of methods
+        self.stacks = {}     # ( collapsed stack, opcode name ) -> [ count, time ]
+        self.stack = []      # running methods, Call instances
+        self.active = {}     # function -> number of its running calls, to account recursion once
+        self.names = {}      # instruction -> opcode name
+        self.stats = {}      # pstats data, filled by create_stats
+
+    def enter(self, vm):
+        """
+        Start accounting the method loaded in the VM.
+        :param vm: Instance of the VM.
+        """
+        key = function(vm)
+        path = frame_name(key) if not self.stack else self.stack[-1].path + ';' + frame_name(key)
+        self.active[key] = self.active.get(key, 0) + 1
+        self.stack.append(Call(key, path, self.timer()))
+
+    def leave(self):
+        """Stop accounting the running method, once it returned or raised."""
+        call = self.stack.pop()
+        total = self.timer() - call.start
+        key = call.function
+        self.active[key] -= 1
+        primitive = 1 if self.active[key] == 0 else 0
+        cumulative = total if primitive else 0.0
+
+        entries = [self.functions.setdefault(key, [0, 0, 0.0, 0.0])]
+        if self.stack:
+            caller = self.stack[-1]
+            caller.children += total
+            entries.append(self.callers.setdefault((caller.function, key), [0, 0, 0.0, 0.0]))
+
+        for entry in entries:
+            entry[0] += 1
+            entry[1] += primitive
+            entry[2] += total - call.children
+            entry[3] += cumulative
+
+    def execute(self, vm, insn):
+        """
+        Run an instruction of the running method, measuring it.
+        :param vm: Instance of the VM.
+        :param insn: The smali.opcodes.Instruction instance to run.
+        """
+        call = self.stack[-1]
+        children = call.children
+        start = self.timer()
+        try:
+            insn.eval(vm, *insn.args)
+        finally:
+            # the time of the methods it invoked was already added to the children of the call
+            elapsed = self.timer() - start - (call.children - children)
+            call.children += elapsed
+
+            name = self.names.get(insn)
+            if name is None:
+                name = self.names[insn] = opcode_name(insn)
+            for table, key in ((self.opcodes, name), (self.lines, (call.function, insn.index + 1)),
+                               (self.calls, (call.function, name)), (self.stacks, (call.path, name))):
+                entry = table.get(key)
+                if entry is None:
+                    entry = table[key] = [0, 0.0]
+                entry[0] += 1
+                entry[1] += elapsed
+
+    def create_stats(self):
+        """Fill 'stats' with the pstats data of the profile, so that pstats.Stats(profiler) works."""
+        stats = {}
+        for key, (calls, primitive, own, cumulative) in self.functions.items():
+            stats[key] = (primitive, calls, own, cumulative, {})
+        for (caller, key), (calls, primitive, own, cumulative) in self.callers.items():
+            stats[key][4][caller] = (calls, primitive, own, cumulative)
+
+        # opcodes are the builtins called by the methods
+        for (caller, name), (count, elapsed) in self.calls.items():
+            key = ('~', 0, name)
+            cc, nc, tt, ct, callers = stats.get(key, (0, 0, 0.0, 0.0, {}))
+            callers[caller] = (count, count, elapsed, elapsed)
+            stats[key] = (cc + count, nc + count, tt + elapsed, ct + elapsed, callers)
+
+        self.stats = stats
+
+    def dump_stats(self, filename):
+        """
+        Write the profile in the file format of cProfile, to be loaded with pstats.Stats(filename).
+        :param filename: Path of the file to write.
+        """
+        self.create_stats()
+        with open(filename, 'wb') as fd:
+            marshal.dump(self.stats, fd)
+
+    def collapsed(self, counts=False):
+        """
+        Collapsed stacks of the profile, the input format of flamegraph.pl.
+        :param counts: If true stacks are weighted by executions instead of microseconds.
+        :return: A list of 'method;method;opcode weight' lines, sorted.
+        """
+        lines = []
+        for (path, name), (count, elapsed) in self.stacks.items():
+            weight = count if counts else int(round(elapsed * 1000000))
+            if weight > 0:
+                lines.append("%s;%s %d" % (path, name, weight))
+        return sorted(lines)
+
+    def write_collapsed(self, filename, counts=False):
+        """
+        Write the collapsed stacks of the profile to a file.
+        :param filename: Path of the file to write.
+        :param counts: If true stacks are weighted by executions instead of microseconds.
+        """
+        with open(filename, 'w') as fd:
+            for line in self.collapsed(counts):
+                fd.write(line + '\n')
+
+    def report(self, limit=10):
+        """
+        Summary of the profile.
+        :param limit: Number of entries of every table.
+        :return: The tables of the most expensive opcodes, lines and methods, as text.
+        """
+        rows = ["%-40s %10s %12s" % ('opcode', 'count', 'time ( ms )')]
+        for name, (count, elapsed) in sorted(self.opcodes.items(), key=lambda item: -item[1][1])[:limit]:
+            rows.append("%-40s %10d %12.3f" % (name, count, elapsed * 1000))
+
+        rows.append('')
+        rows.append("%-40s %10s %12s" % ('line', 'count', 'time ( ms )'))
+        for (key, line), (count, elapsed) in sorted(self.lines.items(), key=lambda item: -item[1][1])[:limit]:
+            rows.append("%-40s %10d %12.3f" % ("%s:%d" % (key[0], line), count, elapsed * 1000))
+
+        rows.append('')
+        rows.append("%-40s %10s %12s %12s" % ('method', 'calls', 'own ( ms )', 'total ( ms )'))
+        for key, (calls, primitive, own, cumulative) in sorted(self.functions.items(), key=lambda item: -item[1][3])[:limit]:
+            rows.append("%-40s %10d %12.3f %12.3f" % (key[2], calls, own * 1000, cumulative * 1000))
+
+        return '\n'.join(rows) + '\n'
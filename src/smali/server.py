@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Smali Emulator.
+#
+# Copyright(c) 2016 Simone 'evilsocket' Margaritelli
+# evilsocket@gmail.com
+# http://www.evilsocket.net
+#
+# This file may be licensed under the terms of of the
+# GNU General Public License Version 3 (the ``GPL'').
+#
+# Software distributed under the License is distributed
+# on an ``AS IS'' basis, WITHOUT WARRANTY OF ANY KIND, either
+# express or implied. See the GPL for the specific language
+# governing rights and limitations.
+#
+# You should have received a copy of the GPL along with this
+# program. If not, go to http://www.gnu.org/licenses/gpl.html
+# or write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+
+import os
+import multiprocessing
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from smali.batch import run_job
+from smali.cache import ProgramCache
+from smali.client import ProtocolError, parse_address, receive_message, send_message
+from smali.emulator import Emulator
+from smali.loader import ClassLoader
+
+# Emulator of the pool worker process.
+_emulator = None
+
+
+def _initialize(paths, capacity, cache, max_steps, deadline):
+    global _emulator
+    _emulator = Emulator(exit=False, loader=ClassLoader(paths, capacity),
+                         cache=ProgramCache(cache) if cache else None, max_steps=max_steps, deadline=deadline)
+
+
+def _run(job):
+    return run_job(_emulator, job, restricted=True)
+
+
+def is_loopback(host):
+    """True if a host name or address can only be reached from this machine."""
+    return host in ('localhost', '::1') or host.startswith('127.')
+
+
+class Handler(socketserver.BaseRequestHandler):
+    """Serve the requests of a connection, one at a time, until the client closes it."""
+    def handle(self):
+        while True:
+            try:
+                job = receive_message(self.request)
+            except ProtocolError as e:
+                send_message(self.request, {'error': "ProtocolError: %s" % e})
+                return
+
+            if job is None:
+                return
+            send_message(self.request, self.server.execute(job))
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class Daemon(object):
+    """
+    Long running emulator serving length prefixed JSON requests over a Unix domain socket or
+    TCP. Connections are handled by threads while jobs run on a pool of processes, every one
+    with a warm cache of the most recently used classes and their decoded methods. Jobs can
+    only load the files inside the search paths, and TCP is bound to the loopback interface
+    unless the daemon is made public.
+    """
+    def __init__(self, address, paths=(), workers=None, capacity=None, tasks=None, cache=None,
+                 max_steps=None, deadline=None, public=False):
+        """
+        :param address: A host:port pair or the path of the Unix domain socket to listen on, the
+                        host is 127.0.0.1 if omitted.
+        :param paths: Directories to search classes in.
+        :param workers: Number of processes, the number of CPUs if None.
+        :param capacity: Number of classes kept loaded by every process, unbounded if None.
+        :param tasks: Number of jobs after which a process is replaced by a new one, never if None.
+        :param cache: Optional directory of the ProgramCache shared by the processes.
+        :param max_steps: Maximum number of steps of every job, unlimited if None.
+        :param deadline: Maximum seconds of execution of every job, unlimited if None.
+        :param public: If true, listen on any host, any peer reaching it can then run jobs.
+        """
+        address = parse_address(address)
+        if isinstance(address, tuple) and not public and not is_loopback(address[0]):
+            raise ValueError("Refusing to listen on %s:%d, which is not a loopback address." % address)
+
+        self.pool = multiprocessing.Pool(workers, _initialize, (list(paths), capacity, cache, max_steps, deadline),
+                                         tasks)
+        if isinstance(address, tuple):
+            self.server = TCPServer(address, Handler)
+        else:
+            if os.path.exists(address):
+                os.unlink(address)
+            self.server = UnixServer(address, Handler)
+
+        self.server.execute = self.execute
+        self.address = self.server.server_address
+
+    def execute(self, job):
+        if not isinstance(job, dict):
+            return {'error': "ProtocolError: Requests must be JSON objects."}
+        return self.pool.apply(_run, (job,))
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def shutdown(self):
+        """Stop serving, from another thread than the one running serve_forever."""
+        self.server.shutdown()
+        self.close()
+
+    def close(self):
+        self.server.server_close()
+        self.pool.terminate()
+        self.pool.join()
+        if not isinstance(self.address, tuple) and os.path.exists(self.address):
+            os.unlink(self.address)
@@ -32,11 +32,12 @@ def get_source_from_file(filename):
 
 
 class Source(object):
-    def __init__(self, lines=None):
+    def __init__(self, lines=None, start=0):
         if not lines:
             raise MissingSource("Missing Source Code.")
 
         self.lines = lines[:]
+        self.start = start  # index of the first line in the original file
 
     def has_line(self, index):
         return 0 <= index < len(self.lines)
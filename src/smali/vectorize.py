@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+# This file is part of the Smali Emulator.
+#
+# Copyright(c) 2016 Simone 'evilsocket' Margaritelli
+# evilsocket@gmail.com
+# http://www.evilsocket.net
+#
+# This file may be licensed under the terms of of the
+# GNU General Public License Version 3 (the ``GPL'').
+#
+# Software distributed under the License is distributed
+# on an ``AS IS'' basis, WITHOUT WARRANTY OF ANY KIND, either
+# express or implied. See the GPL for the specific language
+# governing rights and limitations.
+#
+# You should have received a copy of the GPL along with this
+# program. If not, go to http://www.gnu.org/licenses/gpl.html
+# or write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+
+# Counted loops over arrays run as a handful of NumPy operations. A loop qualifies when its body is
+# straight-line code made of array reads and writes, integer arithmetic and moves, where every
+# register is written before being read in the same iteration, except for the counter which is
+# incremented by one at the end of it. The header of such a loop is replaced by a superinstruction
+# running all of its iterations at once, on arrays with one element per iteration, and falling back
+# to the interpreter whenever it can't tell it'd compute the very same values.
+
+import array
+
+from smali.arrays import INTEGERS
+from smali.opcodes import (
+    Instruction, op_Const, op_Move, op_ArrayLength, op_Aget, op_APut, op_IfGe, op_GoTo, op_AddIntLit,
+    op_MulIntLit, op_XorInt2Addr, op_XorIntLit, op_AddInt, op_SubInt, op_MulInt, op_RemInt, op_AndInt,
+    op_AndIntLit, op_OrInt, op_ShlIntLit, op_RemIntLit, op_IntToType,
+)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Minimum number of iterations for a loop to be vectorized, shorter ones are cheaper to interpret.
+MIN_ITERATIONS = 16
+
+# Bound of the integers computed by a vectorized loop, so that int64 arithmetic never overflows.
+LIMIT = 2 ** 62
+
+STRINGS = (str, type(u''))
+
+# Registers read and written by the opcodes a loop body can be made of, by opcode class: the indexes
+# of the operands which are read and the index of the one which is written, if any.
+EFFECTS = {
+    op_Const: ((), 0),
+    op_Move: ((1,), 0),
+    op_ArrayLength: ((1,), 0),
+    op_Aget: ((1, 2), 0),
+    op_APut: ((0, 1, 2), None),
+    op_AddIntLit: ((1,), 0),
+    op_MulIntLit: ((1,), 0),
+    op_AndIntLit: ((1,), 0),
+    op_RemIntLit: ((1,), 0),
+    op_ShlIntLit: ((1,), 0),
+    op_XorIntLit: ((1,), 0),
+    op_XorInt2Addr: ((0, 1), 0),
+    op_AddInt: ((1, 2), 0),
+    op_SubInt: ((1, 2), 0),
+    op_MulInt: ((1, 2), 0),
+    op_RemInt: ((1, 2), 0),
+    op_AndInt: ((1, 2), 0),
+    op_OrInt: ((1, 2), 0),
+    op_IntToType: ((2,), 1),
+}
+
+# Opcodes taking two registers operands, the other ones take a register and a literal.
+BINARY = (op_AddInt, op_SubInt, op_MulInt, op_RemInt, op_AndInt, op_OrInt)
+
+# Index of the array operand of the opcodes accessing arrays.
+ARRAYS = {op_ArrayLength: 1, op_Aget: 1, op_APut: 1}
+
+# Kinds of the values computed by a loop: integers, chars made by int-to-char and chars read from
+# a list or a register, these last ones can only be xor-ed or copied as they are.
+INT, CHAR, ORIG = 'int', 'char', 'orig'
+
+
+class Unsupported(Exception):
+    """Raised when a loop can't be vectorized with the values it's run with."""
+    pass
+
+
+class Loop(object):
+    """A counted loop over arrays found in the decoded code, see vectorize."""
+    __slots__ = ('header', 'counter', 'bound', 'length', 'exit', 'body', 'written', 'steps', 'fused')
+
+    def __init__(self, header, counter, bound, length, exit, body, written, steps, fused):
+        self.header = header    # original instruction of the header, run when the loop isn't vectorized
+        self.counter = counter  # register of the loop counter
+        self.bound = bound      # register the counter is compared with
+        self.length = length    # register of the array whose length is the bound, if the header takes it
+        self.exit = exit        # offset of the first instruction after the loop
+        self.body = body        # ( opcode class, operands, index offset ) of the body, but the increment
+        self.written = written  # registers written by the body, but the counter
+        self.steps = steps      # ( steps of the header, steps of an iteration of the body ) as interpreted
+        self.fused = fused      # superinstructions run by an iteration of the body
+
+
+class Value(object):
+    """Value of a register along the iterations, a python integer if it's the same for all of them."""
+    __slots__ = ('kind', 'data', 'origin')
+
+    def __init__(self, kind, data, origin=None):
+        self.kind = kind      # INT, CHAR or ORIG
+        self.data = data      # the integers, or the codes of the chars
+        self.origin = origin  # ( list, indexes ) the ORIG chars are read from
+
+    def objects(self, count):
+        """The python objects the interpreter would have computed, one per iteration."""
+        if self.kind == ORIG:
+            source, indexes = self.origin
+            if isinstance(indexes, numpy.ndarray):
+                return [source[idx] for idx in indexes.tolist()]
+            return [source[indexes]] * count
+        data = self.data
+        values = data.tolist() if isinstance(data, numpy.ndarray) else [data] * count
+        return [chr(value) for value in values] if self.kind == CHAR else values
+
+    def last(self):
+        """The python object the interpreter would have computed by the last iteration."""
+        if self.kind == ORIG:
+            source, indexes = self.origin
+            return source[last(indexes)]
+        value = last(self.data)
+        return chr(value) if self.kind == CHAR else value
+
+
+def last(data):
+    """Last of some integers, as a python integer."""
+    return int(data[-1]) if isinstance(data, numpy.ndarray) else data
+
+
+def literal(value):
+    """A literal operand, which must be an integer."""
+    if type(value) not in INTEGERS or abs(value) >= LIMIT:
+        raise Unsupported("literal %r" % (value,))
+    return value
+
+
+def magnitude(data):
+    """Upper bound of the absolute value of some integers."""
+    if isinstance(data, numpy.ndarray):
+        return int(numpy.abs(data).max())
+    return abs(data)
+
+
+class Run(object):
+    """All the iterations of a loop, computed on the registers and arrays of the VM."""
+    def __init__(self, loop, regs, start, stop):
+        self.loop = loop
+        self.regs = regs
+        self.count = stop - start
+        self.env = {loop.counter: Value(INT, numpy.arange(start, stop, dtype=numpy.int64))}
+        self.arrays = {}  # id of an array -> integers or codes of its elements, kind of the elements
+        self.stores = {}  # id of a written array -> array, offset of its indexes, last stored value
+        for opcode, args, offset in loop.body:
+            if opcode is op_APut:
+                target = regs[args[1]]
+                if self.stores.setdefault(id(target), [target, offset, None])[1] != offset:
+                    raise Unsupported("array written at different indexes")
+        self.start = start
+
+    def read(self, key):
+        """Value of a register, loop invariant ones are taken from the VM."""
+        value = self.env.get(key)
+        if value is not None:
+            return value
+
+        obj = self.regs[key]
+        if type(obj) in INTEGERS and abs(obj) < LIMIT:
+            value = Value(INT, obj)
+        elif isinstance(obj, STRINGS) and len(obj) == 1:
+            value = Value(ORIG, ord(obj), ([obj], 0))
+        else:
+            raise Unsupported("register %s holds %r" % (key, obj))
+        self.env[key] = value
+        return value
+
+    def integers(self, *keys):
+        """Data of some registers which must hold integers."""
+        values = [self.read(key) for key in keys]
+        if any(value.kind != INT for value in values):
+            raise Unsupported("not an integer")
+        return [value.data for value in values]
+
+    def elements(self, key):
+        """Integers or codes of the elements of an array read by the body, and their kind."""
+        arr = self.regs[key]
+        cached = self.arrays.get(id(arr))
+        if cached is None:
+            if isinstance(arr, array.array) and arr.typecode not in 'fd':
+                cached = (numpy.array(arr, dtype=numpy.int64), INT)
+            elif isinstance(arr, list) and all(type(item) in INTEGERS for item in arr):
+                cached = (numpy.array(arr, dtype=numpy.int64), INT)
+            elif isinstance(arr, list) and all(isinstance(item, STRINGS) and len(item) == 1 for item in arr):
+                cached = (numpy.array([ord(item) for item in arr], dtype=numpy.int64), ORIG)
+            else:
+                raise Unsupported("array of %r" % type(arr))
+            if cached[1] == INT and len(arr) and magnitude(cached[0]) >= LIMIT:
+                raise Unsupported("integers too large")
+            self.arrays[id(arr)] = cached
+        return cached
+
+    def execute(self):
+        """Compute the body, raising Unsupported if it can't be done exactly."""
+        for opcode, args, offset in self.loop.body:
+            if opcode is op_Aget:
+                self.aget(args, offset)
+            elif opcode is op_APut:
+                self.aput(args, offset)
+            else:
+                self.env[args[EFFECTS[opcode][1]]] = self.compute(opcode, args)
+
+    def aget(self, args, offset):
+        vx, va, vidx = args
+        store = self.stores.get(id(self.regs[va]))
+        if store is not None and store[1] != offset:
+            raise Unsupported("array read and written at different indexes")
+        if store is not None and store[2] is not None and isinstance(store[0], list):
+            # the element stored by this same iteration
+            self.env[vx] = store[2]
+            return
+
+        codes, kind = self.elements(va)
+        idx, = self.integers(vidx)
+        data = codes[idx]
+        if not isinstance(idx, numpy.ndarray):
+            data = int(data)
+        self.env[vx] = Value(kind, data, (self.regs[va], idx) if kind == ORIG else None)
+
+    def aput(self, args, offset):
+        vx, va, vidx = args
+        value = self.read(vx)
+        arr = self.regs[va]
+        start = self.start + offset
+        if start < 0 or start + self.count > len(arr):
+            raise Unsupported("store out of bounds")
+
+        if isinstance(arr, array.array):
+            if arr.typecode in 'fd':
+                raise Unsupported("floating point array")
+            # typed arrays truncate the values and chars are stored as their code, see store
+            codes = self.elements(va)[0]
+            data = numpy.asarray(value.data, dtype=numpy.int64).astype(numpy.dtype(arr.typecode))
+            codes[start:start + self.count] = data
+        self.stores[id(arr)][2] = value
+
+    def compute(self, opcode, args):
+        """Value written by an opcode which doesn't access arrays."""
+        if opcode is op_Const:
+            return Value(INT, literal(args[1]))
+        elif opcode is op_Move:
+            return self.read(args[1])
+        elif opcode is op_ArrayLength:
+            return Value(INT, len(self.regs[args[1]]))
+        elif opcode is op_IntToType:
+            ctype, vx, vy = args
+            y, = self.integers(vy)
+            return Value(CHAR, y & 0xFF) if ctype == 'char' else Value(INT, y)
+        elif opcode is op_XorIntLit:
+            # chars are xor-ed by their code
+            return Value(INT, self.read(args[1]).data ^ literal(args[2]))
+        elif opcode is op_XorInt2Addr:
+            x, = self.integers(args[0])
+            return Value(INT, x ^ self.read(args[1]).data)
+
+        if opcode in BINARY:
+            y, z = self.integers(args[1], args[2])
+        else:
+            (y,), z = self.integers(args[1]), literal(args[2])
+
+        if opcode in (op_AddIntLit, op_AddInt, op_SubInt):
+            if magnitude(y) + magnitude(z) >= LIMIT:
+                raise Unsupported("overflow")
+            return Value(INT, y - z if opcode is op_SubInt else y + z)
+        elif opcode in (op_MulIntLit, op_MulInt):
+            if magnitude(y) * magnitude(z) >= LIMIT:
+                raise Unsupported("overflow")
+            return Value(INT, y * z)
+        elif opcode is op_ShlIntLit:
+            if not 0 <= z < 62 or magnitude(y) << z >= LIMIT:
+                raise Unsupported("overflow")
+            return Value(INT, y << z)
+        elif opcode in (op_RemIntLit, op_RemInt):
+            if not numpy.all(z):
+                raise Unsupported("division by zero")
+            return Value(INT, y % z)
+        elif opcode in (op_AndIntLit, op_AndInt):
+            return Value(INT, y & z)
+        return Value(INT, y | z)
+
+    def commit(self, vm):
+        """Write the arrays and the registers as the interpreter would have left them."""
+        loop = self.loop
+        regs = self.regs
+        # chars are copied from the lists before any of them is written
+        registers = [(key, self.env[key].last()) for key in loop.written]
+        slices = []
+        for arr, offset, value in self.stores.values():
+            start = self.start + offset
+            if isinstance(arr, array.array):
+                codes = self.arrays[id(arr)][0][start:start + self.count]
+                data = array.array(arr.typecode, codes.astype(numpy.dtype(arr.typecode)).tobytes())
+            else:
+                data = value.objects(self.count)
+            slices.append((arr, start, data))
+
+        for arr, start, data in slices:
+            arr[start:start + self.count] = data
+        for key, value in registers:
+            regs[key] = value
+        regs[loop.counter] = self.start + self.count
+        if loop.length is not None:
+            regs[loop.bound] = self.start + self.count
+
+        header, body = loop.steps
+        vm.steps += (self.count + 1) * header + self.count * body - 1
+        vm.fused += self.count * loop.fused
+        vm.pc = loop.exit
+
+
+class VectorLoop(object):
+    """Superinstruction running all the iterations of a loop at once, see vectorize."""
+    @staticmethod
+    def eval(vm, loop):
+        emu = vm.emu
+        regs = vm.regs
+        if emu.budget is None and emu.profiler is None and emu.trace is False:
+            try:
+                start = regs[loop.counter]
+                stop = len(regs[loop.length]) if loop.length is not None else regs[loop.bound]
+                if type(start) in INTEGERS and type(stop) in INTEGERS and \
+                        MIN_ITERATIONS <= stop - start and -LIMIT < start < stop < LIMIT:
+                    run = Run(loop, regs, start, stop)
+                    run.execute()
+                    run.commit(vm)
+                    return
+            except (Unsupported, ArithmeticError, IndexError, KeyError, TypeError, ValueError):
+                pass
+
+        header = loop.header
+        header.eval(vm, *header.args)
+
+
+def analyze(code, start, end):
+    """
+    Recognize a loop from the target of a backward goto to the goto itself.
+    :param code: The decoded code, after the superinstructions were fused.
+    :param start: Offset of the header of the loop.
+    :param end: Offset of the goto.
+    :return: A Loop instance, or None if the code isn't a loop which can be vectorized.
+    """
+    header = code[start]
+    length = None
+    pc = start
+    if isinstance(header.opcode, op_ArrayLength):
+        bound, length = header.args
+        pc += 1
+    if pc >= end or not isinstance(code[pc].opcode, op_IfGe) or code[pc].parts is not None:
+        return None
+    counter, limit, exit = code[pc].args
+    if (length is not None and limit != bound) or counter == limit or start <= exit <= end:
+        return None
+    bound = limit
+    headers = pc + 1 - start
+
+    steps = fused = 0
+    body = []
+    pc += 1
+    while pc < end:
+        insn = code[pc]
+        steps += 1
+        if insn.parts is not None:
+            fused += 1
+        parts = insn.parts or (insn,)
+        body.extend(parts)
+        pc += len(parts)
+    if pc != end or not body or not isinstance(body[-1].opcode, op_AddIntLit) or \
+            body[-1].args != (counter, counter, 1):
+        return None
+
+    body = body[:-1]
+    effects = [EFFECTS.get(type(insn.opcode)) for insn in body]
+    if None in effects or any(isinstance(insn.opcode, op_IntToType) and insn.args[0] not in ('char', 'byte')
+                              for insn in body):
+        return None
+    writes = set(insn.args[write] for insn, (reads, write) in zip(body, effects) if write is not None)
+    arrays = set(insn.args[ARRAYS[type(insn.opcode)]] for insn in body if type(insn.opcode) in ARRAYS)
+    if writes & (arrays | set((counter, bound, length))):
+        return None
+
+    # the index of the array accesses, as an offset from the counter when it is one
+    offsets = {counter: 0}
+    written = []
+    decoded = []
+    for insn in body:
+        opcode, args = type(insn.opcode), insn.args
+        reads, write = EFFECTS[opcode]
+        if any(args[idx] in writes and args[idx] not in written for idx in reads):
+            return None  # the value of a previous iteration is read
+        offset = offsets.get(args[2]) if opcode in (op_Aget, op_APut) else None
+        if opcode is op_APut and offset is None:
+            return None
+        decoded.append((opcode, args, offset))
+
+        if write is not None:
+            key = args[write]
+            offsets.pop(key, None)
+            if opcode is op_Move and args[1] in offsets:
+                offsets[key] = offsets[args[1]]
+            elif opcode is op_AddIntLit and args[1] in offsets:
+                offsets[key] = offsets[args[1]] + args[2]
+            if key not in written:
+                written.append(key)
+
+    return Loop(header, counter, bound, length, exit, tuple(decoded), tuple(written), (headers, steps + 1), fused)
+
+
+def vectorize(vm):
+    """
+    Replace the header of the counted loops over arrays of the decoded code with superinstructions
+    running them with NumPy, if it's available. It must run after fuse, so that the loops account
+    for the superinstructions of their body.
+    :param vm: Instance of the VM holding the decoded code.
+    :return: The number of vectorized loops.
+    """
+    if numpy is None:
+        return 0
+
+    code = vm.code
+    count = 0
+    for end, insn in enumerate(code):
+        if isinstance(insn.opcode, op_GoTo) and insn.args[0] < end and code[insn.args[0]].parts is None:
+            start = insn.args[0]
+            loop = analyze(code, start, end)
+            if loop is not None:
+                first = code[start]
+                code[start] = Instruction(VectorLoop.eval, (loop,), first.index, first.line, parts=(first,))
+                count += 1
+    return count
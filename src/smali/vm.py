@@ -18,18 +18,199 @@
 # or write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
+import copy
+import array
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
 from smali.object_mapping import ObjectMapping
 
+# Python exceptions raised by the emulation for the Java exception types, by descriptor. Types
+# which aren't here catch only the exceptions which declare them as their 'java_class'.
+EXCEPTION_TYPES = {
+    'Ljava/lang/Throwable;': (Exception,),
+    'Ljava/lang/Exception;': (Exception,),
+    'Ljava/lang/RuntimeException;': (Exception,),
+    'Ljava/lang/ArithmeticException;': (ArithmeticError,),
+    'Ljava/lang/IndexOutOfBoundsException;': (IndexError,),
+    'Ljava/lang/ArrayIndexOutOfBoundsException;': (IndexError,),
+    'Ljava/lang/StringIndexOutOfBoundsException;': (IndexError,),
+    'Ljava/lang/NullPointerException;': (AttributeError, TypeError),
+    'Ljava/lang/ClassCastException;': (TypeError,),
+    'Ljava/lang/IllegalArgumentException;': (ValueError,),
+    'Ljava/lang/NumberFormatException;': (ValueError,),
+    'Ljava/lang/OutOfMemoryError;': (MemoryError,),
+}
+
+# Types of the values which snapshots share with the VMs they're restored to, since they never change.
+IMMUTABLE_TYPES = frozenset(type(value) for value in (None, True, 0, 2 ** 64, 0.0, '', u'', b''))
+
+
+class Registers(MutableMapping):
+    """Dictionary view, by register name, of a register file made of slots."""
+    def __init__(self, vm):
+        self.vm = vm
+
+    def __getitem__(self, name):
+        return self.vm.regs[self.vm.slots[name]]
+
+    def __setitem__(self, name, value):
+        self.vm.regs[self.vm.register(name)] = value
+
+    def __delitem__(self, name):
+        raise TypeError("Registers can't be removed from a register file.")
+
+    def __iter__(self):
+        return iter(self.vm.slots)
+
+    def __len__(self):
+        return len(self.vm.slots)
+
+    def copy(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return repr(self.copy())
+
+
+class CatchBlocks(list):
+    """
+    Try/catch blocks as ( start, end, target, type ) tuples of opcodes offsets, in declaration
+    order, the type is None for .catchall. The handlers are indexed by the offset following the
+    throwing instruction, so that a throw is dispatched with a single lookup.
+    """
+    def __init__(self, blocks=(), size=0):
+        """
+        :param blocks: The try/catch blocks.
+        :param size: Number of offsets to index, the length of the code plus one.
+        """
+        list.__init__(self, blocks)
+        self.table = [()] * size  # offset -> ( ( python classes, java type, target ), ... )
+        extended = {}  # handlers shared by the offsets covered by the same blocks
+        for block, (start, end, target, name) in enumerate(self):
+            handler = (EXCEPTION_TYPES.get(name, ()) if name is not None else (Exception,), name, target)
+            for pc in range(start + 1, min(end, size - 1) + 1):
+                handlers = self.table[pc]
+                key = (id(handlers), block)
+                if key not in extended:
+                    extended[key] = handlers + (handler,)
+                self.table[pc] = extended[key]
+
+    def handlers(self, pc):
+        """The handlers covering an offset, in declaration order."""
+        return self.table[pc] if pc < len(self.table) else ()
+
+    def target(self, pc, e):
+        """
+        Find the handler of an exception.
+        :param pc: Offset following the instruction which raised the exception.
+        :param e: The exception.
+        :return: The offset of the first handler catching the exception, or None.
+        """
+        for classes, name, target in self.handlers(pc):
+            if isinstance(e, classes) or (name is not None and getattr(e, 'java_class', None) == name):
+                return target
+        return None
+
+
+class Frame(object):
+    """State of a caller, saved while the method it invoked runs."""
+    __slots__ = ('program', 'code', 'labels', 'catch_blocks', 'packed_switches', 'array_data', 'regs', 'slots', 'pc',
+                 'resume')
+
+
+def duplicate(value, memo):
+    """
+    Copy a value held by a register, arrays are copied with a single slice and the objects of
+    the mapped classes with copy.deepcopy, while immutable values are shared.
+    :param value: The value to copy.
+    :param memo: Dictionary of the values already copied by id, as for copy.deepcopy, so that
+                 the values referenced by several registers or arrays are copied once.
+    :return: The copy.
+    """
+    if type(value) in IMMUTABLE_TYPES:
+        return value
+
+    copied = memo.get(id(value))
+    if copied is None:
+        if isinstance(value, array.array):
+            copied = memo[id(value)] = value[:]
+        elif isinstance(value, list):
+            # arrays of chars and strings, or of other arrays and objects
+            copied = memo[id(value)] = list(value)
+            if not IMMUTABLE_TYPES.issuperset(map(type, value)):
+                for idx, item in enumerate(copied):
+                    if type(item) not in IMMUTABLE_TYPES:
+                        copied[idx] = duplicate(item, memo)
+        else:
+            copied = copy.deepcopy(value, memo)
+    return copied
+
+
+class Snapshot(object):
+    """
+    State of a VM between two instructions of its running method, see VM.snapshot. The decoded
+    code, labels and data blocks of the program are shared, since they're never written once the
+    program is decoded, while the registers, the static fields of the class and the values they
+    hold are copied.
+    """
+    __slots__ = ('program', 'code', 'labels', 'catch_blocks', 'packed_switches', 'array_data', 'regs', 'slots',
+                 'exceptions', 'result', 'return_v', 'stop', 'pc', 'fused', 'klass', 'steps', 'fields', 'initialized')
+
+    def __init__(self, vm, memo):
+        """
+        :param vm: The VM, it must not be running an invoked method.
+        :param memo: Dictionary of the values already copied, None to share them with the VM.
+        """
+        self.program, self.code, self.labels, self.catch_blocks = vm.program, vm.code, vm.labels, vm.catch_blocks
+        self.packed_switches, self.array_data = vm.packed_switches, vm.array_data
+        self.regs, self.slots = Snapshot.copy(vm.regs, memo), None if vm.slots is None else dict(vm.slots)
+        self.exceptions = list(vm.exceptions)
+        self.result, self.return_v = Snapshot.copy(vm.result, memo), Snapshot.copy(vm.return_v, memo)
+        self.stop, self.pc, self.fused, self.klass, self.steps = vm.stop, vm.pc, vm.fused, vm.klass, vm.steps
+        if vm.klass is not None:
+            self.fields, self.initialized = Snapshot.copy(vm.klass.fields, memo), vm.klass.initialized
+
+    @staticmethod
+    def copy(value, memo):
+        if memo is None:
+            return value
+        elif isinstance(value, dict):
+            return dict((name, duplicate(item, memo)) for name, item in value.items())
+        return duplicate(value, memo)
+
+    def apply(self, vm, memo):
+        """
+        Set the state of a VM to the snapshot.
+        :param vm: The VM.
+        :param memo: Dictionary of the values already copied, None to hand the values of the
+                     snapshot to the VM, which must then be the only one to use them.
+        """
+        vm.program, vm.code, vm.labels, vm.catch_blocks = self.program, self.code, self.labels, self.catch_blocks
+        vm.packed_switches, vm.array_data = self.packed_switches, self.array_data
+        vm.regs, vm.slots = Snapshot.copy(self.regs, memo), None if self.slots is None else dict(self.slots)
+        vm.exceptions = list(self.exceptions)
+        vm.result, vm.return_v = Snapshot.copy(self.result, memo), Snapshot.copy(self.return_v, memo)
+        vm.stop, vm.pc, vm.fused, vm.klass, vm.steps = self.stop, self.pc, self.fused, self.klass, self.steps
+        vm.frames = []
+        if self.klass is not None:
+            self.klass.fields, self.klass.initialized = Snapshot.copy(self.fields, memo), self.initialized
+
 
 class VM(object):
     """The virtual machine used by the emulator."""
     def __init__(self, emulator):
 
         self.emu = emulator  # we need the emulator instance in order to call its 'fatal' method.
-        self.mapping = ObjectMapping()  # holds the java->python objects and methods mapping
+        self.mapping = emulator.mapping  # holds the java->python objects and methods mapping
         self.labels = {}  # map of jump labels to opcodes offsets
-        self.variables = {}  # variables container
-        self.catch_blocks = []  # try/catch blocks container with opcodes offsets
+        self.code = []  # decoded instructions stream
+        self.regs = {}  # registers container, by name or by slot once a register file is allocated
+        self.slots = None  # map of register names to register file slots
+        self.catch_blocks = CatchBlocks()  # try/catch blocks container with opcodes offsets
         self.packed_switches = {}  # packed switches containers
         self.array_data = {}  # array data blocks
         self.exceptions = []  # list of thrown exceptions
@@ -37,37 +218,307 @@ class VM(object):
         self.return_v = None  # holds the return value of the method ( used by return-* opcodes )
         self.stop = False  # set to true when a return-* opcode is executed
         self.pc = 0  # current opcode index
+        self.fused = 0  # number of superinstructions executed
+        self.klass = None  # smali.loader.SmaliClass of the running method, if loaded from a class
+        self.frames = []  # call stack, frames of the callers of the running method
+        self.pool = []  # frames free for reuse
+        self.steps = 0  # number of steps executed by the invoked smali methods
+        self.program = None  # smali.loader.Program being run, if loaded from a class
+        self.stepping = False  # run the invoked smali methods in the slices of their caller, see Emulator.step
+
+    @property
+    def variables(self):
+        """Registers by name, a view of the register file when one is allocated."""
+        return self.regs if self.slots is None else Registers(self)
 
     def __getitem__(self, name):
-        return self.variables[name]
+        return self.regs[name]
 
     def __setitem__(self, name, value):
-        self.variables[name] = value
+        self.regs[name] = value
+
+    def allocate(self, size, params=0):
+        """
+        Switch to a register file of 'size' slots, the last 'params' ones are the
+        parameters registers, as in Dalvik ( p0 is an alias for v(size - params) ).
+        :param size: Number of registers of the method.
+        :param params: Number of registers used by the method parameters.
+        """
+        self.regs = [None] * size
+        self.slots = dict(('v%d' % i, i) for i in range(size))
+        self.slots.update(('p%d' % i, size - params + i) for i in range(params))
+
+    def load(self, program):
+        """
+        Load the decoded code of a method and allocate its registers.
+        :param program: The smali.loader.Program instance to run.
+        """
+        self.program = program
+        self.code = program.code
+        self.labels = program.labels
+        self.catch_blocks = program.catch_blocks
+        self.packed_switches = program.packed_switches
+        self.array_data = program.array_data
+        if program.slots is None:
+            self.regs = {}
+            self.slots = None
+        else:
+            self.regs = [None] * program.size
+            self.slots = dict(program.slots)
+
+    def restart(self):
+        """Reset the registers and the execution state to run the loaded program again."""
+        program = self.program
+        if program.slots is None:
+            self.regs = {}
+        else:
+            self.regs[:] = program.blank
+            if len(self.slots) != len(program.slots):
+                self.slots = dict(program.slots)
+
+        del self.exceptions[:]
+        self.result = None
+        self.return_v = None
+        self.stop = False
+        self.pc = 0
+        self.fused = 0
+        self.steps = 0
+
+    def reset(self):
+        """
+        Clear the state in place, so that the VM can load and run another program as a new one
+        would. The containers are replaced rather than emptied, since they may be shared with a
+        program or still referenced by the caller of the previous run, while the object mapping
+        and the pool of frames are kept.
+        :return: The VM itself.
+        """
+        self.labels = {}
+        self.code = []
+        self.regs = {}
+        self.slots = None
+        self.catch_blocks = CatchBlocks()
+        self.packed_switches = {}
+        self.array_data = {}
+        self.exceptions = []
+        self.result = None
+        self.return_v = None
+        self.stop = False
+        self.pc = 0
+        self.fused = 0
+        self.klass = None
+        self.frames = []
+        self.steps = 0
+        self.program = None
+        self.stepping = False
+        return self
+
+    def snapshot(self):
+        """
+        Save the state of the VM, so that the work done so far can be shared by several runs:
+        the registers ( with vm.variables ), the static fields of the running class, the arrays
+        and objects they hold, the exceptions and the pc are copied, the decoded program and
+        its array_data blocks are shared.
+        :return: A Snapshot instance, to be given to restore any number of times.
+        """
+        if self.frames:
+            raise ValueError("A snapshot can't be taken while an invoked method is running.")
+        return Snapshot(self, {})
+
+    def restore(self, snapshot):
+        """
+        Set the state of the VM to a snapshot, which is left untouched by the following run. The
+        static fields go back to their values in the snapshot too, in the class, which is shared
+        with the other VMs running it.
+        :param snapshot: A Snapshot instance taken by this VM or by another one of the same emulator.
+        :return: The VM itself.
+        """
+        snapshot.apply(self, {})
+        return self
+
+    def fork(self):
+        """
+        Copy the VM, the copy goes on from the current state without affecting this VM. It runs
+        a copy of the class, with static fields of its own.
+        :return: The new VM.
+        """
+        vm = VM(self.emu)
+        snapshot = self.snapshot()
+        if snapshot.klass is not None:
+            snapshot.klass = snapshot.klass.clone()
+        snapshot.apply(vm, None)
+        return vm
+
+    def statics(self, field):
+        """
+        The store of a static field: the fields of the running class, initialized by its
+        <clinit> on first access, or the registers for the fields of the other classes and
+        the code which isn't part of a class.
+        :param field: The field descriptor, like Lcom/example/Decryptor;->key:[B
+        :return: The dictionary holding the field, by descriptor.
+        """
+        klass = self.klass
+        if klass is None or field.split('->', 1)[0] != klass.name:
+            return self.variables
+        if not klass.initialized:
+            klass.initialize(self)
+        return klass.fields
+
+    def register(self, name):
+        """
+        Resolve a register name to its key in the registers container, names which are
+        not part of the register file layout get a new slot.
+        :param name: The register name.
+        :return: The slot index, or the name itself if no register file is allocated.
+        """
+        if self.slots is None:
+            return name
+
+        slot = self.slots.get(name)
+        if slot is None:
+            slot = self.slots[name] = len(self.regs)
+            self.regs.append(None)
+        return slot
 
     def fatal(self, message):
         self.emu.fatal(message)
 
-    def goto(self, label):
-        self.pc = self.labels[label]
+    def goto(self, target):
+        self.pc = target
 
     def exception(self, e):
-        self.exceptions.append(e)
+        # check if this operation is surrounded by a try/catch block handling the exception
+        target = self.catch_blocks.target(self.pc, e)
+        if target is not None:
+            self.exceptions.append(e)
+            self.goto(target)
+            return
 
-        # check if this operation is surrounded by a try/catch block
-        for block in self.catch_blocks:
-            start, end, label = block
-            if start <= self.pc <= end:
-                self.goto(label)
-                return
+        # nope, let the caller handle it
+        if self.frames and self.stepping:
+            self.leave()
+            self.exception(e)
+            return
+        elif self.frames:
+            raise e
 
-        # nope, report unhandled exception
+        # or report unhandled exception
         self.emu.fatal("Unhandled exception '%s'." % str(e) )
 
     def new_instance(self, klass):
         return self.mapping.new_instance(self, klass)
 
+    def resolve(self, class_name, method_name):
+        """
+        Find the method invoked by a call site, either a method of the running smali class or a
+        mapped one.
+        :param class_name: Mangled class name, without the trailing ';'.
+        :param method_name: Signature of the method.
+        :return: A function taking the VM, the register of the instance and the registers of
+                 the arguments, its return value ( if not None ) is the result of the call. The
+                 methods of the running class are entered without being run if the VM is stepping.
+        """
+        klass = self.klass
+        if klass is not None and klass.name == class_name + ';':
+            method = klass.method(method_name)
+            return lambda vm, this, args: vm.enter(method, this, args) if vm.stepping else vm.call(method, this, args)
+        return self.mapping.method(self, class_name, method_name)
+
     def invoke(self, this, class_name, method_name, args):
-        self.mapping.invoke(self, this, class_name, method_name, args )
+        result = self.resolve(class_name, method_name)(self, this, args)
+        if result is not None:
+            self.return_v = result
+
+    def dispatch(self, site, this, args):
+        """
+        Invoke the method of a call site, resolving it only if the site was never executed
+        in the running class.
+        :param site: The smali.object_mapping.CallSite of the invoke-* instruction.
+        :param this: Register holding the instance, or the first argument of static methods.
+        :param args: Registers holding the other arguments.
+        """
+        target = site.target if site.owner is self.klass else site.resolve(self)
+        result = target(self, this, args)
+        if result is not None:
+            self.return_v = result
+
+    def call(self, method, this, args):
+        """
+        Run a smali method on its own registers, the state of the caller is saved in a frame
+        and restored once the method returns, leaving its return value for move-result. The
+        method runs to completion even if the VM is stepping.
+        :param method: The smali.loader.Method instance to run.
+        :param this: Register holding the instance, or the first argument of static methods.
+        :param args: Registers holding the other arguments.
+        """
+        if self.stepping:
+            self.stepping = False
+            try:
+                self.call(method, this, args)
+            finally:
+                self.stepping = True
+            return
+
+        self.enter(method, this, args)
+        try:
+            steps = self.emu.interpret(self)
+            self.steps += steps
+        finally:
+            self.leave()
+
+    def enter(self, method, this, args):
+        """
+        Switch to a smali method without running it, the state of the caller is saved in a frame
+        until leave is called.
+        :param method: The smali.loader.Method instance to enter.
+        :param this: Register holding the instance, or the first argument of static methods.
+        :param args: Registers holding the other arguments.
+        """
+        program = self.emu.load(method)
+        regs = self.regs
+        values = () if this is None else (regs[this],) + tuple(regs[arg] for arg in args)
+
+        if program.slots is None:
+            registers, slots = dict(('p%d' % i, value) for i, value in enumerate(values)), None
+        else:
+            registers, slots = program.free.pop() if program.free else (list(program.blank), dict(program.slots))
+            for slot, value in zip(program.params, values):
+                registers[slot] = value
+
+        frame = self.pool.pop() if self.pool else Frame()
+        frame.program, frame.code, frame.labels, frame.catch_blocks = self.program, self.code, self.labels, self.catch_blocks
+        frame.packed_switches, frame.array_data = self.packed_switches, self.array_data
+        frame.regs, frame.slots, frame.pc, frame.resume = regs, self.slots, self.pc, None
+        self.frames.append(frame)
+
+        self.program, self.code, self.labels, self.catch_blocks = program, program.code, program.labels, program.catch_blocks
+        self.packed_switches, self.array_data = program.packed_switches, program.array_data
+        self.regs, self.slots, self.pc = registers, slots, 0
+        if self.stepping and self.emu.profiler is not None:
+            self.emu.profiler.enter(self)
+
+    def leave(self):
+        """Go back to the caller of the running method, restoring its state from its frame."""
+        program, registers, slots = self.program, self.regs, self.slots
+        frame = self.frames.pop()
+        self.program, self.code, self.labels, self.catch_blocks = frame.program, frame.code, frame.labels, frame.catch_blocks
+        self.packed_switches, self.array_data = frame.packed_switches, frame.array_data
+        self.regs, self.slots, self.pc = frame.regs, frame.slots, frame.pc
+        self.stop = False
+        frame.program = frame.regs = frame.slots = frame.resume = None
+        self.pool.append(frame)
 
+        # register files which grew past their layout are not reused
+        if slots is not None and len(registers) == program.size:
+            registers[:] = program.blank
+            program.free.append((registers, slots))
 
+        if self.stepping and self.emu.profiler is not None:
+            self.emu.profiler.leave()
 
+    def resume(self):
+        """Return from a method entered while stepping, finishing the invoke of its caller."""
+        resume = self.frames[-1].resume
+        self.leave()
+        if resume is not None:
+            handler, args = resume
+            handler(self, *args)
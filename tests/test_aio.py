@@ -0,0 +1,113 @@
+import os
+import sys
+
+import pytest
+
+if sys.version_info < (3, 5):
+    pytest.skip("asyncio front end requires Python 3.5", allow_module_level=True)
+
+import asyncio
+
+from smali.aio import run_method
+from smali.emulator import Emulator, EmulationError
+from smali.loader import ClassLoader, SmaliClass
+
+
+FILENAME = os.path.join(os.path.dirname(__file__), 'data', 'methods.smali')
+
+MISSING = """
+.class public Lcom/example/Missing;
+.super Ljava/lang/Object;
+
+.method public static missing()I
+    .locals 1
+
+    invoke-static {}, Ljava/lang/Math;->random()D
+
+    move-result v0
+
+    return v0
+.end method
+""".split('\n')
+
+
+def run(*coroutines, **kwargs):
+    loop = asyncio.new_event_loop()
+    try:
+        tasks = [loop.create_task(coroutine) for coroutine in coroutines]
+        return loop.run_until_complete(asyncio.gather(*tasks, **kwargs))
+    finally:
+        loop.close()
+
+
+def test_run_method():
+    method = ClassLoader().load_file(FILENAME).method('factorial')
+    emulator, expected = Emulator(), Emulator()
+    assert run(run_method(method, {'p0': 10}, slice_steps=3, emulator=emulator)) == [3628800]
+    assert expected.run_method(method, {'p0': 10}) == 3628800
+    assert emulator.stats.steps == expected.stats.steps
+
+
+@pytest.mark.parametrize('name, arg, expected', [('calls', 4, 54), ('factorial', 6, 720)])
+def test_invoked_methods(name, arg, expected):
+    method = ClassLoader().load_file(FILENAME).method(name)
+    emulator, reference = Emulator(), Emulator()
+    assert run(run_method(method, {'p0': arg}, slice_steps=1, emulator=emulator)) == [expected]
+    assert reference.run_method(method, {'p0': arg}) == expected
+    assert emulator.stats.steps == reference.stats.steps
+    assert not emulator.vm.frames
+
+
+def test_invoked_exception():
+    # the exception raised by the invoked method is caught by its caller
+    method = ClassLoader().load_file(FILENAME).method('safe')
+    emulator = Emulator()
+    assert run(run_method(method, {'p0': 5}, slice_steps=1, emulator=emulator)) == [-1]
+    assert not emulator.vm.frames
+
+
+def test_interleaving():
+    method = ClassLoader().load_file(FILENAME).method('fill')
+    emulators = [Emulator() for i in range(20)]
+    results = run(*[run_method(method, {'p0': i % 3}, slice_steps=1, emulator=emulator)
+                    for i, emulator in enumerate(emulators)])
+    assert [result.tolist() for result in results] == [[[2, 2, 3], [1, 3, 3], [1, 2, 4]][i % 3] for i in range(20)]
+    assert all(emulator.stats.steps == 7 for emulator in emulators)
+
+
+def test_cancellation():
+    klass = ClassLoader().load_file(FILENAME)
+    loop = asyncio.new_event_loop()
+    try:
+        spinning = loop.create_task(run_method(klass.method('spin'), {'p0': 0}, slice_steps=100))
+        assert loop.run_until_complete(run_method(klass.method('factorial'), {'p0': 5}, slice_steps=1)) == 120
+        assert not spinning.done()
+
+        spinning.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            loop.run_until_complete(spinning)
+    finally:
+        loop.close()
+
+
+def test_invoked_cancellation():
+    klass = ClassLoader().load_file(FILENAME)
+    loop = asyncio.new_event_loop()
+    try:
+        spinning = loop.create_task(run_method(klass.method('spinning'), slice_steps=100))
+        assert loop.run_until_complete(run_method(klass.method('factorial'), {'p0': 5}, slice_steps=1)) == 120
+        assert not spinning.done()
+
+        spinning.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            loop.run_until_complete(spinning)
+    finally:
+        loop.close()
+
+
+def test_emulation_error():
+    klass = ClassLoader().load_file(FILENAME)
+    results = run(run_method(SmaliClass(MISSING).method('missing')), run_method(klass.method('factorial'), {'p0': 5}),
+                  return_exceptions=True)
+    assert isinstance(results[0], EmulationError)
+    assert results[1] == 120
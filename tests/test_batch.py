@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from smali.batch import jsonable, run_pool
+from smali.emulator import Emulator
+from smali.loader import ClassLoader, search_paths
+from smali.objects.string_builder import Buffer
+
+
+FILENAME = os.path.join(os.path.dirname(__file__), 'data', 'methods.smali')
+DECRYPTOR = os.path.join(os.path.dirname(__file__), '..', 'utils', 'decryptor.smali')
+
+
+@pytest.mark.parametrize('compiled', [False, True])
+def test_run_many(compiled):
+    klass = ClassLoader().load_file(FILENAME)
+    args = [{'p0': n} for n in range(8)]
+
+    expected = []
+    for arg in args:
+        emu = Emulator()
+        ret = emu.run_method(klass.method('factorial'), arg, compiled=compiled)
+        expected.append((ret, emu.stats.steps))
+
+    emu = Emulator()
+    results = emu.run_many(klass.method('factorial'), iter(args), compiled=compiled)
+    assert list(results) == expected
+    assert emu.stats.steps == sum(steps for ret, steps in expected)
+
+
+def test_run_many_resets_registers():
+    klass = ClassLoader().load_file(FILENAME)
+    emu = Emulator()
+    results = emu.run_many(klass.method('fill'), [{'p0': 0}, {'p0': 0}, {'p0': 2}])
+    assert [ret.tolist() for ret, steps in results] == [[2, 2, 3], [2, 2, 3], [1, 2, 4]]
+
+    results = emu.run_many(klass.method('safe'), [{'p0': 5}, {'p0': 0}, {'p0': 5}])
+    assert [ret for ret, steps in results] == [-1, 0, -1]
+    assert emu.vm.exceptions == []
+
+
+def test_run_many_decryptor():
+    method = ClassLoader().load_file(DECRYPTOR).method('field5')
+    key = [-62, -99, -106, -125, -123, -105, -98, -37, -105, -97, -103, -41,
+           -118, -97, -113, -103, -109, -104, -115, 111, 98, 103, 35, 52]
+    args = [{'p0': key, 'p1': 19}, {'p0': key[:11], 'p1': 19}] * 3
+
+    emu = Emulator()
+    results = [ret for ret, steps in emu.run_many(method, args, compiled=True)]
+    assert results == ['/system/bin/setenfroce 0', '/system/bin'] * 3
+
+
+def test_run_pool(tmpdir):
+    directory = tmpdir.mkdir('smali').mkdir('com').mkdir('example')
+    directory.join('Methods.smali').write(open(FILENAME).read())
+    paths = search_paths(str(tmpdir))
+    assert paths == [str(tmpdir.join('smali'))]
+
+    jobs = [{'class': 'Lcom/example/Methods;', 'method': 'factorial', 'args': {'p0': n}} for n in range(10)]
+    jobs += [
+        {'class': 'Lcom/example/Methods;', 'method': 'missing'},
+        {'class': 'Lcom/example/Missing;', 'method': 'factorial'},
+        {'class': 'Lcom/example/Methods;', 'method': 'fill', 'args': {'p0': 5}},
+    ]
+    results = sorted(run_pool(paths, jobs, workers=2, tasks=3), key=lambda result: result['index'])
+    assert [result['index'] for result in results] == list(range(len(jobs)))
+    assert [result['result'] for result in results[:10]] == [1, 1, 2, 6, 24, 120, 720, 5040, 40320, 362880]
+    assert results[10]['error'].startswith('MethodNotFound')
+    assert results[11]['error'].startswith('ClassNotFound')
+    assert results[12]['error'].startswith('line ')
+    assert 'Unhandled exception' in results[12]['error']
+
+
+def test_jsonable():
+    assert jsonable([b'abc', (1, None), {'a': b'\xff'}]) == [u'abc', [1, None], {u'a': u'\xff'}]
+    assert jsonable(IndexError('index')) == repr(IndexError('index'))
+    buffer = Buffer(u'abc')
+    buffer.append(u'\xe9')
+    assert jsonable([buffer]) == [u'abc\xe9']
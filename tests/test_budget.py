@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+from smali.batch import run_method
+from smali.emulator import Emulator, BudgetExceeded
+from smali.loader import ClassLoader
+
+
+FILENAME = os.path.join(os.path.dirname(__file__), 'data', 'methods.smali')
+
+
+@pytest.mark.parametrize('compiled', [False, True])
+@pytest.mark.parametrize('name', ['spin', 'spinning'])
+def test_max_steps(compiled, name):
+    emu = Emulator(max_steps=2500)
+    result = emu.run_file(FILENAME, {'p0': 0}, method=name, compiled=compiled)
+    assert isinstance(result, BudgetExceeded)
+    assert result.reason == 'steps'
+    assert result.steps == emu.stats.steps == 2500
+
+    spin = emu.loader.load_file(FILENAME).method('spin')
+    assert spin.start < result.line < spin.end
+    assert spin.program.code[result.pc].index + 1 == result.line
+    assert emu.vm.frames == []
+
+
+def test_deadline():
+    emu = Emulator(deadline=0.05)
+    result = emu.run_file(FILENAME, {'p0': 0}, method='spinning')
+    assert isinstance(result, BudgetExceeded)
+    assert result.reason == 'deadline'
+    assert emu.stats.execution >= 50
+
+
+@pytest.mark.parametrize('compiled', [False, True])
+def test_within_budget(compiled):
+    emu = Emulator(max_steps=53, deadline=10)
+    assert emu.run_file(FILENAME, {'p0': 10}, method='factorial', compiled=compiled) == 3628800
+    assert emu.stats.steps == 53
+    assert emu.stats.fused == 10
+
+
+@pytest.mark.parametrize('compiled', [False, True])
+def test_run_many_budget(compiled):
+    klass = ClassLoader().load_file(FILENAME)
+    emu = Emulator(max_steps=7)
+    results = emu.run_many(klass.method('fill'), [{'p0': 0}] * 2, compiled=compiled)
+    assert [(ret.tolist(), steps) for ret, steps in results] == [([2, 2, 3], 7)] * 2
+    emu.max_steps = 6
+    results = list(emu.run_many(klass.method('fill'), [{'p0': 0}] * 2, compiled=compiled))
+    assert [result.reason for result, steps in results] == ['steps'] * 2
+    assert [steps for result, steps in results] == [6] * 2
+
+    emu.max_steps = 1000
+    results = emu.run_many(klass.method('spin'), [{'p0': 0}] * 3, compiled=True)
+    assert all(isinstance(result, BudgetExceeded) and steps == 1000 for result, steps in results)
+
+
+def test_batch_budget():
+    method = ClassLoader().load_file(FILENAME).method('spin')
+    result = run_method(Emulator(exit=False, max_steps=100), method, {'p0': 0})
+    assert result['steps'] == 100
+    assert result['budget_exceeded']['reason'] == 'steps'
+    assert result['error'].startswith('Budget exceeded')
@@ -0,0 +1,39 @@
+import os
+
+from smali.cache import ProgramCache
+from smali.emulator import Emulator
+from smali.source import get_source_from_file
+
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def run_cached(cache, filename):
+    emu = Emulator(cache=cache)
+    ret = emu.run_file(os.path.join(DATA, filename))
+    return ret, emu.vm.variables
+
+
+def test_cache_roundtrip(tmpdir):
+    cache = ProgramCache(str(tmpdir))
+    cold = run_cached(cache, 'packed-switch.smali')
+    assert len(tmpdir.listdir()) == 1
+    warm = run_cached(cache, 'packed-switch.smali')
+    assert cold == warm
+    assert len(tmpdir.listdir()) == 1
+
+
+def test_cache_restores_tables(tmpdir):
+    cache = ProgramCache(str(tmpdir))
+    for filename in ('array-data.smali', 'move-exception.smali'):
+        expected = run_cached(None, filename)
+        run_cached(cache, filename)
+        assert run_cached(cache, filename)[0] == expected[0]
+
+
+def test_cache_key_depends_on_content():
+    lines = get_source_from_file(os.path.join(DATA, 'goto.smali')).lines
+    assert ProgramCache.key('sig', lines) == ProgramCache.key('sig', list(lines))
+    assert ProgramCache.key('sig', lines) != ProgramCache.key('sig', lines + ['nop'])
+    assert ProgramCache.key('sig', lines) != ProgramCache.key('other', lines)
+    assert ProgramCache.key('sig', ['ab', 'c']) != ProgramCache.key('sig', ['a', 'bc'])
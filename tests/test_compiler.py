@@ -0,0 +1,79 @@
+import os
+
+import pytest
+
+from smali import compiler
+from smali.compiler import Compiler
+from smali.emulator import Emulator
+
+from test_suite import data_files
+
+
+DECRYPTOR = os.path.join(os.path.dirname(__file__), '..', 'utils', 'decryptor.smali')
+
+
+def run_source(source_code, compiled):
+    emu = Emulator()
+    ret = emu.run_source(source_code, compiled=compiled)
+    out = emu.vm.variables.copy()
+    out.update({'ret': ret})
+    return str(out)
+
+
+@pytest.mark.parametrize(
+    'filename, expected_result, input_source',
+    data_files()
+)
+def test_compiled_files(filename, expected_result, input_source):
+    assert expected_result == run_source(input_source, compiled=True)
+
+
+@pytest.mark.parametrize(
+    'filename, expected_result, input_source',
+    data_files()
+)
+def test_compiled_steps(filename, expected_result, input_source):
+    counts = []
+    for compiled in (False, True):
+        emu = Emulator()
+        emu.run_source(input_source, compiled=compiled)
+        counts.append((emu.stats.steps, emu.stats.fused))
+    assert counts[0] == counts[1]
+
+
+def test_compiled_decryptor():
+    args = {
+        'p0': [-62, -99, -106, -125, -123, -105, -98, -37, -105, -97, -103, -41,
+               -118, -97, -113, -103, -109, -104, -115, 111, 98, 103, 35, 52],
+        'p1': 19,
+    }
+    results = []
+    for compiled in (False, True):
+        emu = Emulator()
+        results.append(emu.run_file(DECRYPTOR, dict(args), compiled=compiled))
+    assert results[0] == results[1] == '/system/bin/setenfroce 0'
+
+
+def test_compiled_once(monkeypatch):
+    emu = Emulator(exit=False)
+    method = emu.loader.load_file(DECRYPTOR).method('field5')
+    compiled = []
+    compile = Compiler.compile
+
+    def counted(self):
+        compiled.append(self)
+        return compile(self)
+
+    monkeypatch.setattr(Compiler, 'compile', counted)
+    args = {'p0': [-62, -99, -106, -125], 'p1': 19}
+    results = [emu.run_method(method, dict(args), compiled=True) for _ in range(3)]
+    results.extend(result for result, steps in emu.run_many(method, [dict(args)], compiled=True))
+    assert len(set(results)) == 1
+    assert len(compiled) == 1 and list(method.program.functions) == [False]
+
+
+def test_code_cache_bounded(monkeypatch):
+    monkeypatch.setattr(compiler, 'CODE_CACHE_SIZE', 2)
+    for value in range(4):
+        Emulator(exit=False).run_source(['const/16 v0, %d' % value, 'return v0'], compiled=True)
+    assert len(compiler._code_cache) == 2
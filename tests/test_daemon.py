@@ -0,0 +1,71 @@
+import os
+import socket
+import threading
+
+import pytest
+
+from smali.client import Client, HEADER
+from smali.server import Daemon
+
+
+FILENAME = os.path.join(os.path.dirname(__file__), 'data', 'methods.smali')
+
+
+@pytest.fixture(params=['unix', 'tcp'])
+def daemon(request, tmpdir):
+    directory = tmpdir.mkdir('smali').mkdir('com').mkdir('example')
+    directory.join('Methods.smali').write(open(FILENAME).read())
+    address = str(tmpdir.join('smali.sock')) if request.param == 'unix' else '127.0.0.1:0'
+    daemon = Daemon(address, [str(tmpdir.join('smali'))], workers=2, capacity=1)
+    thread = threading.Thread(target=daemon.serve_forever)
+    thread.start()
+    yield daemon
+    daemon.shutdown()
+    thread.join()
+
+
+def test_daemon_requests(daemon):
+    with Client(daemon.address, timeout=10) as client:
+        for n in range(6):
+            assert client.run('Lcom/example/Methods;', 'factorial', {'p0': n}) == \
+                {'result': [1, 1, 2, 6, 24, 120][n], 'steps': 3 + 5 * n}
+        assert client.run_file('com/example/Methods.smali', 'fill', {'p0': 1}) == {'result': [1, 3, 3], 'steps': 7}
+        assert client.run('Lcom/example/Methods;', 'missing')['error'].startswith('MethodNotFound')
+        assert client.request(['not', 'a', 'job'])['error'].startswith('ProtocolError')
+        assert client.run('Lcom/example/Methods;', 'twice', {'p0': 4}) == {'result': 8, 'steps': 2}
+
+
+def test_daemon_search_paths(daemon, tmpdir):
+    outside = os.path.relpath(FILENAME, str(tmpdir.join('smali')))
+    with Client(daemon.address, timeout=10) as client:
+        for filename in (FILENAME, outside, os.devnull):
+            assert client.run_file(filename, 'fill', {'p0': 1})['error'].startswith('ClassNotFound')
+        assert client.run('L%s;' % outside[:-len('.smali')], 'fill', {'p0': 1})['error'].startswith('ClassNotFound')
+
+
+def test_daemon_public_address():
+    with pytest.raises(ValueError):
+        Daemon('0.0.0.0:0')
+
+
+def test_daemon_concurrent_clients(daemon):
+    results = {}
+
+    def run(n):
+        with Client(daemon.address, timeout=10) as client:
+            results[n] = client.run('Lcom/example/Methods;', 'factorial', {'p0': n})['result']
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {0: 1, 1: 1, 2: 2, 3: 6, 4: 24, 5: 120, 6: 720, 7: 5040}
+
+
+def test_daemon_malformed_message(daemon):
+    with Client(daemon.address, timeout=10) as client:
+        client.socket.sendall(HEADER.pack(5) + b'nope!')
+        size, = HEADER.unpack(client.socket.recv(HEADER.size))
+        assert b'ProtocolError' in client.socket.recv(size)
+        assert client.socket.recv(1) == b''
@@ -0,0 +1,115 @@
+import pytest
+
+from smali.emulator import Emulator, EmulationError
+from smali.vm import CatchBlocks
+
+
+SOURCE = """
+.class public Lcom/example/Throws;
+.super Ljava/lang/Object;
+
+.method public static pick(II)I
+    .locals 2
+
+    :try_start_0
+    new-array v0, p1, [I
+
+    aget v1, v0, p0
+
+    div-int v1, p1, p0
+
+    :try_end_0
+    .catch Ljava/lang/ArithmeticException; {:try_start_0 .. :try_end_0} :catch_0
+    .catch Ljava/lang/IndexOutOfBoundsException; {:try_start_0 .. :try_end_0} :catch_1
+
+    const/4 v1, 0x0
+
+    return v1
+
+    :catch_0
+    const/4 v1, 0x1
+
+    return v1
+
+    :catch_1
+    const/4 v1, 0x2
+
+    return v1
+.end method
+
+.method public static uncaught(I)I
+    .locals 1
+
+    :try_start_0
+    div-int v0, p0, p0
+
+    :try_end_0
+    .catch Ljava/io/IOException; {:try_start_0 .. :try_end_0} :catch_0
+
+    return v0
+
+    :catch_0
+    const/4 v0, -0x1
+
+    return v0
+.end method
+
+.method public static caller(I)I
+    .locals 1
+
+    :try_start_0
+    invoke-static {p0}, Lcom/example/Throws;->uncaught(I)I
+
+    move-result v0
+
+    :try_end_0
+    .catchall {:try_start_0 .. :try_end_0} :catchall_0
+
+    return v0
+
+    :catchall_0
+    const/4 v0, 0x7
+
+    return v0
+.end method
+""".split('\n')
+
+
+class Custom(Exception):
+    java_class = 'Ljava/io/IOException;'
+
+
+def test_catch_blocks_table():
+    blocks = CatchBlocks([(1, 3, 10, 'Ljava/lang/ArithmeticException;'), (0, 4, 20, None)], 6)
+    assert [len(blocks.handlers(pc)) for pc in range(8)] == [0, 1, 2, 2, 1, 0, 0, 0]
+    # offsets covered by the same blocks share their handlers
+    assert blocks.handlers(2) is blocks.handlers(3)
+    assert blocks.target(2, ZeroDivisionError()) == 10
+    assert blocks.target(2, IndexError()) == 20
+    assert blocks.target(1, ZeroDivisionError()) == 20
+    assert blocks.target(5, ZeroDivisionError()) is None
+
+    blocks = CatchBlocks([(0, 2, 10, 'Ljava/io/IOException;')], 3)
+    assert blocks.target(1, Custom()) == 10
+    assert blocks.target(1, ValueError()) is None
+
+
+@pytest.mark.parametrize('compiled', [False, True])
+def test_catch_by_type(compiled):
+    emu = Emulator()
+    assert emu.run_source(SOURCE, {'p0': 1, 'p1': 2}, method='pick', compiled=compiled) == 0
+    assert emu.run_source(SOURCE, {'p0': 0, 'p1': 2}, method='pick', compiled=compiled) == 1
+    assert emu.run_source(SOURCE, {'p0': 3, 'p1': 2}, method='pick', compiled=compiled) == 2
+
+
+@pytest.mark.parametrize('compiled', [False, True])
+def test_uncaught_type(compiled):
+    emu = Emulator(exit=False)
+    with pytest.raises(EmulationError):
+        emu.run_source(SOURCE, {'p0': 0}, method='uncaught', compiled=compiled)
+
+
+def test_catchall_from_callee():
+    emu = Emulator(exit=False)
+    assert emu.run_source(SOURCE, {'p0': 0}, method='caller') == 7
+    assert emu.vm.frames == []
@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+from smali.emulator import Emulator
+
+from test_suite import data_files
+
+
+def run_source(source_code, fusion):
+    emu = Emulator(fusion=fusion)
+    ret = emu.run_source(source_code)
+    out = emu.vm.variables.copy()
+    out.update({'ret': ret})
+    return str(out)
+
+
+@pytest.mark.parametrize(
+    'filename, expected_result, input_source',
+    data_files()
+)
+def test_unfused_files(filename, expected_result, input_source):
+    assert expected_result == run_source(input_source, fusion=False)
+
+
+def test_fused_steps():
+    filename = os.path.join(os.path.dirname(__file__), 'data', 'fusion.smali')
+    fused, unfused = Emulator(), Emulator(fusion=False)
+    assert fused.run_file(filename) == unfused.run_file(filename)
+    # one invoke sequence, one aget/xor/int-to-char and one add/if per iteration
+    assert fused.stats.fused == 9
+    assert unfused.stats.fused == 0
+    assert fused.stats.steps == unfused.stats.steps - 21
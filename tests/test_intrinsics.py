@@ -0,0 +1,188 @@
+import binascii
+
+import pytest
+
+from smali.crypto import AES, DES, TripleDES, BadPadding, crypt, pad, unpad
+from smali.emulator import Emulator, EmulationError
+
+
+SOURCE = """
+.class public Lcom/example/Intrinsics;
+.super Ljava/lang/Object;
+
+.method public static decrypt(Ljava/lang/String;Ljava/lang/String;Ljava/lang/String;)Ljava/lang/String;
+    .locals 4
+
+    const/4 v0, 0x0
+
+    invoke-static {p0, v0}, Landroid/util/Base64;->decode(Ljava/lang/String;I)[B
+
+    move-result-object v0
+
+    new-instance v1, Ljavax/crypto/spec/SecretKeySpec;
+
+    const-string v2, "0123456789abcdef"
+
+    invoke-virtual {v2}, Ljava/lang/String;->getBytes()[B
+
+    move-result-object v2
+
+    const-string v3, "AES"
+
+    invoke-direct {v1, v2, v3}, Ljavax/crypto/spec/SecretKeySpec;-><init>([BLjava/lang/String;)V
+
+    new-instance v2, Ljavax/crypto/spec/IvParameterSpec;
+
+    invoke-virtual {p1}, Ljava/lang/String;->getBytes()[B
+
+    move-result-object v3
+
+    invoke-direct {v2, v3}, Ljavax/crypto/spec/IvParameterSpec;-><init>([B)V
+
+    invoke-static {p2}, Ljavax/crypto/Cipher;->getInstance(Ljava/lang/String;)Ljavax/crypto/Cipher;
+
+    move-result-object v3
+
+    const/4 p0, 0x2
+
+    invoke-virtual {v3, p0, v1, v2}, Ljavax/crypto/Cipher;->init(ILjava/security/Key;Ljava/security/spec/AlgorithmParameterSpec;)V
+
+    invoke-virtual {v3, v0}, Ljavax/crypto/Cipher;->doFinal([B)[B
+
+    move-result-object v0
+
+    new-instance v1, Ljava/lang/String;
+
+    const-string v2, "UTF-8"
+
+    invoke-direct {v1, v0, v2}, Ljava/lang/String;-><init>([BLjava/lang/String;)V
+
+    return-object v1
+.end method
+
+.method public static hash(Ljava/lang/String;Ljava/lang/String;)Ljava/lang/String;
+    .locals 2
+
+    invoke-static {p1}, Ljava/security/MessageDigest;->getInstance(Ljava/lang/String;)Ljava/security/MessageDigest;
+
+    move-result-object v0
+
+    invoke-virtual {p0}, Ljava/lang/String;->getBytes()[B
+
+    move-result-object v1
+
+    invoke-virtual {v0, v1}, Ljava/security/MessageDigest;->digest([B)[B
+
+    move-result-object v0
+
+    const/4 v1, 0x2
+
+    invoke-static {v0, v1}, Landroid/util/Base64;->encodeToString([BI)Ljava/lang/String;
+
+    move-result-object v0
+
+    return-object v0
+.end method
+
+.method public static inflate([B)Ljava/lang/String;
+    .locals 4
+
+    new-instance v0, Ljava/util/zip/Inflater;
+
+    invoke-direct {v0}, Ljava/util/zip/Inflater;-><init>()V
+
+    invoke-virtual {v0, p0}, Ljava/util/zip/Inflater;->setInput([B)V
+
+    const/16 v1, 0x40
+
+    new-array v1, v1, [B
+
+    invoke-virtual {v0, v1}, Ljava/util/zip/Inflater;->inflate([B)I
+
+    move-result v2
+
+    invoke-virtual {v0}, Ljava/util/zip/Inflater;->finished()Z
+
+    move-result v3
+
+    if-eqz v3, :error
+
+    new-instance v0, Ljava/lang/String;
+
+    const/4 v3, 0x0
+
+    invoke-direct {v0, v1, v3, v2}, Ljava/lang/String;-><init>([BII)V
+
+    return-object v0
+
+    :error
+    const-string v0, "truncated"
+
+    return-object v0
+.end method
+""".split('\n')
+
+COMPRESSED = [120, -100, -53, 72, -51, -55, -55, 87, -56, 64, -112, 0, 58, 46, 6, 125]
+
+
+def unhex(value):
+    return binascii.unhexlify(value)
+
+
+@pytest.mark.parametrize('key, expected', [
+    ('000102030405060708090a0b0c0d0e0f', '69c4e0d86a7b0430d8cdb78070b4c55a'),
+    ('000102030405060708090a0b0c0d0e0f1011121314151617', 'dda97ca4864cdfe06eaf70a0ec0d7191'),
+    ('000102030405060708090a0b0c0d0e0f101112131415161718191a1b1c1d1e1f', '8ea2b7ca516745bfeafc49904b496089'),
+])
+def test_aes(key, expected):
+    # FIPS-197 appendix C
+    plain = unhex('00112233445566778899aabbccddeeff')
+    assert crypt(AES(unhex(key)), plain, True) == unhex(expected)
+    assert crypt(AES(unhex(key)), unhex(expected), False) == plain
+
+
+def test_des():
+    cipher = DES(unhex('133457799bbcdff1'))
+    assert crypt(cipher, unhex('0123456789abcdef'), True) == unhex('85e813540f0ab405')
+    assert crypt(cipher, unhex('85e813540f0ab405'), False) == unhex('0123456789abcdef')
+
+    # DESede with three times the same key is DES
+    iv = unhex('0001020304050607')
+    data = crypt(TripleDES(unhex('133457799bbcdff1') * 3), b'sixteen bytes!!!', True, iv)
+    assert data == crypt(cipher, b'sixteen bytes!!!', True, iv)
+    assert crypt(TripleDES(unhex('133457799bbcdff1') * 3), data, False, iv) == b'sixteen bytes!!!'
+
+
+@pytest.mark.parametrize('compiled', [False, True])
+def test_cipher(compiled):
+    emu = Emulator(exit=False)
+    args = {'p0': 'SaEcOZ2TrO683BP265Zhlw==', 'p1': 'fedcba9876543210', 'p2': 'AES/CBC/PKCS5Padding'}
+    assert emu.run_source(SOURCE, args, method='decrypt', compiled=compiled) == 'attack at dawn'
+
+    # data encrypted with another key isn't properly padded once decrypted
+    with pytest.raises(EmulationError):
+        emu.run_source(SOURCE, dict(args, p0='kgSm6Cp/wO0dF1RTAKI23w=='), method='decrypt', compiled=compiled)
+    with pytest.raises(EmulationError):
+        emu.run_source(SOURCE, dict(args, p2='AES/GCM/NoPadding'), method='decrypt', compiled=compiled)
+
+
+@pytest.mark.parametrize('algorithm, expected', [
+    ('MD5', 'XUFAKrxLKna5cZ2REBfFkg=='),
+    ('SHA-256', 'LPJNul+wow4m6DsqxbninhsWHlwfp0JecwQzYpOLmCQ='),
+])
+def test_message_digest(algorithm, expected):
+    emu = Emulator(exit=False)
+    assert emu.run_source(SOURCE, {'p0': 'hello', 'p1': algorithm}, method='hash') == expected
+
+
+def test_inflater():
+    emu = Emulator(exit=False)
+    assert emu.run_source(SOURCE, {'p0': COMPRESSED}, method='inflate') == 'hello hello hello'
+    assert emu.run_source(SOURCE, {'p0': COMPRESSED[:8]}, method='inflate') == 'truncated'
+
+
+def test_padding():
+    assert unpad(pad(b'attack at dawn', 16), 16) == b'attack at dawn'
+    assert len(pad(b'sixteen bytes!!!', 16)) == 32
+    with pytest.raises(BadPadding):
+        unpad(b'attack at dawn\x03\x02', 16)
@@ -0,0 +1,128 @@
+import os
+
+import pytest
+
+from smali.emulator import Emulator
+from smali.loader import ClassLoader, MethodNotFound
+
+
+FILENAME = os.path.join(os.path.dirname(__file__), 'data', 'methods.smali')
+
+
+def test_methods_index():
+    klass = ClassLoader().load_file(FILENAME)
+    assert klass.name == 'Lcom/example/Methods;'
+    assert [method.signature for method in klass.methods] == [
+        'answer()I', 'twice(I)I', 'sum(II)I', 'sum(III)I', 'fill(I)[I', 'calls(I)I', 'factorial(I)I', 'safe(I)I',
+        'spin(I)I', 'spinning()I'
+    ]
+    assert [method.registers for method in klass.methods] == [1, 2, 3, 4, 3, 3, 2, 2, 2, 1]
+    assert all(method.static for method in klass.methods)
+
+    method = klass.method('twice')
+    assert klass.lines[method.start].strip() == '.method public static twice(I)I'
+    assert klass.lines[method.end - 1].strip() == '.end method'
+    assert all(method.program is None for method in klass.methods)
+
+
+def test_methods_lookup():
+    klass = ClassLoader().load_file(FILENAME)
+    assert klass.method('sum').signature == 'sum(II)I'
+    assert klass.method('sum(III)I').signature == 'sum(III)I'
+    with pytest.raises(MethodNotFound):
+        klass.method('missing')
+
+
+def test_run_method():
+    emu = Emulator()
+    assert emu.run_file(FILENAME, {'p0': 21}, method='twice') == 42
+    assert emu.run_file(FILENAME, {'p0': 1, 'p1': 2}, method='sum') == 3
+    assert emu.run_file(FILENAME, {'p0': 1, 'p1': 2, 'p2': 3}, method='sum(III)I') == 6
+    assert emu.vm.variables.copy() == {'v0': 6, 'v1': 1, 'v2': 2, 'v3': 3, 'p0': 1, 'p1': 2, 'p2': 3}
+
+    # only the methods which were run are decoded
+    klass = emu.loader.load_file(FILENAME)
+    assert [method.program is not None for method in klass.methods] == [False, True, True, True, False, False, False, False, False, False]
+
+
+def test_run_method_again():
+    emu = Emulator()
+    assert emu.run_file(FILENAME, {'p0': 0}, method='fill').tolist() == [2, 2, 3]
+    program = emu.loader.load_file(FILENAME).method('fill').program
+    assert emu.run_file(FILENAME, {'p0': 2}, method='fill', compiled=True).tolist() == [1, 2, 4]
+    assert emu.loader.load_file(FILENAME).method('fill').program is program
+
+
+def test_reused_vm():
+    emu = Emulator()
+    vm = emu.vm
+    assert emu.run_file(FILENAME, {'p0': 21}, method='twice') == 42
+    program = vm.program
+    registers = vm.regs
+
+    assert vm.reset() is vm
+    assert vm.program is None and vm.code == [] and vm.regs == {} and vm.stop is False
+    # the containers of the program and of the previous run are left untouched
+    assert len(program.code) == 3 and registers[program.slots['v0']] == 42
+
+    assert emu.run_file(FILENAME, {'p0': 1, 'p1': 2}, method='sum') == 3
+    assert emu.vm is vm
+
+
+def test_vms_in_use():
+    emu = Emulator()
+    klass = emu.loader.load_file(FILENAME)
+    runs = emu.run_many(klass.method('twice'), [{'p0': 1}, {'p0': 2}])
+    assert next(runs)[0] == 2
+
+    # the VM of the generator isn't reused by the other runs
+    assert emu.run_method(klass.method('sum'), {'p0': 7, 'p1': 9}) == 16
+    assert next(runs)[0] == 4
+
+    first = emu.prepare(klass.method('twice'), {'p0': 5})
+    second = emu.prepare(klass.method('twice'), {'p0': 6})
+    assert first is not second
+    assert first.variables['p0'] == 5 and second.variables['p0'] == 6
+    assert emu.run_method(klass.method('twice'), {'p0': 8}) == 16
+    assert first.variables['p0'] == 5
+
+
+def test_shared_tables():
+    first, second = Emulator(), Emulator()
+    assert first.opcodes is second.opcodes
+    # the models of the java classes are not, they're per emulator
+    assert first.vm.mapping.mapping is not second.vm.mapping.mapping
+    assert [opcode.__class__.__name__ for opcode in first.opcodes] == sorted(first.table.by_name)
+
+
+def test_run_method_lines():
+    emu = Emulator()
+    for name in ('twice', 'safe'):
+        emu.run_file(FILENAME, {'p0': 1}, method=name)
+        method = emu.loader.load_file(FILENAME).method(name)
+        code = emu.vm.code[:-1]
+        assert all(method.start < insn.index < method.end for insn in code)
+        assert [insn.line for insn in code] == [method.klass.lines[insn.index].strip() for insn in code]
+        assert emu.vm.code[-1].index == method.end
+
+
+@pytest.mark.parametrize('compiled', [False, True])
+def test_invoke_methods(compiled):
+    emu = Emulator()
+    assert emu.run_file(FILENAME, {'p0': 5}, method='calls', compiled=compiled) == 57
+    assert emu.run_file(FILENAME, {'p0': 10}, method='factorial', compiled=compiled) == 3628800
+    assert emu.stats.steps == 10 * 5 + 3
+    assert emu.vm.frames == []
+    # one frame for every level of recursion, reused by the next run
+    assert len(emu.vm.pool) == 10
+    program = emu.loader.load_file(FILENAME).method('factorial').program
+    assert len(program.free) == 10
+    assert all(regs == list(program.blank) for regs, slots in program.free)
+
+
+@pytest.mark.parametrize('compiled', [False, True])
+def test_invoke_exception(compiled):
+    emu = Emulator()
+    assert emu.run_file(FILENAME, {'p0': 1}, method='safe', compiled=compiled) == 0
+    assert emu.run_file(FILENAME, {'p0': 5}, method='safe', compiled=compiled) == -1
+    assert emu.vm.exceptions == []
@@ -0,0 +1,108 @@
+import pytest
+
+from smali.emulator import Emulator, EmulationError
+from smali.object_mapping import ObjectMapping, UNRESOLVED
+
+
+SOURCE = """
+.class public Lcom/example/Chars;
+.super Ljava/lang/Object;
+
+.method public static sum(Ljava/lang/String;)I
+    .locals 3
+
+    const/4 v0, 0x0
+
+    const/4 v1, 0x0
+
+    :loop
+    invoke-virtual {p0}, Ljava/lang/String;->length()I
+
+    move-result v2
+
+    if-ge v1, v2, :done
+
+    invoke-virtual {p0, v1}, Ljava/lang/String;->charAt(I)C
+
+    move-result v2
+
+    invoke-static {v2}, Lcom/example/Chars;->code(C)I
+
+    move-result v2
+
+    add-int v0, v0, v2
+
+    add-int/lit8 v1, v1, 0x1
+
+    goto :loop
+
+    :done
+    return v0
+.end method
+
+.method public static code(C)I
+    .locals 1
+
+    const/4 v0, 0x1
+
+    return v0
+.end method
+
+.method public static missing()I
+    .locals 1
+
+    invoke-static {}, Ljava/lang/Math;->random()D
+
+    move-result v0
+
+    return v0
+.end method
+""".split('\n')
+
+
+@pytest.fixture
+def resolved(monkeypatch):
+    """Signatures of the mapped methods, every time one is looked up."""
+    names = []
+    method = ObjectMapping.method
+
+    def counted(self, vm, klass, method_name):
+        names.append(method_name)
+        return method(self, vm, klass, method_name)
+
+    monkeypatch.setattr(ObjectMapping, 'method', counted)
+    return names
+
+
+@pytest.mark.parametrize('fusion', [False, True])
+@pytest.mark.parametrize('compiled', [False, True])
+def test_call_sites_resolved_once(resolved, fusion, compiled):
+    emu = Emulator(exit=False, fusion=fusion)
+    assert emu.run_source(SOURCE, {'p0': 'hello'}, method='sum', compiled=compiled) == 5
+    assert sorted(resolved) == ['charAt(I)C', 'length()I']
+
+    # the sites keep their target for the next runs of the same program
+    assert emu.run_method(emu.vm.klass.method('sum'), {'p0': 'abc'}, compiled=compiled) == 3
+    assert len(resolved) == 2
+
+
+def test_unresolved_call_site():
+    emu = Emulator(exit=False, fusion=False)
+    with pytest.raises(EmulationError):
+        emu.run_source(SOURCE, method='missing')
+
+    site = emu.vm.klass.method('missing').program.code[0].args[1]
+    assert repr(site) == 'Ljava/lang/Math;->random()D'
+    assert site.owner is UNRESOLVED and site.target is None
+
+
+def test_mapping_per_emulator():
+    source = ['new-instance v0, Lcom/example/Model;', 'return-object v0']
+    emu, other = Emulator(exit=False), Emulator(exit=False)
+    assert emu.mapping is not other.mapping and emu.vm.mapping is emu.mapping
+
+    emu.mapping.mapping['com.example.Model'] = {'new-instance': dict}
+    assert emu.run_source(source) == {}
+    with pytest.raises(EmulationError):
+        other.run_source(source)
+    assert 'com.example.Model' not in ObjectMapping().mapping
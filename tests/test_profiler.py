@@ -0,0 +1,82 @@
+import os
+import marshal
+import pstats
+
+import pytest
+
+from smali.emulator import Emulator
+from smali.profiler import Profiler, SOURCE
+
+
+FILENAME = os.path.join(os.path.dirname(__file__), 'data', 'methods.smali')
+
+FACTORIAL = 'Lcom/example/Methods;->factorial(I)I'
+
+
+class Clock(object):
+    """Timer advancing by one microsecond on every reading."""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        self.now += 0.000001
+        return self.now
+
+
+@pytest.mark.parametrize('compiled', [False, True])
+def test_profile_method(compiled):
+    profiler = Profiler()
+    emu = Emulator(profiler=profiler)
+    assert emu.run_file(FILENAME, {'p0': 5}, method='factorial', compiled=compiled) == 120
+    assert emu.stats.steps == 5 * 5 + 3
+    assert profiler.stack == []
+
+    key = next(key for key in profiler.functions if key[2] == FACTORIAL)
+    method = emu.loader.load_file(FILENAME).method('factorial')
+    assert key == (FILENAME, method.start + 1, FACTORIAL)
+    calls, primitive, own, cumulative = profiler.functions[key]
+    assert (calls, primitive) == (6, 1)
+    assert sum(count for count, elapsed in profiler.opcodes.values()) == emu.stats.steps
+    assert all(method.start < line < method.end for function, line in profiler.lines)
+    # recursive calls invoke the method from itself
+    assert profiler.callers[(key, key)][:2] == [5, 0]
+
+
+def test_profile_collapsed():
+    profiler = Profiler()
+    emu = Emulator(profiler=profiler)
+    emu.run_file(FILENAME, {'p0': 2}, method='factorial')
+    stacks = dict(line.rsplit(' ', 1) for line in profiler.collapsed(counts=True))
+    assert sum(int(count) for count in stacks.values()) == 2 * 5 + 3
+    assert max(stack.count(';') for stack in stacks) == 3
+    assert all(stack.startswith('com/example/Methods.factorial(I)I;') for stack in stacks)
+
+
+def test_profile_pstats(tmpdir):
+    profiler = Profiler(timer=Clock())
+    emu = Emulator(profiler=profiler)
+    emu.run_file(FILENAME, {'p0': 5}, method='calls')
+
+    filename = str(tmpdir.join('calls.prof'))
+    profiler.dump_stats(filename)
+    with open(filename, 'rb') as fd:
+        assert marshal.load(fd) == profiler.stats
+
+    stats = pstats.Stats(filename)
+    names = set(key[2] for key in stats.stats)
+    assert 'Lcom/example/Methods;->calls(I)I' in names
+    assert 'op_Invoke+op_MoveResult' in names or 'op_Invoke' in names
+    assert pstats.Stats(profiler).total_calls == stats.total_calls
+
+    # the time of the run is split between the opcodes and the methods, without overlapping
+    cumulative = next(entry[3] for key, entry in profiler.functions.items() if key[2].endswith('calls(I)I'))
+    assert abs(stats.total_tt - cumulative) < 1e-9
+
+
+def test_profile_source():
+    profiler = Profiler()
+    emu = Emulator(profiler=profiler)
+    emu.run_file(FILENAME)
+    assert list(profiler.functions) == [SOURCE]
+    assert set(function for function, line in profiler.lines) == set([SOURCE])
+    assert 'op_Const' in profiler.report()
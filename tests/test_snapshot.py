@@ -0,0 +1,165 @@
+import pytest
+
+from smali.emulator import Emulator
+from smali.loader import SmaliClass
+from smali.vm import Frame
+
+
+SOURCE = """
+.class public Lcom/example/Prefix;
+.super Ljava/lang/Object;
+
+.field private static count:I
+
+.method public static lookup(I)I
+    .locals 3
+
+    const/16 v0, 0x10
+
+    new-array v0, v0, [I
+
+    const/4 v1, 0x0
+
+    :fill
+    const/16 v2, 0x10
+
+    if-ge v1, v2, :input
+
+    mul-int/lit8 v2, v1, 0x3
+
+    aput v2, v0, v1
+
+    add-int/lit8 v1, v1, 0x1
+
+    goto :fill
+
+    :input
+    aget v1, v0, p0
+
+    const/4 v2, 0x0
+
+    aput v2, v0, p0
+
+    return v1
+.end method
+
+.method public static greet(Ljava/lang/String;Ljava/lang/String;)Ljava/lang/String;
+    .locals 1
+
+    new-instance v0, Ljava/lang/StringBuilder;
+
+    invoke-direct {v0}, Ljava/lang/StringBuilder;-><init>()V
+
+    invoke-virtual {v0, p0}, Ljava/lang/StringBuilder;->append(Ljava/lang/String;)Ljava/lang/StringBuilder;
+
+    :input
+    invoke-virtual {v0, p1}, Ljava/lang/StringBuilder;->append(Ljava/lang/String;)Ljava/lang/StringBuilder;
+
+    invoke-virtual {v0}, Ljava/lang/StringBuilder;->toString()Ljava/lang/String;
+
+    move-result-object v0
+
+    return-object v0
+.end method
+
+.method public static count()I
+    .locals 1
+
+    const/4 v0, 0x0
+
+    :input
+    sget v0, Lcom/example/Prefix;->count:I
+
+    add-int/lit8 v0, v0, 0x1
+
+    sput v0, Lcom/example/Prefix;->count:I
+
+    return v0
+.end method
+""".split('\n')
+
+
+def prefix(emu, name, args):
+    """Run a method up to its :input label."""
+    vm = emu.prepare(SmaliClass(list(SOURCE)).method(name), args)
+    while vm.pc != vm.labels[':input']:
+        emu.step(vm, 1)
+    return vm
+
+
+def test_restore():
+    emu = Emulator(exit=False)
+    vm = prefix(emu, 'lookup', {'p0': 0})
+    snapshot = vm.snapshot()
+    for index in (3, 5, 3, 0):
+        vm.restore(snapshot)
+        vm.variables['p0'] = index
+        emu.interpret(vm)
+        # the store of every run is undone by the next restore
+        assert vm.return_v == index * 3
+        assert vm.variables['v0'][index] == 0
+
+    assert snapshot.regs[snapshot.slots['v0']].tolist() == [n * 3 for n in range(16)]
+    assert snapshot.pc == vm.labels[':input']
+
+
+def test_fork():
+    emu = Emulator(exit=False)
+    vm = prefix(emu, 'lookup', {'p0': 2})
+    child = vm.fork()
+    assert child is not vm and child.pc == vm.pc and child.emu is emu
+
+    emu.interpret(child)
+    assert child.return_v == 6 and child.variables['v0'][2] == 0
+    assert vm.stop is False and vm.variables['v0'][2] == 6
+
+    emu.interpret(vm)
+    assert vm.return_v == 6
+
+
+def test_static_fields():
+    emu = Emulator(exit=False)
+    vm = prefix(emu, 'count', {})
+    snapshot = vm.snapshot()
+    for _ in range(3):
+        emu.interpret(vm.restore(snapshot))
+        # the store of every run is undone by the next restore
+        assert vm.return_v == 1
+
+    child = vm.restore(snapshot).fork()
+    emu.interpret(child)
+    assert child.return_v == 1 and child.klass is not vm.klass
+    emu.interpret(vm)
+    assert vm.return_v == 1 and vm.klass.fields['Lcom/example/Prefix;->count:I'] == 1
+
+
+def test_objects():
+    emu = Emulator(exit=False)
+    vm = prefix(emu, 'greet', {'p0': 'hello ', 'p1': ''})
+    snapshot = vm.snapshot()
+    for name in ('world', 'there'):
+        vm.restore(snapshot)
+        vm.variables['p1'] = name
+        emu.interpret(vm)
+        assert vm.return_v == 'hello ' + name
+
+
+def test_shared_values():
+    emu = Emulator(exit=False)
+    vm = prefix(emu, 'lookup', {'p0': 0})
+    vm.variables['v2'] = vm.variables['v0']
+    vm.exceptions.append(ValueError())
+
+    restored = vm.fork().restore(vm.snapshot())
+    assert restored.variables['v2'] is restored.variables['v0']
+    assert restored.variables['v0'] is not vm.variables['v0']
+    assert restored.exceptions == vm.exceptions and restored.exceptions is not vm.exceptions
+    assert restored.array_data is vm.array_data and restored.code is vm.code
+
+
+def test_invoked_method():
+    emu = Emulator(exit=False)
+    vm = prefix(emu, 'lookup', {'p0': 0})
+    vm.frames.append(Frame())
+    with pytest.raises(ValueError):
+        vm.snapshot()
@@ -0,0 +1,148 @@
+import pytest
+
+from smali.emulator import Emulator, EmulationError
+from smali.loader import SmaliClass, default_value
+
+
+SOURCE = """
+.class public Lcom/example/Table;
+.super Ljava/lang/Object;
+
+.field private static runs:I
+
+.field private static table:[I
+
+.field public static final size:I = 0x10
+
+.field private key:I
+
+.method static constructor <clinit>()V
+    .locals 3
+
+    sget v0, Lcom/example/Table;->runs:I
+
+    add-int/lit8 v0, v0, 0x1
+
+    sput v0, Lcom/example/Table;->runs:I
+
+    sget v0, Lcom/example/Table;->size:I
+
+    new-array v0, v0, [I
+
+    const/4 v1, 0x0
+
+    :loop
+    sget v2, Lcom/example/Table;->size:I
+
+    if-ge v1, v2, :done
+
+    mul-int/lit8 v2, v1, 0x3
+
+    aput v2, v0, v1
+
+    add-int/lit8 v1, v1, 0x1
+
+    goto :loop
+
+    :done
+    sput-object v0, Lcom/example/Table;->table:[I
+
+    return-void
+.end method
+
+.method public static lookup(I)I
+    .locals 1
+
+    sget-object v0, Lcom/example/Table;->table:[I
+
+    aget v0, v0, p0
+
+    return v0
+.end method
+""".split('\n')
+
+FAILING = """
+.class public Lcom/example/Failing;
+.super Ljava/lang/Object;
+
+.field private static runs:I
+
+.method static constructor <clinit>()V
+    .locals 1
+
+    sget v0, Lcom/example/Failing;->runs:I
+
+    add-int/lit8 v0, v0, 0x1
+
+    sput v0, Lcom/example/Failing;->runs:I
+
+    div-int/lit8 v0, v0, 0x0
+
+    return-void
+.end method
+
+.method public static runs()I
+    .locals 1
+
+    sget v0, Lcom/example/Failing;->runs:I
+
+    return v0
+.end method
+""".split('\n')
+
+
+def test_declared_fields():
+    klass = SmaliClass(SOURCE)
+    assert klass.fields == {
+        'Lcom/example/Table;->runs:I': 0,
+        'Lcom/example/Table;->table:[I': None,
+        'Lcom/example/Table;->size:I': 16,
+    }
+    assert not klass.initialized
+
+
+@pytest.mark.parametrize('descriptor, literal, value', [
+    ('B', '-0x5t', -5),
+    ('S', '0x1s', 1),
+    ('J', '0x10L', 16),
+    ('F', '1.5f', 1.5),
+    ('D', '-2.0', -2.0),
+    ('Z', 'true', 1),
+    ('C', "'a'", 97),
+    ('Ljava/lang/String;', '"key\\n"', 'key\n'),
+    ('Ljava/lang/String;', 'null', None),
+])
+def test_default_value(descriptor, literal, value):
+    assert default_value(descriptor, literal) == value
+
+
+def test_unsupported_value():
+    with pytest.raises(ValueError):
+        default_value('Ljava/lang/Class;', 'Ljava/lang/Object;')
+
+
+@pytest.mark.parametrize('compiled', [False, True])
+def test_clinit_runs_once(compiled):
+    klass = SmaliClass(SOURCE)
+    lookup = klass.method('lookup')
+    emu = Emulator(exit=False)
+    assert emu.run_method(lookup, {'p0': 5}, compiled=compiled) == 15
+    assert emu.run_method(lookup, {'p0': 7}, compiled=compiled) == 21
+
+    # the fields belong to the class, not to the VM or the emulator
+    assert Emulator(exit=False).run_method(lookup, {'p0': 15}, compiled=compiled) == 45
+    assert [result for result, steps in emu.run_many(lookup, [{'p0': 1}, {'p0': 2}], compiled=compiled)] == [3, 6]
+    assert klass.fields['Lcom/example/Table;->runs:I'] == 1
+    assert 'Lcom/example/Table;->table:[I' not in emu.vm.variables
+
+
+def test_failed_clinit():
+    klass = SmaliClass(FAILING)
+    emu = Emulator(exit=False)
+    for _ in range(2):
+        with pytest.raises(EmulationError):
+            emu.run_method(klass.method('runs'))
+
+        # the initializer runs again on the next access
+        assert not klass.initialized
+        assert klass.fields == {'Lcom/example/Failing;->runs:I': 0}
@@ -0,0 +1,174 @@
+import array
+
+import pytest
+
+from smali.emulator import Emulator, EmulationError
+from smali.vectorize import VectorLoop, Run, MIN_ITERATIONS
+
+
+SOURCE = """
+.class public Lcom/example/Loops;
+.super Ljava/lang/Object;
+
+.method public static xor([B[B)[B
+    .locals 5
+
+    array-length v0, p0
+
+    new-array v4, v0, [B
+
+    const/4 v1, 0x0
+
+    :loop
+    if-ge v1, v0, :done
+
+    aget-byte v2, p0, v1
+
+    array-length v3, p1
+
+    rem-int v3, v1, v3
+
+    aget-byte v3, p1, v3
+
+    xor-int/2addr v2, v3
+
+    int-to-byte v2, v2
+
+    aput-byte v2, v4, v1
+
+    add-int/lit8 v1, v1, 0x1
+
+    goto :loop
+
+    :done
+    return-object v4
+.end method
+
+.method public static decode(Ljava/lang/String;)Ljava/lang/String;
+    .locals 4
+
+    invoke-virtual {p0}, Ljava/lang/String;->toCharArray()[C
+
+    move-result-object v0
+
+    const/4 v1, 0x0
+
+    :loop
+    array-length v3, v0
+
+    if-ge v1, v3, :done
+
+    aget-char v2, v0, v1
+
+    xor-int/lit8 v2, v2, 0x7
+
+    int-to-char v2, v2
+
+    aput-char v2, v0, v1
+
+    add-int/lit8 v1, v1, 0x1
+
+    goto :loop
+
+    :done
+    new-instance v1, Ljava/lang/String;
+
+    invoke-direct {v1, v0}, Ljava/lang/String;-><init>([C)V
+
+    return-object v1
+.end method
+
+.method public static sum([I)I
+    .locals 4
+
+    const/4 v0, 0x0
+
+    const/4 v1, 0x0
+
+    :loop
+    array-length v3, p0
+
+    if-ge v1, v3, :done
+
+    aget v2, p0, v1
+
+    add-int v0, v0, v2
+
+    add-int/lit8 v1, v1, 0x1
+
+    goto :loop
+
+    :done
+    return v0
+.end method
+""".split('\n')
+
+
+def run(method, args, **kwargs):
+    emu = Emulator(exit=False, **kwargs)
+    result = emu.run_source(SOURCE, args, method=method)
+    return result, emu.vm.variables.copy(), emu.stats.steps, emu.stats.fused
+
+
+def vectorized(method, args):
+    emu = Emulator(exit=False)
+    emu.run_source(SOURCE, args, method=method)
+    return [insn.eval for insn in emu.vm.code].count(VectorLoop.eval)
+
+
+@pytest.mark.parametrize('size', [1, MIN_ITERATIONS, 1000])
+def test_xor(size):
+    data = array.array('b', [(n * 7) % 256 - 128 for n in range(size)])
+    key = array.array('b', [-3, 17, 120, 0, -128])
+    expected = [(value ^ key[n % len(key)]) for n, value in enumerate(data)]
+
+    result = run('xor', {'p0': data, 'p1': key})
+    assert result[0].tolist() == expected
+    assert result == run('xor', {'p0': data, 'p1': key}, vectorize=False)
+
+
+def test_decode():
+    text = ''.join(chr(ord(c) ^ 7) for c in 'vectorized loops decode strings') * 3
+    result = run('decode', {'p0': text})
+    assert result[0] == 'vectorized loops decode strings' * 3
+    assert result == run('decode', {'p0': text}, vectorize=False)
+    assert run('decode', {'p0': text}, fusion=False) == run('decode', {'p0': text}, fusion=False, vectorize=False)
+
+
+def test_carried():
+    values = array.array('i', range(100))
+    assert run('sum', {'p0': values}) == run('sum', {'p0': values}, vectorize=False)
+    assert vectorized('sum', {'p0': values}) == 0
+
+
+def test_mixed_values():
+    # chars xor-ed by their code, integers truncated by the byte array
+    data = [n * 1000 for n in range(50)]
+    key = ['k', 'e', 'y']
+    result = run('xor', {'p0': data, 'p1': key})
+    assert result[0].tolist() == [((n * 1000) ^ ord(key[n % 3]) + 128) % 256 - 128 for n in range(50)]
+    assert result == run('xor', {'p0': data, 'p1': key}, vectorize=False)
+
+
+def test_fallback():
+    data = array.array('b', range(64))
+    key = array.array('b', [1, 2])
+    expected = run('xor', {'p0': data, 'p1': key}, vectorize=False)
+    # budgeted runs are interpreted, so are the loops on values the interpreter can't mimic
+    assert run('xor', {'p0': data, 'p1': key}, max_steps=10 ** 6) == expected
+    with pytest.raises(EmulationError):
+        run('xor', {'p0': data, 'p1': [1, 'ab']})
+
+
+def test_vectorized(monkeypatch):
+    pytest.importorskip('numpy')
+    assert vectorized('xor', {'p0': array.array('b', [0]), 'p1': array.array('b', [1])}) == 1
+    assert vectorized('decode', {'p0': 'a'}) == 1
+
+    runs = []
+    commit = Run.commit
+    monkeypatch.setattr(Run, 'commit', lambda self, vm: runs.append(self.count) or commit(self, vm))
+    run('xor', {'p0': array.array('b', range(100)), 'p1': array.array('b', [1, 2])})
+    run('xor', {'p0': array.array('b', range(MIN_ITERATIONS - 1)), 'p1': array.array('b', [1, 2])})
+    run('decode', {'p0': 'x' * 50})
+    assert runs == [100, 50]
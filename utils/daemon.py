@@ -0,0 +1,64 @@
+#!/usr/bin/env python2
+
+"""Smali Emulator Daemon.
+
+Usage:
+    daemon.py -a address [-d Directory] [-w workers] [-n tasks] [-l classes] [-c cacheDirectory] [-s steps] [-t seconds] [--public]
+
+Options:
+    -h --help        Show this screen.
+    -a <address>     The path of the Unix domain socket, or the host:port pair, to listen on ( 127.0.0.1 if the host is omitted ).
+    -d <directory>   The apktool output directory, or a directory of smali files.
+    -w <workers>     Number of worker processes, the number of CPUs by default.
+    -n <tasks>       Replace every worker process after this many jobs.
+    -l <classes>     Number of classes every worker keeps loaded, unbounded by default.
+    -c <directory>   Cache the preprocessed programs in this directory.
+    -s <steps>       Stop every job after this many steps.
+    -t <seconds>     Stop every job after this many seconds.
+    --public         Allow listening on a host other than the loopback interface, any peer can then run jobs.
+
+Requests and responses are JSON objects preceded by their length, as a 32 bits big
+endian integer. Requests hold the "class" descriptor ( or the smali "file" path, inside
+the directory ), the "method" name and its "args", responses the "result" and "steps" or
+the "error".
+See smali.client for a client library.
+"""
+
+from __future__ import print_function
+
+from docopt import docopt
+import smali.loader
+import smali.server
+
+
+def main(arguments):
+    directory = arguments.get('-d')
+    workers = arguments.get('-w')
+    tasks = arguments.get('-n')
+    classes = arguments.get('-l')
+    steps = arguments.get('-s')
+    seconds = arguments.get('-t')
+    daemon = smali.server.Daemon(
+        arguments.get('-a'),
+        smali.loader.search_paths(directory) if directory else [],
+        workers=int(workers) if workers else None,
+        capacity=int(classes) if classes else None,
+        tasks=int(tasks) if tasks else None,
+        cache=arguments.get('-c'),
+        max_steps=int(steps) if steps else None,
+        deadline=float(seconds) if seconds else None,
+        public=arguments.get('--public'),
+    )
+    if arguments.get('--public'):
+        print("WARNING: listening on a public address, any peer reaching it can run jobs.")
+    print("listening on %s" % (daemon.address,))
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
+
+
+if __name__ == '__main__':
+    main(docopt(__doc__))
@@ -3,7 +3,8 @@
 """Exec Smali Files.
 
 Usage:
-    exec.py -i File.smali -m methodName [-p methodParameters]
+    exec.py -i File.smali -m methodName [-p methodParameters] [-c cacheDirectory] [-s steps] [-t seconds] [--pstats file] [--collapsed file]
+    exec.py -i File.smali -m methodName --stdin-jsonl [-c cacheDirectory] [-s steps] [-t seconds]
 
 Options:
     -h --help        Show this screen.
@@ -12,23 +13,75 @@ Options:
     -p <parameters>  A list of parameters to give as arguments.
                      If not provided, the script will introspect the method
                      and give insights about what parameters are expected.
+    -c <directory>   Cache the preprocessed program in this directory.
+    -s <steps>       Stop every run after this many steps.
+    -t <seconds>     Stop every run after this many seconds.
+    --pstats <file>     Profile the run and write the pstats data to this file.
+    --collapsed <file>  Profile the run and write the collapsed stacks, in microseconds,
+                        to this file, for flamegraph.pl.
+    --stdin-jsonl    Read one JSON object of parameters per line from the standard
+                     input and write one JSON result per line, in the same order,
+                     with "result" and "steps" or the "error".
 """
 
 from __future__ import unicode_literals
 
+import sys
+import json
+
 from docopt import docopt
 import smali.emulator
+import smali.batch
+import smali.cache
+import smali.profiler
 import ast
 
 
+def run_jsonl(emu, filename, method):
+    method = emu.loader.load_file(filename).method(method)
+    for line in iter(sys.stdin.readline, ''):
+        try:
+            parameters = json.loads(line)
+        except ValueError as e:
+            result = {'error': "ValueError: %s" % e}
+        else:
+            result = smali.batch.run_method(emu, method, parameters)
+        sys.stdout.write(json.dumps(result, sort_keys=True) + '\n')
+        sys.stdout.flush()
+
+
 def main(arguments):
     filename = arguments.get('-i')
+    method = arguments.get('-m')
     parameters = arguments.get('-p')
     parameters = ast.literal_eval(parameters) if parameters else {}
-    emu = smali.emulator.Emulator()
-    result = emu.run_file(filename, parameters)
+    cache = arguments.get('-c')
+    cache = smali.cache.ProgramCache(cache) if cache else None
+    steps = arguments.get('-s')
+    seconds = arguments.get('-t')
+    budget = {
+        'max_steps': int(steps) if steps else None,
+        'deadline': float(seconds) if seconds else None,
+    }
+    if arguments.get('--stdin-jsonl'):
+        run_jsonl(smali.emulator.Emulator(cache=cache, exit=False, **budget), filename, method)
+        return
+
+    pstats = arguments.get('--pstats')
+    collapsed = arguments.get('--collapsed')
+    profiler = smali.profiler.Profiler() if pstats or collapsed else None
+
+    emu = smali.emulator.Emulator(cache=cache, profiler=profiler, **budget)
+    result = emu.run_file(filename, parameters, method=method)
     print(result)
 
+    if profiler is not None:
+        print(profiler.report())
+        if pstats:
+            profiler.dump_stats(pstats)
+        if collapsed:
+            profiler.write_collapsed(collapsed)
+
 
 if __name__ == '__main__':
     main(docopt(__doc__))
@@ -14,6 +14,7 @@ Options:
 from docopt import docopt
 import smali.source
 import smali.emulator
+import smali.loader
 
 
 def main(arguments):
@@ -33,7 +34,9 @@ def inspect_exceptions(filename):
 
 def inspect_methods(filename):
     """Inspect methods in the smali file."""
-    raise NotImplemented()
+    klass = smali.loader.ClassLoader().load_file(filename)
+    for method in klass.methods:
+        print(' '.join(method.modifiers + [repr(method)]))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,59 @@
+#!/usr/bin/env python2
+
+"""Exec Smali Methods in Parallel.
+
+Usage:
+    pool.py -d Directory -j Jobs.jsonl [-w workers] [-n tasks] [-c cacheDirectory] [-s steps] [-t seconds]
+
+Options:
+    -h --help        Show this screen.
+    -d <directory>   The apktool output directory, or a directory of smali files.
+    -j <jobs>        The jobs file ( - for the standard input ), one JSON object per line
+                     with the "class" descriptor, the "method" name and its "args", like:
+                     {"class": "Lcom/example/Decryptor;", "method": "field5", "args": {"p1": 19}}
+    -w <workers>     Number of worker processes, the number of CPUs by default.
+    -n <tasks>       Replace every worker process after this many jobs.
+    -c <directory>   Cache the preprocessed programs in this directory.
+    -s <steps>       Stop every run after this many steps.
+    -t <seconds>     Stop every run after this many seconds.
+
+Results are printed as JSON lines in completion order, with the "index" of their job.
+"""
+
+from __future__ import print_function
+
+import sys
+import json
+
+from docopt import docopt
+import smali.batch
+import smali.loader
+
+
+def read_jobs(fd):
+    for line in fd:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def main(arguments):
+    paths = smali.loader.search_paths(arguments.get('-d'))
+    workers = arguments.get('-w')
+    tasks = arguments.get('-n')
+    steps = arguments.get('-s')
+    seconds = arguments.get('-t')
+    filename = arguments.get('-j')
+    fd = sys.stdin if filename == '-' else open(filename, 'r')
+
+    results = smali.batch.run_pool(paths, read_jobs(fd), workers=int(workers) if workers else None,
+                                   tasks=int(tasks) if tasks else None, cache=arguments.get('-c'),
+                                   max_steps=int(steps) if steps else None,
+                                   deadline=float(seconds) if seconds else None)
+    for result in results:
+        print(json.dumps(result, sort_keys=True))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main(docopt(__doc__))